@@ -1,14 +1,17 @@
 """
 API 依赖项
 """
-from fastapi import Depends, HTTPException
+import secrets
+
+from fastapi import Depends, HTTPException, Request
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlmodel import select
 
+from app.core.config import settings
 from app.core.database import get_session
 from app.core.security import decode_token
 from app.models.user import User
+from app.services.lookups import user_by_id
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/login")
 
@@ -26,10 +29,7 @@ async def get_current_user(
     if not user_id:
         raise HTTPException(status_code=401, detail="无效的认证凭据")
     
-    result = await session.execute(
-        select(User).where(User.id == int(user_id))
-    )
-    user = result.scalar_one_or_none()
+    user = await user_by_id(session, int(user_id))
     
     if not user:
         raise HTTPException(status_code=401, detail="用户不存在")
@@ -47,3 +47,18 @@ async def get_current_admin(
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="需要管理员权限")
     return current_user
+
+
+async def verify_metrics_access(
+    request: Request,
+    session: AsyncSession = Depends(get_session),
+) -> None:
+    """监控指标鉴权：优先校验 METRICS_TOKEN，否则要求管理员令牌"""
+    authorization = request.headers.get("Authorization", "")
+    token = authorization[7:].strip() if authorization.lower().startswith("bearer ") else ""
+
+    if settings.METRICS_TOKEN and secrets.compare_digest(token, settings.METRICS_TOKEN):
+        return
+
+    user = await get_current_user(token, session)
+    await get_current_admin(user)
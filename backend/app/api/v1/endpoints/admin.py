@@ -1,6 +1,8 @@
 """
 管理后台 API 端点
 """
+import json
+import logging
 from typing import Optional, List
 from datetime import datetime, timedelta
 from fastapi import APIRouter, Depends, HTTPException, Query
@@ -9,22 +11,37 @@ from sqlalchemy import delete
 from sqlmodel import select, func
 
 from app.core.database import get_session
+from app.core.replica import get_read_session
 from app.core.response import success, error
 from app.core.security import get_password_hash
 from app.api.deps import get_current_admin
 from app.models.user import User
-from app.models.license import License, LicenseHeartbeat
+from app.models.audit import AuditEvent
+from app.models.license import (
+    License, LicenseBinding, LicenseFlag, LicenseHeartbeat, LicensePresence, LicenseSeatLease,
+)
 from app.models.order import Order
 from app.models.promo import PromoCampaign
+from app.services.online import online
+from app.services.promo_cache import promo_cache
+from app.services.seat_leases import seat_leases
+from app.services.id_generator import generate_license_key
+from app.services import audit, bindings, license_events, verify_snapshot
+from app.services.audit import audit_log
+
+logger = logging.getLogger("zentea.admin")
 
 router = APIRouter()
 
+# 仪表盘在线统计中列出的在线安装最多的客户数
+ONLINE_TOP_CUSTOMERS = 10
+
 
 # ==================== 仪表盘 ====================
 
 @router.get("/dashboard")
 async def get_dashboard(
-    session: AsyncSession = Depends(get_session),
+    session: AsyncSession = Depends(get_read_session),
     _: User = Depends(get_current_admin),
 ):
     """获取仪表盘统计"""
@@ -67,6 +84,18 @@ async def get_dashboard(
     )
     expiring_soon = expiring_soon.scalar() or 0
     
+    # 实时在线安装数（最近 5/15/60 分钟，合并各 worker 的内存统计，见 services/online.py）
+    windows = await online.summary(session)
+    top = {
+        minutes: sorted(w["by_customer"].items(), key=lambda item: (-item[1], item[0]))[:ONLINE_TOP_CUSTOMERS]
+        for minutes, w in windows.items()
+    }
+    top_ids = {user_id for items in top.values() for user_id, _ in items}
+    users_map = {}
+    if top_ids:
+        users_result = await session.execute(select(User).where(User.id.in_(top_ids)))
+        users_map = {u.id: u for u in users_result.scalars().all()}
+    
     return success({
         "total_customers": total_customers,
         "licenses": {
@@ -74,7 +103,24 @@ async def get_dashboard(
             "pending": pending_count,
             "expired": expired_count,
             "expiring_soon": expiring_soon,
-        }
+        },
+        "online": {
+            f"{minutes}m": {
+                "total": w["total"],
+                "by_plan": w["by_plan"],
+                "customers": len(w["by_customer"]),
+                "top_customers": [
+                    {
+                        "user_id": user_id,
+                        "username": users_map[user_id].username if user_id in users_map else None,
+                        "company_name": users_map[user_id].company_name if user_id in users_map else None,
+                        "online": count,
+                    }
+                    for user_id, count in top[minutes]
+                ],
+            }
+            for minutes, w in windows.items()
+        },
     })
 
 
@@ -84,7 +130,7 @@ async def get_dashboard(
 async def get_customers(
     page: int = Query(1, ge=1),
     page_size: int = Query(20, ge=1, le=100),
-    session: AsyncSession = Depends(get_session),
+    session: AsyncSession = Depends(get_read_session),
     _: User = Depends(get_current_admin),
 ):
     """获取客户列表"""
@@ -129,7 +175,7 @@ async def get_customers(
 @router.get("/customers/{customer_id}")
 async def get_customer_detail(
     customer_id: int,
-    session: AsyncSession = Depends(get_session),
+    session: AsyncSession = Depends(get_read_session),
     _: User = Depends(get_current_admin),
 ):
     """获取客户详情"""
@@ -177,7 +223,7 @@ async def get_customer_detail(
 async def create_customer(
     data: dict,
     session: AsyncSession = Depends(get_session),
-    _: User = Depends(get_current_admin),
+    admin: User = Depends(get_current_admin),
 ):
     """创建客户"""
     username = (data.get("username") or "").strip()
@@ -203,6 +249,8 @@ async def create_customer(
         generated_password = f"ZT{uuid.uuid4().hex[:10]}"
         password = generated_password
 
+    # bcrypt 计算期间不占用数据库连接
+    await session.release()
     customer = User(
         username=username,
         email=email,
@@ -219,6 +267,7 @@ async def create_customer(
     session.add(customer)
     await session.commit()
     await session.refresh(customer)
+    audit_log.record(admin, "customer.create", "user", customer.id, after=audit.snapshot(customer, audit.CUSTOMER_FIELDS))
 
     return success(
         {
@@ -234,13 +283,14 @@ async def update_customer(
     customer_id: int,
     data: dict,
     session: AsyncSession = Depends(get_session),
-    _: User = Depends(get_current_admin),
+    admin: User = Depends(get_current_admin),
 ):
     """编辑客户"""
     result = await session.execute(select(User).where(User.id == customer_id, User.role == "customer"))
     customer = result.scalar_one_or_none()
     if not customer:
         return error("客户不存在", code=404)
+    before = audit.snapshot(customer, audit.CUSTOMER_FIELDS)
 
     # 用户名/邮箱变更需校验唯一性
     if "username" in data and data["username"] is not None:
@@ -272,6 +322,10 @@ async def update_customer(
     customer.updated_at = datetime.utcnow()
     session.add(customer)
     await session.commit()
+    audit_log.record(
+        admin, "customer.update", "user", customer.id,
+        before=before, after=audit.snapshot(customer, audit.CUSTOMER_FIELDS),
+    )
 
     return success({"id": customer.id}, "更新成功")
 
@@ -280,7 +334,7 @@ async def update_customer(
 async def delete_customer(
     customer_id: int,
     session: AsyncSession = Depends(get_session),
-    _: User = Depends(get_current_admin),
+    admin: User = Depends(get_current_admin),
 ):
     """删除客户（会同时清理其授权/订单/心跳记录）"""
     result = await session.execute(select(User).where(User.id == customer_id, User.role == "customer"))
@@ -289,18 +343,29 @@ async def delete_customer(
         return error("客户不存在", code=404)
 
     # 先清理关联数据，避免外键约束导致删除失败
-    lic_ids_res = await session.execute(select(License.id).where(License.user_id == customer_id))
-    license_ids = list(lic_ids_res.scalars().all())
+    lic_res = await session.execute(select(License.id, License.license_key).where(License.user_id == customer_id))
+    lic_rows = lic_res.all()
+    license_ids = [row.id for row in lic_rows]
 
     if license_ids:
         await session.execute(delete(LicenseHeartbeat).where(LicenseHeartbeat.license_id.in_(license_ids)))
+        await session.execute(delete(LicenseSeatLease).where(LicenseSeatLease.license_id.in_(license_ids)))
+        await session.execute(delete(LicenseBinding).where(LicenseBinding.license_id.in_(license_ids)))
+        await session.execute(delete(LicensePresence).where(LicensePresence.license_id.in_(license_ids)))
+        await session.execute(delete(LicenseFlag).where(LicenseFlag.license_id.in_(license_ids)))
         # 订单里可能引用 license_id，也可能仅按 user_id 关联，统一按 user_id 清理
 
     await session.execute(delete(Order).where(Order.user_id == customer_id))
     await session.execute(delete(License).where(License.user_id == customer_id))
 
+    before = audit.snapshot(customer, audit.CUSTOMER_FIELDS)
     await session.delete(customer)
     await session.commit()
+    verify_snapshot.record_removed(row.license_key for row in lic_rows)
+    audit_log.record(
+        admin, "customer.delete", "user", customer_id, before=before,
+        detail=f"同时删除授权 {len(lic_rows)} 个" if lic_rows else None,
+    )
 
     return success(None, "删除成功")
 
@@ -311,7 +376,7 @@ async def delete_customer(
 async def get_admins(
     page: int = Query(1, ge=1),
     page_size: int = Query(20, ge=1, le=100),
-    session: AsyncSession = Depends(get_session),
+    session: AsyncSession = Depends(get_read_session),
     _: User = Depends(get_current_admin),
 ):
     """获取管理员列表"""
@@ -349,7 +414,7 @@ async def get_admins(
 async def create_admin(
     data: dict,
     session: AsyncSession = Depends(get_session),
-    _: User = Depends(get_current_admin),
+    current_admin: User = Depends(get_current_admin),
 ):
     """创建管理员"""
     username = (data.get("username") or "").strip()
@@ -367,6 +432,8 @@ async def create_admin(
     if exists_email.scalar_one_or_none():
         return error("邮箱已被注册")
 
+    # bcrypt 计算期间不占用数据库连接
+    await session.release()
     admin = User(
         username=username,
         email=email,
@@ -379,6 +446,7 @@ async def create_admin(
     session.add(admin)
     await session.commit()
     await session.refresh(admin)
+    audit_log.record(current_admin, "admin.create", "user", admin.id, after=audit.snapshot(admin, audit.ADMIN_FIELDS))
 
     return success({"id": admin.id}, "创建成功")
 
@@ -395,6 +463,7 @@ async def update_admin(
     admin = result.scalar_one_or_none()
     if not admin:
         return error("管理员不存在", code=404)
+    before = audit.snapshot(admin, audit.ADMIN_FIELDS)
 
     if "username" in data and data["username"] is not None:
         new_username = str(data["username"]).strip()
@@ -423,6 +492,9 @@ async def update_admin(
     admin.updated_at = datetime.utcnow()
     session.add(admin)
     await session.commit()
+    audit_log.record(
+        current_admin, "admin.update", "user", admin.id, before=before, after=audit.snapshot(admin, audit.ADMIN_FIELDS),
+    )
 
     return success({"id": admin.id}, "更新成功")
 
@@ -448,8 +520,10 @@ async def delete_admin(
     if not admin:
         return error("管理员不存在", code=404)
 
+    before = audit.snapshot(admin, audit.ADMIN_FIELDS)
     await session.delete(admin)
     await session.commit()
+    audit_log.record(current_admin, "admin.delete", "user", admin_id, before=before)
 
     return success(None, "删除成功")
 
@@ -459,7 +533,7 @@ async def set_admin_password(
     admin_id: int,
     data: dict,
     session: AsyncSession = Depends(get_session),
-    _: User = Depends(get_current_admin),
+    current_admin: User = Depends(get_current_admin),
 ):
     """修改管理员密码（重置/改密）"""
     new_password = (data.get("new_password") or "").strip()
@@ -473,10 +547,13 @@ async def set_admin_password(
     if not admin:
         return error("管理员不存在", code=404)
 
+    # bcrypt 计算期间不占用数据库连接
+    await session.release()
     admin.hashed_password = get_password_hash(new_password)
     admin.updated_at = datetime.utcnow()
     session.add(admin)
     await session.commit()
+    audit_log.record(current_admin, "admin.password", "user", admin.id)
 
     return success({"id": admin.id}, "密码已更新")
 
@@ -488,10 +565,11 @@ async def get_licenses(
     page_size: int = Query(20, ge=1, le=100),
     status: Optional[str] = None,
     user_id: Optional[int] = None,
-    session: AsyncSession = Depends(get_session),
+    with_presence: bool = False,
+    session: AsyncSession = Depends(get_read_session),
     _: User = Depends(get_current_admin),
 ):
-    """获取授权列表"""
+    """获取授权列表（with_presence 时附带最近心跳等在线状态）"""
     offset = (page - 1) * page_size
     
     # 构建查询
@@ -525,6 +603,24 @@ async def get_licenses(
     )
     users_map = {u.id: u for u in users_result.scalars().all()}
     
+    # 在线状态在单独的窄表中，只在需要时查询
+    presence_map = {}
+    if with_presence and licenses:
+        presence_result = await session.execute(
+            select(LicensePresence).where(LicensePresence.license_id.in_([lic.id for lic in licenses]))
+        )
+        presence_map = {p.license_id: p for p in presence_result.scalars().all()}
+    
+    def _presence(lic: License) -> dict:
+        if not with_presence:
+            return {}
+        p = presence_map.get(lic.id)
+        return {
+            "last_heartbeat": p.last_heartbeat.isoformat() if p and p.last_heartbeat else None,
+            "last_ip": p.last_ip if p else None,
+            "heartbeat_count": p.heartbeat_count if p else 0,
+        }
+    
     return success({
         "items": [
             {
@@ -538,11 +634,13 @@ async def get_licenses(
                 "expire_date": lic.expire_date.isoformat() if lic.expire_date else None,
                 "machine_id": lic.machine_id,
                 "max_users": lic.max_users,
+                "max_machines": lic.max_machines,
                 "notes": lic.notes,
                 "user": {
                     "username": users_map[lic.user_id].username,
                     "company_name": users_map[lic.user_id].company_name,
                 } if lic.user_id in users_map else None,
+                **_presence(lic),
             }
             for lic in licenses
         ],
@@ -559,12 +657,11 @@ async def create_license(
     admin: User = Depends(get_current_admin),
 ):
     """创建授权"""
-    import uuid
-    
     user_id = int(data.get("user_id"))  # 确保是整数
     plan_type = data.get("plan_type", "yearly")
     expire_date_str = data.get("expire_date")
     max_users = data.get("max_users", 5)
+    max_machines = max(int(data.get("max_machines") or 1), 1)
     notes = data.get("notes")
     
     # 验证用户存在
@@ -588,7 +685,7 @@ async def create_license(
     # lifetime, promo_free, free_forever 无到期日期
     
     # 生成授权码
-    license_key = f"ZT-{plan_type.upper()[:3]}-{uuid.uuid4().hex[:16].upper()}"
+    license_key = generate_license_key(plan_type)
     
     # 创建授权
     license = License(
@@ -598,11 +695,13 @@ async def create_license(
         status="pending",
         expire_date=expire_date,
         max_users=max_users,
+        max_machines=max_machines,
         notes=notes,
     )
     session.add(license)
     await session.commit()
     await session.refresh(license)
+    audit_log.record(admin, "license.create", "license", license.id, after=audit.snapshot(license, audit.LICENSE_FIELDS))
     
     return success({
         "id": license.id,
@@ -616,7 +715,7 @@ async def extend_license(
     license_id: int,
     days: int = Query(..., ge=1),
     session: AsyncSession = Depends(get_session),
-    _: User = Depends(get_current_admin),
+    admin: User = Depends(get_current_admin),
 ):
     """续期授权"""
     result = await session.execute(
@@ -627,6 +726,8 @@ async def extend_license(
     if not license:
         return error("授权不存在")
     
+    before = audit.snapshot(license, audit.LICENSE_FIELDS)
+    
     # 计算新到期日期
     base_date = license.expire_date or datetime.utcnow()
     if base_date < datetime.utcnow():
@@ -639,6 +740,16 @@ async def extend_license(
         license.status = "active"
     
     await session.commit()
+    await verify_snapshot.record_license(session, license)
+    audit_log.record(
+        admin, "license.extend", "license", license.id,
+        before=before, after=audit.snapshot(license, audit.LICENSE_FIELDS), detail=f"续期 {days} 天",
+    )
+    
+    await license_events.hub.publish(
+        license_events.EVENT_EXTEND, license.id,
+        status=license.status, expire_date=license.expire_date.isoformat(),
+    )
     
     return success({
         "new_expire_date": license.expire_date.isoformat()
@@ -650,7 +761,7 @@ async def revoke_license(
     license_id: int,
     reason: Optional[str] = None,
     session: AsyncSession = Depends(get_session),
-    _: User = Depends(get_current_admin),
+    admin: User = Depends(get_current_admin),
 ):
     """吊销授权"""
     result = await session.execute(
@@ -661,11 +772,19 @@ async def revoke_license(
     if not license:
         return error("授权不存在")
     
+    before = audit.snapshot(license, audit.LICENSE_FIELDS)
     license.status = "revoked"
-    if reason:
-        license.notes = f"{license.notes or ''}\n[吊销原因] {reason}".strip()
+    await seat_leases.release_license(session, license.id)
     
     await session.commit()
+    await verify_snapshot.record_license(session, license)
+    # 吊销原因记入审计日志，不再追加到 notes
+    audit_log.record(
+        admin, "license.revoke", "license", license.id,
+        before=before, after=audit.snapshot(license, audit.LICENSE_FIELDS), detail=reason,
+    )
+    
+    await license_events.hub.publish(license_events.EVENT_REVOKE, license.id, status=license.status)
     
     return success(None, "已吊销")
 
@@ -673,10 +792,63 @@ async def revoke_license(
 @router.post("/licenses/{license_id}/unbind")
 async def unbind_license(
     license_id: int,
+    machine_id: Optional[str] = None,
     session: AsyncSession = Depends(get_session),
+    admin: User = Depends(get_current_admin),
+):
+    """解绑机器（指定 machine_id 时只解绑该设备，否则解绑全部设备）"""
+    result = await session.execute(
+        select(License).where(License.id == license_id)
+    )
+    license = result.scalar_one_or_none()
+    
+    if not license:
+        return error("授权不存在")
+    
+    removed = await bindings.unbind(session, license, machine_id)
+    if machine_id and not removed:
+        return error("该设备未绑定此授权")
+    await seat_leases.release_license(session, license.id, machine_id)
+    await session.commit()
+    await verify_snapshot.record_license(session, license)
+    audit_log.record(admin, "license.unbind", "license", license.id, detail="解绑设备: " + ", ".join(removed))
+    
+    await license_events.hub.publish(
+        license_events.EVENT_UNBIND, license.id, status=license.status, machine_id=machine_id,
+    )
+    
+    return success({"unbound": removed}, "已解绑")
+
+
+@router.get("/licenses/{license_id}/bindings")
+async def get_license_bindings(
+    license_id: int,
+    session: AsyncSession = Depends(get_read_session),
     _: User = Depends(get_current_admin),
 ):
-    """解绑机器"""
+    """授权的绑定设备列表（含最近验证时间）"""
+    result = await session.execute(
+        select(License.max_machines).where(License.id == license_id)
+    )
+    max_machines = result.scalar_one_or_none()
+    
+    if max_machines is None:
+        return error("授权不存在")
+    
+    return success({
+        "max_machines": max_machines,
+        "items": await bindings.list_bindings(session, license_id),
+    })
+
+
+@router.post("/licenses/{license_id}/max-machines")
+async def set_license_max_machines(
+    license_id: int,
+    max_machines: int = Query(..., ge=1),
+    session: AsyncSession = Depends(get_session),
+    admin: User = Depends(get_current_admin),
+):
+    """设置最大绑定设备数（已绑定的设备不受影响，超出部分需手动解绑）"""
     result = await session.execute(
         select(License).where(License.id == license_id)
     )
@@ -685,17 +857,179 @@ async def unbind_license(
     if not license:
         return error("授权不存在")
     
-    license.machine_id = None
+    before = audit.snapshot(license, audit.LICENSE_FIELDS)
+    license.max_machines = max_machines
     await session.commit()
+    audit_log.record(
+        admin, "license.max_machines", "license", license.id,
+        before=before, after=audit.snapshot(license, audit.LICENSE_FIELDS),
+    )
     
-    return success(None, "已解绑")
+    return success({"max_machines": max_machines}, "设置成功")
+
+
+# ==================== 授权共享告警 ====================
+
+@router.get("/license-flags")
+async def get_license_flags(
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=100),
+    status: Optional[str] = "open",
+    license_id: Optional[int] = None,
+    session: AsyncSession = Depends(get_read_session),
+    _: User = Depends(get_current_admin),
+):
+    """授权共享告警列表（见 services/sharing.py，默认只列出待处理的）"""
+    offset = (page - 1) * page_size
+    
+    query = select(LicenseFlag, License.license_key, License.user_id).outerjoin(
+        License, License.id == LicenseFlag.license_id
+    )
+    count_query = select(func.count()).select_from(LicenseFlag)
+    
+    if status:
+        query = query.where(LicenseFlag.status == status)
+        count_query = count_query.where(LicenseFlag.status == status)
+    
+    if license_id:
+        query = query.where(LicenseFlag.license_id == license_id)
+        count_query = count_query.where(LicenseFlag.license_id == license_id)
+    
+    result = await session.execute(
+        query.order_by(LicenseFlag.updated_at.desc())
+        .offset(offset)
+        .limit(page_size)
+    )
+    rows = result.all()
+    
+    total = await session.execute(count_query)
+    total = total.scalar() or 0
+    
+    user_ids = list(set(user_id for _, _, user_id in rows if user_id))
+    users_result = await session.execute(
+        select(User).where(User.id.in_(user_ids))
+    )
+    users_map = {u.id: u for u in users_result.scalars().all()}
+    
+    return success({
+        "items": [
+            {
+                "id": flag.id,
+                "license_id": flag.license_id,
+                "license_key": license_key,
+                "kind": flag.kind,
+                "observed": flag.observed,
+                "threshold": flag.threshold,
+                "window_seconds": flag.window_seconds,
+                "detail": flag.detail,
+                "status": flag.status,
+                "created_at": flag.created_at.isoformat(),
+                "updated_at": flag.updated_at.isoformat(),
+                "resolved_at": flag.resolved_at.isoformat() if flag.resolved_at else None,
+                "user": {
+                    "username": users_map[user_id].username,
+                    "company_name": users_map[user_id].company_name,
+                } if user_id in users_map else None,
+            }
+            for flag, license_key, user_id in rows
+        ],
+        "total": total,
+        "page": page,
+        "page_size": page_size,
+    })
+
+
+@router.post("/license-flags/{flag_id}/dismiss")
+async def dismiss_license_flag(
+    flag_id: int,
+    session: AsyncSession = Depends(get_session),
+    admin: User = Depends(get_current_admin),
+):
+    """标记告警已处理（之后再次超过阈值时产生新告警）"""
+    result = await session.execute(
+        select(LicenseFlag).where(LicenseFlag.id == flag_id)
+    )
+    flag = result.scalar_one_or_none()
+    
+    if not flag:
+        return error("告警不存在")
+    
+    flag.status = "dismissed"
+    flag.resolved_at = datetime.utcnow()
+    await session.commit()
+    audit_log.record(
+        admin, "license_flag.dismiss", "license_flag", flag.id,
+        before={"status": "open"}, after={"status": flag.status}, detail=f"授权 {flag.license_id}: {flag.kind}",
+    )
+    
+    return success(None, "已处理")
+
+
+# ==================== 审计日志 ====================
+
+@router.get("/audit-events")
+async def get_audit_events(
+    target_type: Optional[str] = None,
+    target_id: Optional[str] = None,
+    actor_id: Optional[int] = None,
+    action: Optional[str] = None,
+    before_id: Optional[int] = Query(None, ge=1),
+    limit: int = Query(50, ge=1, le=200),
+    session: AsyncSession = Depends(get_session),
+    _: User = Depends(get_current_admin),
+):
+    """
+    审计日志（按 ID 倒序键集分页）
+    下一页传入上一页返回的 next_before_id，为空表示没有更多记录
+    """
+    # 先写入本进程队列中的事件，刚做的操作立即可查；写入失败时事件留在队列中由后台任务重试，
+    # 这里照常返回已写入的记录（最多晚 AUDIT_FLUSH_SECONDS 出现）
+    try:
+        await audit_log.flush()
+    except Exception:
+        logger.exception("审计日志写入失败，返回已写入的记录")
+    
+    query = select(AuditEvent)
+    if target_type:
+        query = query.where(AuditEvent.target_type == target_type)
+    if target_id:
+        query = query.where(AuditEvent.target_id == target_id)
+    if actor_id:
+        query = query.where(AuditEvent.actor_id == actor_id)
+    if action:
+        query = query.where(AuditEvent.action == action)
+    if before_id:
+        query = query.where(AuditEvent.id < before_id)
+    
+    result = await session.execute(query.order_by(AuditEvent.id.desc()).limit(limit + 1))
+    events = result.scalars().all()
+    has_more = len(events) > limit
+    events = events[:limit]
+    
+    return success({
+        "items": [
+            {
+                "id": e.id,
+                "created_at": e.created_at.isoformat(),
+                "actor_id": e.actor_id,
+                "actor": e.actor,
+                "action": e.action,
+                "target_type": e.target_type,
+                "target_id": e.target_id,
+                "changes": json.loads(e.changes) if e.changes else {},
+                "detail": e.detail,
+            }
+            for e in events
+        ],
+        "next_before_id": events[-1].id if has_more else None,
+    })
 
 
 # ==================== 促销活动管理 ====================
 
 @router.get("/promos")
 async def get_promos(
-    session: AsyncSession = Depends(get_session),
+    session: AsyncSession = Depends(get_read_session),
     _: User = Depends(get_current_admin),
 ):
     """获取促销活动列表"""
@@ -725,7 +1059,7 @@ async def get_promos(
 async def create_promo(
     data: dict,
     session: AsyncSession = Depends(get_session),
-    _: User = Depends(get_current_admin),
+    admin: User = Depends(get_current_admin),
 ):
     """创建促销活动"""
     promo = PromoCampaign(
@@ -740,5 +1074,7 @@ async def create_promo(
     session.add(promo)
     await session.commit()
     await session.refresh(promo)
+    promo_cache.invalidate()
+    audit_log.record(admin, "promo.create", "promo", promo.id, after=audit.snapshot(promo, audit.PROMO_FIELDS))
     
     return success({"id": promo.id}, "创建成功")
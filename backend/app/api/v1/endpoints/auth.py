@@ -5,7 +5,6 @@ from datetime import timedelta
 from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlmodel import select
 
 from app.core.database import get_session
 from app.core.security import verify_password, create_access_token
@@ -14,6 +13,7 @@ from app.core.response import success, error
 from app.core.login_limiter import login_limiter
 from app.models.user import User
 from app.api.deps import get_current_user
+from app.services.lookups import user_by_username
 
 router = APIRouter()
 
@@ -51,10 +51,9 @@ async def login(
         )
     
     # 查询用户
-    result = await session.execute(
-        select(User).where(User.username == username)
-    )
-    user = result.scalar_one_or_none()
+    user = await user_by_username(session, username)
+    # bcrypt 校验期间不占用数据库连接
+    await session.release()
     
     # 验证失败
     if not user or not verify_password(form_data.password, user.hashed_password):
@@ -2,18 +2,30 @@
 授权验证 API 端点（供 ZenTea ERP 调用）
 """
 import hashlib
+import time
 from datetime import datetime
 from typing import Optional
 from fastapi import APIRouter, Depends, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlmodel import select
 
-from app.core.database import get_session
+from app.core.binary_protocol import BinaryNegotiationRoute, NegotiatedResponse
+from app.core.config import settings
+from app.core.database import async_session, get_session
 from app.core.response import success, error
-from app.models.license import License, LicenseHeartbeat
-from app.models.user import User
+from app.models.license import LicenseHeartbeat
+from app.services.id_generator import is_valid_license_key
+from app.services.lookups import license_state_by_key, license_with_binding
+from app.services import bindings, license_events, verify_fast, verify_snapshot
+from app.services.heartbeat_log import heartbeat_log
+from app.services.heartbeat_policy import heartbeat_policy
+from app.services.online import online
+from app.services.presence import presence
+from app.services.seat_leases import seat_leases
+from app.services.sharing import sharing_detector
 
-router = APIRouter()
+# 支持 MessagePack / CBOR 内容协商（见 core/binary_protocol.py），默认仍为 JSON
+router = APIRouter(route_class=BinaryNegotiationRoute, default_response_class=NegotiatedResponse)
 
 
 def generate_machine_id(info: dict) -> str:
@@ -23,6 +35,62 @@ def generate_machine_id(info: dict) -> str:
     return hashlib.sha256(raw.encode()).hexdigest()[:32]
 
 
+def _parse_state_version(value) -> Optional[int]:
+    """客户端回传的 state_version，缺失或格式错误时返回 None（按完整验证处理）"""
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+async def _unchanged_result(state_version: int, expire_date: Optional[datetime]) -> dict:
+    """条件验证命中（授权状态与客户端持有的版本一致）时的精简响应"""
+    return {
+        "valid": True,
+        "unchanged": True,
+        "state_version": state_version,
+        "next_check_in": await heartbeat_policy.next_check_in(expire_date),
+    }
+
+
+async def _verify_result(
+    plan_type: str, expire_date: Optional[datetime], max_users: int, state_version: int,
+) -> dict:
+    """验证成功的响应数据（ORM 路径与快速路径共用）"""
+    # 计算剩余天数
+    remaining_days = None
+    if expire_date:
+        delta = expire_date - datetime.utcnow()
+        remaining_days = max(0, delta.days)
+    
+    return {
+        "valid": True,
+        "plan_type": plan_type,
+        "expire_date": expire_date.isoformat() if expire_date else None,
+        "remaining_days": remaining_days,
+        "max_users": max_users,
+        "state_version": state_version,
+        # 建议的下一次心跳间隔（秒）
+        "next_check_in": await heartbeat_policy.next_check_in(expire_date),
+    }
+
+
+async def _record_heartbeat(
+    session: AsyncSession, license_key: str, license_id: int, machine_id: str, ip_address: str, now: datetime,
+    plan_type: Optional[str], user_id: Optional[int] = None,
+):
+    """
+    记录在线状态（批量写入 license_presence，不改写授权行）和仪表盘在线统计，
+    设备首次心跳、IP 变化或超过去重窗口时写心跳日志（见 services/heartbeat_log.py）
+    """
+    if heartbeat_log.should_log(license_key, machine_id, ip_address, time.time()):
+        session.add(LicenseHeartbeat(license_id=license_id, machine_id=machine_id, ip_address=ip_address, created_at=now))
+        await session.commit()
+    presence.record(license_id, machine_id, ip_address, now)
+    online.record(license_id, machine_id, plan_type, user_id)
+    sharing_detector.observe(license_id, machine_id, ip_address, True)
+
+
 @router.post("/activate")
 async def activate_license(
     data: dict,
@@ -45,11 +113,12 @@ async def activate_license(
     if not license_key:
         return error("请提供授权码")
     
-    # 查询授权
-    result = await session.execute(
-        select(License).where(License.license_key == license_key)
-    )
-    license = result.scalar_one_or_none()
+    # 校验位不通过的授权码直接拒绝，无需查库
+    if not is_valid_license_key(license_key):
+        return error("授权码无效", code=404)
+    
+    # 查询授权及本设备的绑定
+    license, binding_id = await license_with_binding(session, license_key, machine_id)
     
     if not license:
         return error("授权码无效", code=404)
@@ -60,17 +129,23 @@ async def activate_license(
     if license.status == "expired":
         return error("授权已过期", code=403)
     
-    # 检查是否已绑定其他机器
-    if license.machine_id and license.machine_id != machine_id:
-        return error("授权已绑定其他设备，请联系管理员解绑", code=403)
+    now = datetime.utcnow()
+    ip_address = request.client.host if request.client else "unknown"
+    if binding_id is None:
+        # 绑定设备数已达上限（单设备授权即已绑定其他机器）
+        if not await bindings.bind(session, license, machine_id, now):
+            sharing_detector.observe(license.id, machine_id, ip_address, False)
+            return error("授权已绑定其他设备，请联系管理员解绑", code=403)
     
     # 激活
     license.status = "active"
-    license.machine_id = machine_id
-    license.activated_at = datetime.utcnow()
-    license.last_heartbeat = datetime.utcnow()
+    license.activated_at = now
     
     await session.commit()
+    presence.record(license.id, machine_id, ip_address, now)
+    online.record(license.id, machine_id, license.plan_type, license.user_id)
+    sharing_detector.observe(license.id, machine_id, ip_address, True)
+    await verify_snapshot.record_license(session, license)
     
     return success({
         "license_key": license.license_key,
@@ -78,6 +153,8 @@ async def activate_license(
         "expire_date": license.expire_date.isoformat() if license.expire_date else None,
         "max_users": license.max_users,
         "machine_id": machine_id,
+        "state_version": license.state_version,
+        "next_check_in": await heartbeat_policy.next_check_in(license.expire_date),
     }, "激活成功")
 
 
@@ -93,24 +170,106 @@ async def verify_license(
     请求参数:
     - license_key: 授权码
     - machine_id: 机器码
+    - state_version: 客户端持有的授权状态版本（可选），与服务端一致时返回精简响应 {"unchanged": true}
     """
     license_key = data.get("license_key")
     machine_id = data.get("machine_id")
+    client_version = _parse_state_version(data.get("state_version"))
     
     if not license_key or not machine_id:
         return error("参数不完整")
     
-    # 查询授权
-    result = await session.execute(
-        select(License).where(License.license_key == license_key)
-    )
-    license = result.scalar_one_or_none()
+    # 校验位不通过的授权码直接拒绝，无需查库
+    if not is_valid_license_key(license_key):
+        return error("授权码无效", code=404)
+    
+    ip_address = request.client.host if request.client else "unknown"
+    
+    # 验证快照（见 services/verify_snapshot.py）：已删除、已吊销的授权无需查库直接拒绝，有效时只写心跳；
+    # 快照中没有的授权码、机器码不匹配（其他 worker 刚绑定的设备最多 REFRESH_INTERVAL 秒后才可见）
+    # 及需要标记过期的授权仍按下面的路径查库判定；只读边缘节点只根据快照判定
+    if verify_snapshot.enabled():
+        edge = settings.LICENSE_SNAPSHOT_EDGE
+        record = verify_snapshot.reader.lookup(license_key, machine_id)
+        if record is None:
+            if edge:
+                return error("授权码无效", code=404)
+        elif record.status == verify_snapshot.STATUS_DELETED:
+            return error("授权码无效", code=404)
+        elif not record.machine_matches(machine_id):
+            if edge:
+                return error("机器码不匹配", code=403)
+        elif record.status_name == "revoked":
+            return error("授权已被吊销", code=403)
+        elif record.is_expired():
+            if edge:
+                return error("授权已过期", code=403)
+        elif edge or not verify_fast.enabled():
+            if not edge:
+                await _record_heartbeat(
+                    session, license_key, record.license_id, machine_id, ip_address, datetime.utcnow(),
+                    record.plan_type,
+                )
+            if client_version == record.state_version:
+                return success(await _unchanged_result(record.state_version, record.expire_date))
+            return success(await _verify_result(
+                record.plan_type, record.expire_date, record.max_users, record.state_version,
+            ))
+    
+    # 快速路径：一条语句完成查询和心跳更新（见 services/verify_fast.py）
+    if verify_fast.enabled():
+        now = datetime.utcnow()
+        log_heartbeat = heartbeat_log.should_log(license_key, machine_id, ip_address, time.time())
+        row = await verify_fast.verify_and_touch(license_key, machine_id, ip_address, now, log_heartbeat)
+        valid = bool(row) and row["binding_id"] is not None and row["status"] != "revoked" and not (
+            row["expire_date"] and row["expire_date"] < now
+        )
+        if log_heartbeat and not valid:
+            # 语句未写心跳日志，撤销去重记录
+            heartbeat_log.forget(license_key, machine_id)
+        if not row:
+            return error("授权码无效", code=404)
+        if row["binding_id"] is None:
+            sharing_detector.observe(row["id"], machine_id, ip_address, False)
+            return error("机器码不匹配", code=403)
+        if row["status"] == "revoked":
+            return error("授权已被吊销", code=403)
+        if row["expire_date"] and row["expire_date"] < now:
+            return error("授权已过期", code=403)
+        presence.record(row["id"], machine_id, ip_address, now)
+        online.record(row["id"], machine_id, row["plan_type"], row["user_id"])
+        if client_version == row["state_version"]:
+            return success(await _unchanged_result(row["state_version"], row["expire_date"]))
+        return success(await _verify_result(
+            row["plan_type"], row["expire_date"], row["max_users"], row["state_version"],
+        ))
+    
+    # 条件验证：只查判定字段，版本一致且授权有效时直接记录心跳，不加载完整授权
+    if client_version is not None:
+        state = await license_state_by_key(session, license_key, machine_id)
+        if not state:
+            return error("授权码无效", code=404)
+        now = datetime.utcnow()
+        if (
+            state.state_version == client_version
+            and state.binding_id is not None
+            and state.status != "revoked"
+            and not (state.expire_date and state.expire_date < now)
+        ):
+            await _record_heartbeat(
+                session, license_key, state.id, machine_id, ip_address, now, state.plan_type, state.user_id,
+            )
+            return success(await _unchanged_result(state.state_version, state.expire_date))
+    
+    # 查询授权及本设备的绑定
+    license, binding_id = await license_with_binding(session, license_key, machine_id)
     
     if not license:
         return error("授权码无效", code=404)
     
     # 验证机器码
-    if license.machine_id != machine_id:
+    if binding_id is None:
+        sharing_detector.observe(license.id, machine_id, ip_address, False)
         return error("机器码不匹配", code=403)
     
     # 检查状态
@@ -119,36 +278,21 @@ async def verify_license(
     
     # 检查过期
     if license.expire_date and license.expire_date < datetime.utcnow():
-        license.status = "expired"
-        await session.commit()
+        if license.status != "expired":
+            license.status = "expired"
+            await session.commit()
+            await verify_snapshot.record_license(session, license)
         return error("授权已过期", code=403)
     
-    # 更新心跳
-    license.last_heartbeat = datetime.utcnow()
-    
-    # 记录心跳日志
-    heartbeat = LicenseHeartbeat(
-        license_id=license.id,
-        machine_id=machine_id,
-        ip_address=request.client.host if request.client else "unknown",
+    # 记录心跳
+    await _record_heartbeat(
+        session, license_key, license.id, machine_id, ip_address, datetime.utcnow(),
+        license.plan_type, license.user_id,
     )
-    session.add(heartbeat)
-    
-    await session.commit()
     
-    # 计算剩余天数
-    remaining_days = None
-    if license.expire_date:
-        delta = license.expire_date - datetime.utcnow()
-        remaining_days = max(0, delta.days)
-    
-    return success({
-        "valid": True,
-        "plan_type": license.plan_type,
-        "expire_date": license.expire_date.isoformat() if license.expire_date else None,
-        "remaining_days": remaining_days,
-        "max_users": license.max_users,
-    })
+    return success(await _verify_result(
+        license.plan_type, license.expire_date, license.max_users, license.state_version,
+    ))
 
 
 @router.post("/deactivate")
@@ -169,23 +313,169 @@ async def deactivate_license(
     if not license_key or not machine_id:
         return error("参数不完整")
     
-    # 查询授权
-    result = await session.execute(
-        select(License).where(License.license_key == license_key)
-    )
-    license = result.scalar_one_or_none()
+    # 校验位不通过的授权码直接拒绝，无需查库
+    if not is_valid_license_key(license_key):
+        return error("授权码无效", code=404)
+    
+    # 查询授权及本设备的绑定
+    license, binding_id = await license_with_binding(session, license_key, machine_id)
     
     if not license:
         return error("授权码无效", code=404)
     
     # 验证机器码
-    if license.machine_id != machine_id:
+    if binding_id is None:
         return error("机器码不匹配", code=403)
     
-    # 解绑
-    license.machine_id = None
-    license.status = "pending"
+    # 解绑本设备，没有其他绑定设备时回到待激活状态
+    await bindings.unbind(session, license, machine_id)
+    if license.machine_id is None:
+        license.status = "pending"
+    await seat_leases.release_license(session, license.id, machine_id)
     
     await session.commit()
+    await verify_snapshot.record_license(session, license)
     
     return success(None, "已停用，可在其他设备重新激活")
+
+
+@router.post("/checkout")
+async def checkout_seat(
+    data: dict,
+    session: AsyncSession = Depends(get_session),
+):
+    """
+    领取并发用户席位（ERP 用户登录时调用，席位数上限为授权的 max_users）
+    
+    请求参数:
+    - license_key: 授权码
+    - machine_id: 机器码
+    - client_id: 客户端标识（ERP 登录用户或会话），同一客户端重复领取时复用原租约
+    """
+    license_key = data.get("license_key")
+    machine_id = data.get("machine_id")
+    client_id = str(data.get("client_id") or "").strip()[:64]
+    
+    if not license_key or not machine_id or not client_id:
+        return error("参数不完整")
+    
+    # 校验位不通过的授权码直接拒绝，无需查库
+    if not is_valid_license_key(license_key):
+        return error("授权码无效", code=404)
+    
+    license, binding_id = await license_with_binding(session, license_key, machine_id)
+    
+    if not license:
+        return error("授权码无效", code=404)
+    
+    if binding_id is None:
+        return error("机器码不匹配", code=403)
+    
+    if license.status == "revoked":
+        return error("授权已被吊销", code=403)
+    
+    if license.expire_date and license.expire_date < datetime.utcnow():
+        return error("授权已过期", code=403)
+    
+    lease, seats_used = await seat_leases.checkout(session, license, client_id, machine_id)
+    if lease is None:
+        return error("并发用户数已达上限", code=409, data={
+            "seats_used": seats_used,
+            "max_users": license.max_users,
+        })
+    
+    return success({
+        **lease.to_dict(),
+        "seats_used": seats_used,
+        "max_users": license.max_users,
+    })
+
+
+@router.post("/renew")
+async def renew_seat(
+    data: dict,
+    session: AsyncSession = Depends(get_session),
+):
+    """
+    续租席位（客户端按返回的 ttl 在到期前续租，建议间隔为 ttl 的一半以内）
+    
+    请求参数:
+    - lease_id: 租约 ID
+    """
+    lease_id = data.get("lease_id")
+    
+    if not lease_id:
+        return error("参数不完整")
+    
+    lease = await seat_leases.renew(session, str(lease_id))
+    if lease is None:
+        return error("租约不存在或已过期", code=404)
+    
+    return success(lease.to_dict())
+
+
+@router.post("/checkin")
+async def checkin_seat(
+    data: dict,
+    session: AsyncSession = Depends(get_session),
+):
+    """
+    归还席位（ERP 用户退出时调用）
+    
+    请求参数:
+    - lease_id: 租约 ID
+    """
+    lease_id = data.get("lease_id")
+    
+    if not lease_id:
+        return error("参数不完整")
+    
+    if not await seat_leases.checkin(session, str(lease_id)):
+        return error("租约不存在或已过期", code=404)
+    
+    return success(None, "租约已归还")
+
+
+@router.get("/events")
+async def subscribe_license_events(license_key: str, machine_id: str):
+    """
+    订阅授权变更（SSE，供 ZenTea ERP 长连接）
+    
+    查询参数:
+    - license_key: 授权码
+    - machine_id: 机器码
+    
+    连接建立后先推送 ready（当前状态），之后推送 revoke / extend / unbind 事件；
+    收到 revoke、unbind 后服务端关闭连接。保持连接期间客户端可大幅降低心跳频率。
+    """
+    if not is_valid_license_key(license_key):
+        return error("授权码无效", code=404)
+    
+    if license_events.hub.is_full:
+        return error("推送连接已满，请稍后重试", code=503)
+    
+    # 校验完成即释放会话，长连接期间不占用数据库连接
+    async with async_session() as session:
+        license, binding_id = await license_with_binding(session, license_key, machine_id)
+    
+    if not license:
+        return error("授权码无效", code=404)
+    
+    if binding_id is None:
+        return error("机器码不匹配", code=403)
+    
+    if license.status == "revoked":
+        return error("授权已被吊销", code=403)
+    
+    ready = {
+        "event": "ready",
+        "license_id": license.id,
+        "status": license.status,
+        "expire_date": license.expire_date.isoformat() if license.expire_date else None,
+        "ts": datetime.utcnow().isoformat(),
+    }
+    return StreamingResponse(
+        license_events.stream(license.id, machine_id, ready),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -3,18 +3,26 @@
 """
 from typing import Optional
 from datetime import datetime, timedelta
-from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlmodel import select, func
-import uuid
 
 from app.core.database import get_session
+from app.core.replica import get_read_session
 from app.core.response import success, error
 from app.api.deps import get_current_user, get_current_admin
 from app.models.user import User
 from app.models.order import Order
 from app.models.license import License
-from app.models.promo import PromoCampaign
+from app.services import audit
+from app.services.audit import audit_log
+from app.services.promo_cache import promo_cache, redeem_promo
+from app.services.proof_storage import (
+    NAME_PATTERN, PROOF_HEADERS, ProofRejected, display_url, proof_name, proof_storage, receive_proof, signed_url,
+    thumbnail_name, thumbnails, verify_signature,
+)
+from app.services.id_generator import generate_license_key, generate_order_no
 
 router = APIRouter()
 
@@ -76,13 +84,7 @@ async def create_order(
     
     # 检查促销码
     if promo_code:
-        promo_result = await session.execute(
-            select(PromoCampaign).where(
-                PromoCampaign.code == promo_code,
-                PromoCampaign.is_active == True,
-            )
-        )
-        promo = promo_result.scalar_one_or_none()
+        promo = await promo_cache.get_by_code(session, promo_code)
         
         if promo:
             now = datetime.utcnow()
@@ -92,7 +94,7 @@ async def create_order(
                     amount = 0
     
     # 生成订单号
-    order_no = f"ORD{datetime.utcnow().strftime('%Y%m%d%H%M%S')}{uuid.uuid4().hex[:6].upper()}"
+    order_no = generate_order_no()
     
     # 创建订单
     order = Order(
@@ -106,10 +108,11 @@ async def create_order(
     session.add(order)
     await session.commit()
     await session.refresh(order)
+    audit_log.record(current_user, "order.create", "order", order.id, after=audit.snapshot(order, audit.ORDER_FIELDS))
     
     # 免费订单自动完成
     if amount == 0:
-        return await complete_order_internal(session, order, current_user)
+        return await complete_order_internal(session, order, current_user, actor=current_user)
     
     return success({
         "order_id": order.id,
@@ -127,11 +130,11 @@ async def create_order(
 @router.post("/{order_id}/upload-proof")
 async def upload_payment_proof(
     order_id: int,
-    proof_url: str,  # 简化版：前端上传后传URL
+    request: Request,
     current_user: User = Depends(get_current_user),
     session: AsyncSession = Depends(get_session),
 ):
-    """上传支付凭证"""
+    """上传支付凭证（multipart/form-data，文件字段名 file；PNG/JPEG/WebP 图片或 PDF）"""
     result = await session.execute(
         select(Order).where(Order.id == order_id, Order.user_id == current_user.id)
     )
@@ -143,17 +146,55 @@ async def upload_payment_proof(
     if order.status != "pending":
         return error("订单状态不允许此操作")
     
-    order.payment_proof = proof_url
-    order.notes = f"{order.notes or ''}\n[{datetime.utcnow().isoformat()}] 客户上传支付凭证".strip()
+    # 接收文件期间不占用数据库连接
+    await session.release()
+    try:
+        name = await receive_proof(request, proof_storage)
+    except ProofRejected as e:
+        return error(str(e), e.status_code)
+    
+    # 上传期间订单可能已被审核
+    result = await session.execute(
+        select(Order).where(Order.id == order_id).with_for_update()
+    )
+    order = result.scalar_one()
+    if order.status != "pending":
+        return error("订单状态不允许此操作")
+    
+    before = audit.snapshot(order, audit.ORDER_FIELDS)
+    order.payment_proof = proof_storage.url(name)
     await session.commit()
+    audit_log.record(
+        current_user, "order.upload_proof", "order", order.id,
+        before=before, after=audit.snapshot(order, audit.ORDER_FIELDS),
+    )
+    thumbnails.schedule(proof_storage, name)
     
-    return success(None, "上传成功，请等待审核")
+    return success({"payment_proof": signed_url(name)}, "上传成功，请等待审核")
+
+
+@router.get("/proofs/{expires}/{signature}/{name}")
+async def get_payment_proof(expires: int, signature: str, name: str, request: Request):
+    """
+    读取支付凭证或缩略图
+    链接由订单接口签发（见 proof_storage.signed_url），带有效期和签名，<img> 标签可直接引用；内容不变，长期缓存
+    """
+    if not NAME_PATTERN.match(name):
+        raise HTTPException(status_code=404, detail="文件不存在")
+    if not verify_signature(name, expires, signature):
+        raise HTTPException(status_code=403, detail="链接已过期或无效")
+    if not await proof_storage.exists(name):
+        raise HTTPException(status_code=404, detail="文件不存在")
+    etag = f'"{name}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=dict(PROOF_HEADERS, ETag=etag))
+    return proof_storage.response(name)
 
 
 @router.get("/my")
 async def get_my_orders(
     current_user: User = Depends(get_current_user),
-    session: AsyncSession = Depends(get_session),
+    session: AsyncSession = Depends(get_read_session),
 ):
     """获取我的订单列表"""
     result = await session.execute(
@@ -185,7 +226,7 @@ async def admin_get_orders(
     page: int = Query(1, ge=1),
     page_size: int = Query(20, ge=1, le=100),
     status: Optional[str] = None,
-    session: AsyncSession = Depends(get_session),
+    session: AsyncSession = Depends(get_read_session),
     _: User = Depends(get_current_admin),
 ):
     """管理员：获取订单列表"""
@@ -215,6 +256,16 @@ async def admin_get_orders(
     )
     users_map = {u.id: u for u in users_result.scalars().all()}
     
+    # 已生成的凭证缩略图（未生成时前端显示原图）
+    thumb_names = {}
+    for o in orders:
+        name = proof_name(o.payment_proof)
+        thumb = thumbnail_name(name) if name else None
+        if thumb:
+            thumb_names[o.id] = thumb
+    existing = await proof_storage.existing(thumb_names.values())
+    thumbs = {order_id: signed_url(thumb) for order_id, thumb in thumb_names.items() if thumb in existing}
+    
     return success({
         "items": [
             {
@@ -228,7 +279,10 @@ async def admin_get_orders(
                 "plan_type": o.plan_type,
                 "amount": o.amount,
                 "status": o.status,
-                "payment_proof": o.payment_proof,
+                "payment_method": o.payment_method,
+                "payment_txn_id": o.payment_txn_id,
+                "payment_proof": display_url(o.payment_proof),
+                "payment_proof_thumb": thumbs.get(o.id),
                 "promo_code": o.promo_code,
                 "notes": o.notes,
                 "created_at": o.created_at.isoformat() if o.created_at else None,
@@ -250,8 +304,9 @@ async def admin_approve_order(
     admin: User = Depends(get_current_admin),
 ):
     """管理员：审核通过订单"""
+    # 锁定订单行，与支付通知处理同时完成订单时只有一方生效
     result = await session.execute(
-        select(Order).where(Order.id == order_id)
+        select(Order).where(Order.id == order_id).with_for_update()
     )
     order = result.scalar_one_or_none()
     
@@ -270,7 +325,7 @@ async def admin_approve_order(
     if not user:
         return error("订单用户不存在")
     
-    return await complete_order_internal(session, order, user, notes, admin.username)
+    return await complete_order_internal(session, order, user, notes, actor=admin, action="order.approve")
 
 
 @router.post("/admin/{order_id}/reject")
@@ -281,8 +336,9 @@ async def admin_reject_order(
     admin: User = Depends(get_current_admin),
 ):
     """管理员：拒绝订单"""
+    # 锁定订单行：支付通知处理同时完成订单时，等其提交后再检查状态，不会把已支付的订单改为取消
     result = await session.execute(
-        select(Order).where(Order.id == order_id)
+        select(Order).where(Order.id == order_id).with_for_update()
     )
     order = result.scalar_one_or_none()
     
@@ -292,9 +348,13 @@ async def admin_reject_order(
     if order.status != "pending":
         return error("订单状态不允许此操作")
     
+    before = audit.snapshot(order, audit.ORDER_FIELDS)
     order.status = "cancelled"
-    order.notes = f"{order.notes or ''}\n[{datetime.utcnow().isoformat()}] 管理员 {admin.username} 拒绝: {reason}".strip()
     await session.commit()
+    audit_log.record(
+        admin, "order.reject", "order", order.id,
+        before=before, after=audit.snapshot(order, audit.ORDER_FIELDS), detail=reason,
+    )
     
     return success(None, "已拒绝")
 
@@ -304,9 +364,29 @@ async def complete_order_internal(
     order: Order,
     user: User,
     notes: Optional[str] = None,
-    admin_username: Optional[str] = None,
+    actor: Optional[User] = None,
+    action: str = "order.complete",
+    payment_method: str = "manual",
+    payment_txn_id: Optional[str] = None,
 ):
-    """内部函数：完成订单并生成授权"""
+    """
+    内部函数：完成订单并生成授权（actor 为操作人，notes 记入审计日志）
+    支付通知处理时 payment_method 为支付渠道，payment_txn_id 为支付平台交易号
+    """
+    before = audit.snapshot(order, audit.ORDER_FIELDS)
+    # 核销促销码（条件 UPDATE，活动已停用、已结束或名额已满时不核销）
+    if order.promo_code:
+        redeemed = await redeem_promo(session, order.promo_code)
+        # 依赖促销码免单但活动已失效或名额已被抢完：取消订单，不生成授权
+        if redeemed is None and order.amount == 0 and PLAN_PRICES.get(order.plan_type, 0) > 0:
+            order.status = "cancelled"
+            await session.commit()
+            audit_log.record(
+                actor, "order.cancel", "order", order.id,
+                before=before, after=audit.snapshot(order, audit.ORDER_FIELDS), detail="促销活动已结束或名额已满，订单已取消",
+            )
+            return error("活动已结束或名额已满")
+    
     # 计算到期日期
     duration = PLAN_DURATIONS.get(order.plan_type)
     expire_date = None
@@ -314,7 +394,7 @@ async def complete_order_internal(
         expire_date = datetime.utcnow() + timedelta(days=duration)
     
     # 生成授权码
-    license_key = f"ZT-{order.plan_type.upper()[:3]}-{uuid.uuid4().hex[:16].upper()}"
+    license_key = generate_license_key(order.plan_type)
     
     # 创建授权
     license = License(
@@ -332,23 +412,18 @@ async def complete_order_internal(
     order.status = "paid"
     order.paid_at = datetime.utcnow()
     order.license_id = license.id
-    order.payment_method = "manual"
-    
-    if notes:
-        order.notes = f"{order.notes or ''}\n[{datetime.utcnow().isoformat()}] {notes}".strip()
-    if admin_username:
-        order.notes = f"{order.notes or ''}\n[{datetime.utcnow().isoformat()}] 管理员 {admin_username} 审核通过".strip()
-    
-    # 更新促销码使用次数
-    if order.promo_code:
-        promo_result = await session.execute(
-            select(PromoCampaign).where(PromoCampaign.code == order.promo_code)
-        )
-        promo = promo_result.scalar_one_or_none()
-        if promo:
-            promo.current_uses += 1
+    order.payment_method = payment_method
+    order.payment_txn_id = payment_txn_id
     
     await session.commit()
+    audit_log.record(
+        actor, action, "order", order.id,
+        before=before, after=audit.snapshot(order, audit.ORDER_FIELDS), detail=notes,
+    )
+    audit_log.record(
+        actor, "license.create", "license", license.id,
+        after=audit.snapshot(license, audit.LICENSE_FIELDS), detail=f"订单 {order.order_no}",
+    )
     
     return success({
         "license_key": license_key,
@@ -12,20 +12,28 @@ from app.core.response import success, error
 from app.api.deps import get_current_admin
 from app.models.user import User
 from app.models.page import Page, DEFAULT_PAGES
+from app.services import audit
+from app.services.audit import audit_log
 
 router = APIRouter()
 
 
+def _audit_snapshot(page: Page) -> dict:
+    """审计日志中的页面字段（正文只记录摘要）"""
+    return {**audit.snapshot(page, audit.PAGE_FIELDS), "content": audit.digest(page.content)}
+
+
 async def init_default_pages(session: AsyncSession):
     """初始化默认页面"""
-    for item in DEFAULT_PAGES:
-        result = await session.execute(
-            select(Page).where(Page.slug == item["slug"])
-        )
-        if not result.scalar_one_or_none():
-            page = Page(**item)
-            session.add(page)
-    await session.commit()
+    result = await session.execute(
+        select(Page.slug).where(Page.slug.in_([item["slug"] for item in DEFAULT_PAGES]))
+    )
+    existing = set(result.scalars().all())
+    missing = [item for item in DEFAULT_PAGES if item["slug"] not in existing]
+    if missing:
+        for item in missing:
+            session.add(Page(**item))
+        await session.commit()
 
 
 @router.get("")
@@ -105,6 +113,8 @@ async def update_page(
     if not page:
         return error("页面不存在")
     
+    before = _audit_snapshot(page)
+    
     # 更新字段
     if "title" in data:
         page.title = data["title"]
@@ -122,6 +132,7 @@ async def update_page(
     page.updated_at = datetime.utcnow()
     
     await session.commit()
+    audit_log.record(admin, "page.update", "page", page.id, before=before, after=_audit_snapshot(page))
     
     return success({"id": page.id}, "页面更新成功")
 
@@ -157,6 +168,7 @@ async def create_page(
     session.add(page)
     await session.commit()
     await session.refresh(page)
+    audit_log.record(admin, "page.create", "page", page.id, after=_audit_snapshot(page))
     
     return success({"id": page.id}, "页面创建成功")
 
@@ -176,8 +188,10 @@ async def delete_page(
     if not page:
         return error("页面不存在")
     
+    before = _audit_snapshot(page)
     await session.delete(page)
     await session.commit()
+    audit_log.record(admin, "page.delete", "page", page_id, before=before)
     
     return success(None, "页面删除成功")
 
@@ -0,0 +1,146 @@
+"""
+支付通知 API 端点
+支付宝/微信支付异步通知验签后写入 payment_notifications 即应答，订单由后台任务完成（见 services/payment_notifications.py）
+"""
+import logging
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select, func
+
+from app.core.database import get_session
+from app.core.replica import get_read_session
+from app.core.response import success, error
+from app.api.deps import get_current_admin
+from app.models.payment import PaymentNotification
+from app.models.user import User
+from app.services.audit import audit_log
+from app.services.payment_gateways import GATEWAYS, NotificationError, payment_config
+from app.services.payment_notifications import payment_notifications_total, payment_queue
+
+logger = logging.getLogger("zentea.payment")
+
+router = APIRouter()
+
+# 通知请求体上限（字节）
+MAX_NOTIFY_BODY = 64 * 1024
+
+
+@router.post("/notify/{provider}")
+async def payment_notify(provider: str, request: Request):
+    """支付平台异步通知（alipay / wechat / stub），应答格式由各渠道决定"""
+    gateway = GATEWAYS.get(provider)
+    config = await payment_config.get() if gateway else None
+    if gateway is None or not gateway.enabled(config):
+        raise HTTPException(status_code=404, detail="支付渠道未启用")
+
+    body = await request.body()
+    try:
+        if len(body) > MAX_NOTIFY_BODY:
+            raise NotificationError("通知内容过大")
+        params = gateway.parse(body)
+        if not gateway.verify(params, config):
+            raise NotificationError("验签失败")
+        notification = gateway.extract(params)
+    except NotificationError as e:
+        payment_notifications_total.inc(provider, "rejected")
+        logger.warning("支付通知被拒绝: %s %s", provider, e)
+        return gateway.ack(False)
+
+    # 非支付成功的状态（等待付款、交易关闭等）只应答
+    if not notification.paid:
+        payment_notifications_total.inc(provider, "ignored")
+        return gateway.ack(True)
+
+    try:
+        await payment_queue.submit(provider, notification, body.decode("utf-8", "replace"))
+    except Exception:
+        # 未保存时应答失败，支付平台稍后重试
+        logger.exception("支付通知保存失败: %s %s", provider, notification.txn_id)
+        return gateway.ack(False)
+    return gateway.ack(True)
+
+
+@router.get("/admin/notifications")
+async def admin_list_notifications(
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=100),
+    status: Optional[str] = None,
+    order_no: Optional[str] = None,
+    session: AsyncSession = Depends(get_read_session),
+    _: User = Depends(get_current_admin),
+):
+    """管理员：支付通知列表（failed 为需要人工核对的通知）"""
+    offset = (page - 1) * page_size
+
+    query = select(PaymentNotification)
+    count_query = select(func.count()).select_from(PaymentNotification)
+
+    if status:
+        query = query.where(PaymentNotification.status == status)
+        count_query = count_query.where(PaymentNotification.status == status)
+
+    if order_no:
+        query = query.where(PaymentNotification.order_no == order_no)
+        count_query = count_query.where(PaymentNotification.order_no == order_no)
+
+    result = await session.execute(
+        query.order_by(PaymentNotification.id.desc())
+        .offset(offset)
+        .limit(page_size)
+    )
+    notifications = result.scalars().all()
+
+    total = await session.execute(count_query)
+    total = total.scalar() or 0
+
+    return success({
+        "items": [
+            {
+                "id": n.id,
+                "provider": n.provider,
+                "txn_id": n.txn_id,
+                "order_no": n.order_no,
+                "amount": n.amount_cents / 100,
+                "status": n.status,
+                "attempts": n.attempts,
+                "error": n.error,
+                "created_at": n.created_at.isoformat(),
+                "processed_at": n.processed_at.isoformat() if n.processed_at else None,
+            }
+            for n in notifications
+        ],
+        "total": total,
+        "page": page,
+        "page_size": page_size,
+    })
+
+
+@router.post("/admin/notifications/{notification_id}/retry")
+async def admin_retry_notification(
+    notification_id: int,
+    session: AsyncSession = Depends(get_session),
+    admin: User = Depends(get_current_admin),
+):
+    """管理员：重新处理失败的通知（核对并修正订单后使用）"""
+    result = await session.execute(
+        select(PaymentNotification).where(PaymentNotification.id == notification_id)
+    )
+    notification = result.scalar_one_or_none()
+
+    if not notification:
+        return error("通知不存在")
+
+    if notification.status != "failed":
+        return error("只能重新处理失败的通知")
+
+    notification.status = "pending"
+    notification.attempts = 0
+    notification.processed_at = None
+    await session.commit()
+    audit_log.record(
+        admin, "payment_notification.retry", "payment_notification", notification.id,
+        before={"status": "failed"}, after={"status": "pending"}, detail=notification.error,
+    )
+
+    return success(None, "已重新加入处理队列")
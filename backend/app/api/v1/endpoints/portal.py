@@ -6,14 +6,16 @@ from datetime import datetime, timedelta
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlmodel import select
-import uuid
 
 from app.core.database import get_session
+from app.core.replica import get_read_session
 from app.core.security import get_password_hash
 from app.core.response import success, error
 from app.api.deps import get_current_user
 from app.models.user import User
 from app.models.license import License
+from app.services import bindings
+from app.services.id_generator import generate_license_key, generate_order_no
 
 router = APIRouter()
 
@@ -47,6 +49,9 @@ async def register(
     if result.scalar_one_or_none():
         return error("邮箱已被注册")
     
+    # bcrypt 计算期间不占用数据库连接
+    await session.release()
+    
     # 创建用户
     user = User(
         username=username,
@@ -69,7 +74,7 @@ async def register(
 @router.get("/licenses")
 async def get_my_licenses(
     current_user: User = Depends(get_current_user),
-    session: AsyncSession = Depends(get_session),
+    session: AsyncSession = Depends(get_read_session),
 ):
     """获取我的授权列表"""
     result = await session.execute(
@@ -90,11 +95,33 @@ async def get_my_licenses(
             "expire_date": lic.expire_date.isoformat() if lic.expire_date else None,
             "machine_id": lic.machine_id,
             "max_users": lic.max_users,
+            "max_machines": lic.max_machines,
         }
         for lic in licenses
     ])
 
 
+@router.get("/licenses/{license_id}/bindings")
+async def get_my_license_bindings(
+    license_id: int,
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_read_session),
+):
+    """我的授权的绑定设备列表（含最近验证时间）"""
+    result = await session.execute(
+        select(License.max_machines).where(License.id == license_id, License.user_id == current_user.id)
+    )
+    max_machines = result.scalar_one_or_none()
+    
+    if max_machines is None:
+        return error("授权不存在", code=404)
+    
+    return success({
+        "max_machines": max_machines,
+        "items": await bindings.list_bindings(session, license_id),
+    })
+
+
 # ==================== 套餐信息 ====================
 
 @router.get("/plans")
@@ -178,7 +205,7 @@ async def create_order(
             return error("您已使用过试用版")
         
         # 生成授权
-        license_key = f"ZT-TRL-{uuid.uuid4().hex[:16].upper()}"
+        license_key = generate_license_key("TRL")
         license = License(
             user_id=current_user.id,
             license_key=license_key,
@@ -196,7 +223,7 @@ async def create_order(
         })
     
     # 付费版返回支付信息（简化版）
-    order_no = f"ORD{datetime.utcnow().strftime('%Y%m%d%H%M%S')}{uuid.uuid4().hex[:6].upper()}"
+    order_no = generate_order_no()
     
     return success({
         "order_no": order_no,
@@ -4,11 +4,10 @@
 from datetime import datetime
 from fastapi import APIRouter, Depends
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlmodel import select
 
 from app.core.database import get_session
 from app.core.response import success, error
-from app.models.promo import PromoCampaign
+from app.services.promo_cache import promo_cache
 
 router = APIRouter()
 
@@ -18,16 +17,7 @@ async def get_current_promo(
     session: AsyncSession = Depends(get_session),
 ):
     """获取当前有效的促销活动"""
-    now = datetime.utcnow()
-    
-    result = await session.execute(
-        select(PromoCampaign).where(
-            PromoCampaign.is_active == True,
-            PromoCampaign.start_date <= now,
-            PromoCampaign.end_date >= now,
-        )
-    )
-    promos = result.scalars().all()
+    promos = await promo_cache.get_active(session)
     
     # 过滤已达上限的活动
     valid_promos = []
@@ -57,13 +47,7 @@ async def check_promo_code(
     
     now = datetime.utcnow()
     
-    result = await session.execute(
-        select(PromoCampaign).where(
-            PromoCampaign.code == code,
-            PromoCampaign.is_active == True,
-        )
-    )
-    promo = result.scalar_one_or_none()
+    promo = await promo_cache.get_by_code(session, code)
     
     if not promo:
         return error("促销码无效", code=404)
@@ -12,20 +12,37 @@ from app.core.response import success, error
 from app.api.deps import get_current_admin
 from app.models.user import User
 from app.models.setting import SystemSetting, DEFAULT_SETTINGS, SettingKeys
+from app.services.audit import audit_log
+from app.services.heartbeat_policy import heartbeat_policy
+from app.services.payment_gateways import payment_config
 
 router = APIRouter()
 
+# 敏感设置（返回和审计日志中脱敏）
+SENSITIVE_KEYS = (
+    SettingKeys.ALIPAY_PRIVATE_KEY,
+    SettingKeys.ALIPAY_PUBLIC_KEY,
+    SettingKeys.WECHAT_API_KEY,
+)
+
+
+def _masked(key: str, value: Optional[str]) -> Optional[str]:
+    return "******" if key in SENSITIVE_KEYS and value else value
+
 
 async def init_default_settings(session: AsyncSession):
     """初始化默认设置"""
-    for item in DEFAULT_SETTINGS:
-        result = await session.execute(
-            select(SystemSetting).where(SystemSetting.key == item["key"])
+    result = await session.execute(
+        select(SystemSetting.key).where(
+            SystemSetting.key.in_([item["key"] for item in DEFAULT_SETTINGS])
         )
-        if not result.scalar_one_or_none():
-            setting = SystemSetting(**item)
-            session.add(setting)
-    await session.commit()
+    )
+    existing = set(result.scalars().all())
+    missing = [item for item in DEFAULT_SETTINGS if item["key"] not in existing]
+    if missing:
+        for item in missing:
+            session.add(SystemSetting(**item))
+        await session.commit()
 
 
 @router.get("")
@@ -48,16 +65,11 @@ async def get_settings(
     
     # 敏感字段脱敏
     data = []
-    sensitive_keys = [
-        SettingKeys.ALIPAY_PRIVATE_KEY,
-        SettingKeys.ALIPAY_PUBLIC_KEY,
-        SettingKeys.WECHAT_API_KEY,
-    ]
     for s in settings:
         item = {
             "id": s.id,
             "key": s.key,
-            "value": "******" if s.key in sensitive_keys and s.value else s.value,
+            "value": _masked(s.key, s.value),
             "description": s.description,
             "category": s.category,
             "has_value": bool(s.value),  # 标记是否已配置
@@ -78,32 +90,49 @@ async def update_settings(
     if not settings:
         return error("请提供要更新的设置")
     
+    # 一次查出所有待更新的设置
+    result = await session.execute(
+        select(SystemSetting).where(SystemSetting.key.in_(list(settings.keys())))
+    )
+    existing = {s.key: s for s in result.scalars().all()}
+    
     updated = []
+    changes = []
     for key, value in settings.items():
         # 跳过脱敏占位符
         if value == "******":
             continue
             
-        result = await session.execute(
-            select(SystemSetting).where(SystemSetting.key == key)
-        )
-        setting = result.scalar_one_or_none()
+        setting = existing.get(key)
+        value = str(value) if value is not None else ""
+        old_value = setting.value if setting else None
         
         if setting:
-            setting.value = str(value) if value is not None else ""
+            setting.value = value
             setting.updated_at = datetime.utcnow()
             updated.append(key)
         else:
             # 创建新设置
             new_setting = SystemSetting(
                 key=key,
-                value=str(value) if value is not None else "",
+                value=value,
                 category="custom",
             )
             session.add(new_setting)
             updated.append(key)
+        if value != old_value:
+            changes.append((key, old_value, value))
     
     await session.commit()
+    heartbeat_policy.invalidate()
+    payment_config.invalidate()
+    # 每项设置一条审计事件；敏感设置不记录取值
+    for key, old_value, value in changes:
+        if key in SENSITIVE_KEYS:
+            before, after = {"value": _masked(key, old_value)}, {"value": "******(已修改)" if value else ""}
+        else:
+            before, after = {"value": old_value}, {"value": value}
+        audit_log.record(admin, "setting.update", "setting", key, before=before, after=after)
     return success({"updated": updated}, f"已更新 {len(updated)} 项设置")
 
 
@@ -124,7 +153,7 @@ async def get_payment_settings(
     data = {}
     for s in settings:
         # 敏感字段脱敏
-        if s.key in [SettingKeys.ALIPAY_PRIVATE_KEY, SettingKeys.ALIPAY_PUBLIC_KEY, SettingKeys.WECHAT_API_KEY]:
+        if s.key in SENSITIVE_KEYS:
             data[s.key] = "******" if s.value else ""
             data[f"{s.key}_configured"] = bool(s.value)
         else:
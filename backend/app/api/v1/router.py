@@ -3,7 +3,7 @@ API 路由汇总
 """
 from fastapi import APIRouter
 
-from app.api.v1.endpoints import auth, license, admin, promo, portal, order, setting, page
+from app.api.v1.endpoints import auth, license, admin, promo, portal, order, payment, setting, page
 
 api_router = APIRouter()
 
@@ -25,6 +25,9 @@ api_router.include_router(portal.router, prefix="/portal", tags=["用户门户"]
 # 订单管理
 api_router.include_router(order.router, prefix="/orders", tags=["订单管理"])
 
+# 支付通知
+api_router.include_router(payment.router, prefix="/payments", tags=["支付通知"])
+
 # 系统设置
 api_router.include_router(setting.router, prefix="/settings", tags=["系统设置"])
 
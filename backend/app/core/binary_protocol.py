@@ -0,0 +1,178 @@
+"""
+授权接口的紧凑二进制协议（MessagePack / CBOR）
+ERP 客户端可通过内容协商改用二进制格式，减少高频心跳的带宽和编解码开销：
+- 请求：Content-Type 为 application/msgpack 或 application/cbor 时按对应格式解析请求体
+- 响应：Accept 包含上述类型时（未指定或 */* 则跟随请求体格式）按对应格式返回，
+  信封为 {"c": 业务码, "r": 原因码, "d": 数据}，以 REASON_CODES 中的数字代替中文提示；
+  未收录的提示仍以 "m" 字段原样返回
+未协商二进制格式的请求与原 JSON 接口完全一致。msgpack / cbor2 为可选依赖，未安装时对应格式不可用。
+"""
+import email.message
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Optional
+
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+
+try:
+    import msgpack
+except ImportError:  # 可选依赖
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:  # 可选依赖
+    cbor2 = None
+
+MSGPACK = "msgpack"
+CBOR = "cbor"
+
+# 媒体类型 -> 格式
+MEDIA_TYPES = {
+    "application/msgpack": MSGPACK,
+    "application/x-msgpack": MSGPACK,
+    "application/vnd.msgpack": MSGPACK,
+    "application/cbor": CBOR,
+}
+RESPONSE_MEDIA_TYPES = {MSGPACK: "application/msgpack", CBOR: "application/cbor"}
+
+# 提示文字 -> 原因码（0 表示无附加说明）；新增提示时在末尾追加，已发布的编号不可修改
+REASON_CODES: Dict[str, int] = {
+    "操作成功": 0,
+    "激活成功": 1,
+    "已停用，可在其他设备重新激活": 2,
+    "请提供授权码": 100,
+    "参数不完整": 101,
+    "授权码无效": 102,
+    "授权已被吊销": 103,
+    "授权已过期": 104,
+    "授权已绑定其他设备，请联系管理员解绑": 105,
+    "机器码不匹配": 106,
+    "推送连接已满，请稍后重试": 107,
+    "并发用户数已达上限": 108,
+    "租约不存在或已过期": 109,
+    "租约已归还": 110,
+}
+UNKNOWN_REASON = -1
+
+# 当前请求协商出的响应格式（None 为 JSON）
+_response_format: ContextVar[Optional[str]] = ContextVar("response_format", default=None)
+
+
+def available_formats() -> set:
+    formats = set()
+    if msgpack is not None:
+        formats.add(MSGPACK)
+    if cbor2 is not None:
+        formats.add(CBOR)
+    return formats
+
+
+def _media_type(value: Optional[str]) -> str:
+    if not value:
+        return ""
+    message = email.message.Message()
+    message["content-type"] = value
+    return message.get_content_type()
+
+
+def _response_format_for(accept: Optional[str], request_format: Optional[str]) -> Optional[str]:
+    """
+    确定响应格式：按 Accept 中出现的顺序选择第一个可用的二进制格式；
+    Accept 明确要求 JSON 时返回 JSON，未指定（或 */*）时跟随请求体格式
+    """
+    if not accept:
+        return request_format
+    formats = available_formats()
+    for part in accept.split(","):
+        media_type = part.split(";")[0].strip().lower()
+        fmt = MEDIA_TYPES.get(media_type)
+        if fmt in formats:
+            return fmt
+        if media_type == "application/json":
+            return None
+    return request_format
+
+
+def encode(fmt: str, obj: Any) -> bytes:
+    if fmt == MSGPACK:
+        return msgpack.packb(obj, use_bin_type=True)
+    return cbor2.dumps(obj)
+
+
+def decode(fmt: str, body: bytes) -> Any:
+    if fmt == MSGPACK:
+        return msgpack.unpackb(body, raw=False)
+    return cbor2.loads(body)
+
+
+def compact_envelope(content: Any) -> Any:
+    """{"code","message","data"} 信封转换为 {"c","r","d"}"""
+    if not isinstance(content, dict) or "code" not in content or "message" not in content:
+        return content
+    message = content["message"]
+    reason = REASON_CODES.get(message, UNKNOWN_REASON)
+    compact = {"c": content["code"], "r": reason, "d": content.get("data")}
+    if reason == UNKNOWN_REASON:
+        compact["m"] = message
+    return compact
+
+
+class NegotiatedResponse(JSONResponse):
+    """按协商格式序列化的响应（默认与 JSONResponse 完全相同）"""
+
+    def render(self, content: Any) -> bytes:
+        fmt = _response_format.get()
+        if fmt is None:
+            return super().render(content)
+        # init_headers 在 render 之后调用，这里修改 media_type 即可生效
+        self.media_type = RESPONSE_MEDIA_TYPES[fmt]
+        return encode(fmt, compact_envelope(content))
+
+
+class _DecodedRequest(Request):
+    """请求体已按二进制格式解码的请求"""
+
+    def __init__(self, scope, receive, fmt: str):
+        super().__init__(scope, receive)
+        self._format = fmt
+
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            try:
+                self._json = decode(self._format, await self.body())
+            except Exception:
+                raise HTTPException(status_code=400, detail="请求体格式错误")
+        return self._json
+
+
+class BinaryNegotiationRoute(APIRoute):
+    """支持 MessagePack / CBOR 内容协商的路由（配合 NegotiatedResponse 使用）"""
+
+    def get_route_handler(self) -> Callable:
+        original_handler = super().get_route_handler()
+
+        async def handler(request: Request) -> Response:
+            request_format = MEDIA_TYPES.get(_media_type(request.headers.get("content-type")))
+            if request_format is not None:
+                if request_format not in available_formats():
+                    raise HTTPException(status_code=415, detail="不支持的请求格式")
+                # 改写 Content-Type 使 FastAPI 调用 json()，由 _DecodedRequest 完成解码
+                scope = dict(request.scope)
+                scope["headers"] = [
+                    (k, b"application/json" if k == b"content-type" else v) for k, v in request.scope["headers"]
+                ]
+                request = _DecodedRequest(scope, request.receive, request_format)
+
+            response_format = _response_format_for(request.headers.get("accept"), request_format)
+            token = _response_format.set(response_format)
+            try:
+                response = await original_handler(request)
+            finally:
+                _response_format.reset(token)
+            if response_format is not None:
+                response.headers["Vary"] = "Accept"
+            return response
+
+        return handler
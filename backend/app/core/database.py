@@ -1,26 +1,250 @@
 """
 数据库连接配置
+默认使用 PostgreSQL（asyncpg）；本地模式可使用内嵌 SQLite（aiosqlite），见 _sqlite_engine_options
 """
+import asyncio
+import os
+import time
+
+from sqlalchemy import event, inspect, text
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlalchemy.util import await_only
 from sqlmodel import SQLModel
 
 from .config import settings
+from . import metrics, query_stats
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """记录连接获取等待时间的连接池"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            metrics.db_pool_wait.observe(time.perf_counter() - start)
+
+
+# ==================== 内嵌 SQLite ====================
+
+# 连接初始化参数：
+# - WAL：读不阻塞写、写不阻塞读；NORMAL 同步级别在 WAL 下仍保证崩溃后数据库一致
+# - busy_timeout：多进程同时写入时等待而不是立即报 database is locked
+# - foreign_keys：与 PostgreSQL 一致地校验外键
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+)
+
+is_sqlite = settings.is_sqlite
+
+
+def _sqlite_engine_options(url: str) -> dict:
+    """SQLite 引擎参数（文件库使用计时连接池，内存库沿用 SQLAlchemy 默认的单连接池）"""
+    database = make_url(url).database
+    if not database or database == ":memory:":
+        return {}
+    directory = os.path.dirname(os.path.abspath(database))
+    os.makedirs(directory, exist_ok=True)
+    return {"poolclass": TimedQueuePool}
+
+
+def _sqlite_on_connect(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
 
 # 创建异步引擎
 engine = create_async_engine(
     settings.DATABASE_URL,
     echo=False,
     future=True,
+    **(_sqlite_engine_options(settings.DATABASE_URL) if is_sqlite else {"poolclass": TimedQueuePool}),
 )
+if is_sqlite:
+    event.listen(engine.sync_engine, "connect", _sqlite_on_connect)
+
+# 语句统计与慢查询日志
+query_stats.install(engine.sync_engine)
+
+
+class EdgeDatabaseAccess(RuntimeError):
+    """只读边缘验证节点访问了数据库"""
+
+
+def _refuse_edge_connect(dialect, conn_rec, cargs, cparams):
+    raise EdgeDatabaseAccess("只读边缘验证节点（LICENSE_SNAPSHOT_EDGE）不连接数据库")
+
+
+# 边缘节点不连接数据库：任何建立连接的尝试都直接报错，便于发现验证路径上误加的数据库访问
+if settings.LICENSE_SNAPSHOT_EDGE:
+    event.listen(engine.sync_engine, "do_connect", _refuse_edge_connect)
+
+
+def pool_status() -> dict:
+    """连接池状态（用于监控指标）；NullPool、StaticPool 等非队列连接池没有这些统计，均为 0"""
+    pool = engine.pool
+    if not isinstance(pool, QueuePool):
+        return {"size": 0, "checked_out": 0, "overflow": 0}
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "overflow": max(0, pool.overflow()),
+    }
+
+
+def pool_utilization() -> float:
+    """连接池使用率（已借出连接数 / 常驻加溢出上限），非队列连接池为 0"""
+    pool = engine.pool
+    if not isinstance(pool, QueuePool):
+        return 0.0
+    capacity = pool.size() + max(0, getattr(pool, "_max_overflow", 0))
+    return pool.checkedout() / capacity if capacity > 0 else 0.0
+
+
+metrics.register_gauge(
+    "zentea_db_pool_size", "连接池常驻连接数", lambda: pool_status()["size"],
+)
+metrics.register_gauge(
+    "zentea_db_pool_checked_out", "连接池已借出连接数", lambda: pool_status()["checked_out"],
+)
+metrics.register_gauge(
+    "zentea_db_pool_overflow", "连接池溢出连接数（超出 pool_size 的临时连接）", lambda: pool_status()["overflow"],
+)
+
+early_releases_total = metrics.registry.register(metrics.Counter(
+    "zentea_db_session_early_release_total", "只读事务提前归还连接的次数",
+))
+
+
+# SQLite 同一时刻只允许一个写事务：进程内的写事务在此排队（asyncio.Lock 按先来先得唤醒），
+# 避免多个连接同时写入时互相等待 busy_timeout 或报 database is locked；多进程之间仍依赖 busy_timeout
+sqlite_writer = asyncio.Lock() if is_sqlite else None
+
+sqlite_writer_wait = None
+if is_sqlite:
+    sqlite_writer_wait = metrics.registry.register(metrics.Histogram(
+        "zentea_db_sqlite_writer_wait_seconds", "SQLite 写事务排队等待时间（秒）",
+        buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0),
+    ))
+
+
+async def _acquire_writer(session: Session):
+    """为会话当前事务获取 SQLite 写锁，事务结束时释放"""
+    if sqlite_writer is None or session.info.get("sqlite_writer"):
+        return
+    start = time.perf_counter()
+    await sqlite_writer.acquire()
+    sqlite_writer_wait.observe(time.perf_counter() - start)
+    session.info["sqlite_writer"] = True
+
+
+def _release_writer(session: Session):
+    if session.info.pop("sqlite_writer", None):
+        sqlite_writer.release()
+
+
+class _TrackingSession(Session):
+    """记录当前事务是否已有写操作的同步会话"""
+
+
+@event.listens_for(_TrackingSession, "before_flush")
+def _before_flush(session, flush_context, instances):
+    # flush 在 AsyncSession 的 greenlet 中执行，可通过 await_only 等待写锁
+    if sqlite_writer is not None and not session.info.get("sqlite_writer"):
+        await_only(_acquire_writer(session))
+
+
+@event.listens_for(_TrackingSession, "after_flush")
+def _mark_flush(session, flush_context):
+    session.info["tx_writes"] = True
+
+
+@event.listens_for(_TrackingSession, "after_transaction_end")
+def _reset_writes(session, transaction):
+    if transaction.parent is None:
+        session.info.pop("tx_writes", None)
+        _release_writer(session)
+
+
+class LazySession(AsyncSession):
+    """
+    可提前归还连接的会话
+    AsyncSession 本身在首条语句执行时才获取连接，但会一直占用到提交或会话关闭；
+    bcrypt、接收上传文件等慢操作之前调用 release()，只读事务立即提交以归还连接，避免慢操作期间占用连接池。
+    其余情况连接在请求结束、依赖退出关闭会话时归还，多条查询共用同一事务和连接。
+    - 事务内已有写操作（flush 或 DML）、未提交的对象修改、嵌套事务时 release() 不提交
+    - expire_on_commit=False，已加载的对象在提交后仍可继续使用和修改
+    """
+    sync_session_class = _TrackingSession
+
+    def _can_release(self) -> bool:
+        if not settings.DB_EARLY_RELEASE or not self.in_transaction() or self.in_nested_transaction():
+            return False
+        if self.sync_session.info.get("tx_writes"):
+            return False
+        return not (self.new or self.dirty or self.deleted)
+
+    async def release(self):
+        """慢操作前调用：当前事务只读时提交以归还连接（有写操作时不做任何事）"""
+        if self._can_release():
+            await self.commit()
+            early_releases_total.inc()
+
+    async def execute(self, statement, *args, **kwargs):
+        # SQLite 下 DML 与 SELECT ... FOR UPDATE（SQLite 不支持行锁）都先进入写队列
+        if sqlite_writer is not None and (
+            not getattr(statement, "is_select", False) or getattr(statement, "_for_update_arg", None) is not None
+        ):
+            await _acquire_writer(self.sync_session)
+            try:
+                result = await super().execute(statement, *args, **kwargs)
+            except BaseException:
+                # 事务未能开始时不会触发 after_transaction_end，这里直接释放
+                if not self.in_transaction():
+                    _release_writer(self.sync_session)
+                raise
+        else:
+            result = await super().execute(statement, *args, **kwargs)
+        if not getattr(statement, "is_select", False):
+            self.sync_session.info["tx_writes"] = True
+        return result
+
 
 # 创建异步会话工厂
 async_session = sessionmaker(
     engine,
-    class_=AsyncSession,
+    class_=LazySession,
     expire_on_commit=False,
 )
 
+# 只读副本（可选），连接上的事务均为只读事务
+replica_engine = None
+replica_session = None
+if settings.DATABASE_REPLICA_URL:
+    replica_engine = create_async_engine(
+        settings.DATABASE_REPLICA_URL,
+        echo=False,
+        future=True,
+        poolclass=TimedQueuePool,
+    ).execution_options(postgresql_readonly=True)
+    query_stats.install(replica_engine.sync_engine)
+    replica_session = sessionmaker(
+        replica_engine,
+        class_=LazySession,
+        expire_on_commit=False,
+    )
+
 
 async def get_session():
     """获取数据库会话"""
@@ -28,7 +252,74 @@ async def get_session():
         yield session
 
 
+# 已有表上新增的列和索引（create_all 只创建缺失的表，不会修改已存在的表），启动时补齐
+# 列: (表名, 列名, 列定义)
+ADDED_COLUMNS = [
+    ("licenses", "state_version", "INTEGER NOT NULL DEFAULT 1"),
+    ("licenses", "max_machines", "INTEGER NOT NULL DEFAULT 1"),
+    ("orders", "payment_txn_id", "VARCHAR(64)"),
+]
+# 索引: (表名, 索引名)
+ADDED_INDEXES = [
+    ("licenses", "ix_licenses_key_state"),
+    ("license_flags", "uq_license_flags_open"),
+]
+# 创建唯一索引前清理已有的重复数据: {索引名: SQL}
+INDEX_DEDUPES = {
+    # 每个授权每类告警只保留最新的 open 记录，其余标记为已处理
+    "uq_license_flags_open": """
+        UPDATE license_flags SET status = 'dismissed', resolved_at = CURRENT_TIMESTAMP
+        WHERE status = 'open' AND id NOT IN (
+            SELECT MAX(id) FROM license_flags WHERE status = 'open' GROUP BY license_id, kind
+        )
+    """,
+}
+
+
+def _upgrade_schema(conn):
+    inspector = inspect(conn)
+    for table, column, ddl in ADDED_COLUMNS:
+        if not inspector.has_table(table):
+            continue
+        if column not in {c["name"] for c in inspector.get_columns(table)}:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+    for table, name in ADDED_INDEXES:
+        if not inspector.has_table(table) or name in {i["name"] for i in inspector.get_indexes(table)}:
+            continue
+        if name in INDEX_DEDUPES:
+            conn.execute(text(INDEX_DEDUPES[name]))
+        index = next(i for i in SQLModel.metadata.tables[table].indexes if i.name == name)
+        index.create(conn)
+
+
+# 新建表后的数据迁移: {表名: SQL}，仅在该表首次创建时执行
+NEW_TABLE_BACKFILLS = {
+    # 单设备绑定（licenses.machine_id）迁移到绑定表
+    "license_bindings": """
+        INSERT INTO license_bindings (license_id, machine_id, activated_at, last_seen)
+        SELECT id, machine_id, COALESCE(activated_at, created_at), last_heartbeat
+        FROM licenses WHERE machine_id IS NOT NULL
+    """,
+    # licenses.last_heartbeat 迁移到在线状态表
+    "license_presence": """
+        INSERT INTO license_presence (license_id, last_heartbeat, heartbeat_count)
+        SELECT id, last_heartbeat, 0 FROM licenses WHERE last_heartbeat IS NOT NULL
+    """,
+}
+
+
+def _missing_backfills(conn) -> list:
+    inspector = inspect(conn)
+    if not inspector.has_table("licenses"):
+        return []
+    return [table for table in NEW_TABLE_BACKFILLS if not inspector.has_table(table)]
+
+
 async def init_db():
     """初始化数据库表"""
     async with engine.begin() as conn:
+        await conn.run_sync(_upgrade_schema)
+        backfills = await conn.run_sync(_missing_backfills)
         await conn.run_sync(SQLModel.metadata.create_all)
+        for table in backfills:
+            await conn.execute(text(NEW_TABLE_BACKFILLS[table]))
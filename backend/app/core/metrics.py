@@ -0,0 +1,277 @@
+"""
+运行指标（Prometheus 文本格式）
+不依赖 prometheus_client，提供最小的 Counter / Gauge / Histogram 实现：
+- MetricsMiddleware 按路由模板（如 /api/v1/admin/licenses/{license_id}/extend）记录请求数、状态码和耗时，
+  避免原始路径导致标签基数失控
+- 连接池、缓存命中率等通过回调型 Gauge 在抓取时读取
+指标按进程统计，多 worker 部署时由 Prometheus 分别抓取后聚合
+"""
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# 默认耗时分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """指标基类"""
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """单调递增计数器"""
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def get(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def items(self) -> List[Tuple[Tuple[str, ...], float]]:
+        return list(self._values.items())
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(v)}"
+            for labels, v in sorted(self._values.items())
+        ]
+
+
+class Gauge(Metric):
+    """
+    瞬时值
+    可直接 set/inc/dec，也可传入 callback 在抓取时计算：
+    callback 返回数值（无标签）或 {标签值元组: 数值}
+    """
+    type_name = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        callback: Optional[Callable[[], object]] = None,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._callback = callback
+
+    def set(self, value: float, *labels: str):
+        self._values[labels] = value
+
+    def inc(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels: str, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def get(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self) -> List[str]:
+        values = self._values
+        if self._callback is not None:
+            try:
+                result = self._callback()
+            except Exception:
+                return []
+            if result is None:
+                return []
+            values = result if isinstance(result, dict) else {(): result}
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(v)}"
+            for labels, v in sorted(values.items())
+        ]
+
+
+class Histogram(Metric):
+    """分桶直方图"""
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # {标签值元组: [各桶计数..., 总数, 总和]}
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labels: str):
+        data = self._values.get(labels)
+        if data is None:
+            data = self._values[labels] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                data[i] += 1
+                break
+        data[-2] += 1
+        data[-1] += value
+
+    def samples(self) -> List[str]:
+        lines = []
+        for labels, data in sorted(self._values.items()):
+            cumulative = 0
+            for i, bound in enumerate(self.buckets):
+                cumulative += data[i]
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            inf = _format_labels(self.labelnames, labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{inf} {int(data[-2])}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(data[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {int(data[-2])}")
+        return lines
+
+
+class Registry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(m.render() for m in self._metrics.values()) + "\n"
+
+
+# 全局注册表
+registry = Registry()
+
+http_requests_total = registry.register(Counter(
+    "zentea_http_requests_total", "HTTP 请求数", ("method", "route", "status"),
+))
+http_request_duration = registry.register(Histogram(
+    "zentea_http_request_duration_seconds", "HTTP 请求耗时（秒）", ("method", "route"),
+))
+http_requests_in_flight = registry.register(Gauge(
+    "zentea_http_requests_in_flight", "正在处理的 HTTP 请求数",
+))
+db_pool_wait = registry.register(Histogram(
+    "zentea_db_pool_wait_seconds", "从连接池获取连接的等待时间（秒）",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0),
+))
+cache_requests_total = registry.register(Counter(
+    "zentea_cache_requests_total", "内存缓存访问次数", ("cache", "result"),
+))
+
+
+def record_cache(cache: str, hit: bool):
+    """记录一次缓存访问"""
+    cache_requests_total.inc(cache, "hit" if hit else "miss")
+
+
+def _cache_hit_ratio() -> Dict[Tuple[str, ...], float]:
+    totals: Dict[str, List[float]] = {}
+    for (cache, result), value in cache_requests_total.items():
+        hits_total = totals.setdefault(cache, [0, 0])
+        if result == "hit":
+            hits_total[0] += value
+        hits_total[1] += value
+    return {(cache, ): hits / total for cache, (hits, total) in totals.items() if total}
+
+
+registry.register(Gauge(
+    "zentea_cache_hit_ratio", "内存缓存命中率", ("cache",), callback=_cache_hit_ratio,
+))
+
+
+def register_gauge(name: str, documentation: str, callback: Callable[[], object], labelnames: Sequence[str] = ()):
+    """注册回调型 Gauge（抓取时调用 callback 取值）"""
+    return registry.register(Gauge(name, documentation, labelnames, callback=callback))
+
+
+# ==================== ASGI 中间件 ====================
+
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+class MetricsMiddleware:
+    """按路由模板记录请求数、状态码与耗时"""
+
+    def __init__(self, app):
+        self.app = app
+        # {endpoint 函数: 路由模板}，首次请求时从应用路由表构建
+        self._templates: Optional[Dict[Callable, str]] = None
+
+    def _route_template(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return UNMATCHED_ROUTE
+        if self._templates is None:
+            app = scope.get("app")
+            self._templates = {
+                r.endpoint: r.path
+                for r in getattr(app, "routes", [])
+                if hasattr(r, "endpoint") and hasattr(r, "path")
+            }
+        return self._templates.get(endpoint, UNMATCHED_ROUTE)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_requests_in_flight.dec()
+            route = self._route_template(scope)
+            method = scope.get("method", "")
+            http_requests_total.inc(method, route, str(status))
+            http_request_duration.observe(time.perf_counter() - start, method, route)
@@ -0,0 +1,151 @@
+"""
+SQL 语句统计
+通过 SQLAlchemy 事件统计每个请求执行的语句数和数据库耗时：
+- 非生产环境在响应头中附加 Server-Timing: db;dur=<毫秒>;desc="<语句数> queries"
+- 超过 SLOW_QUERY_MS 的语句写入慢查询日志（参数脱敏，仅记录类型）
+- 同一请求内相同语句重复超过 QUERY_REPEAT_THRESHOLD 次时告警（疑似 N+1）
+"""
+import logging
+import re
+import time
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .config import settings
+from . import metrics
+
+logger = logging.getLogger("zentea.sql")
+
+_WHITESPACE = re.compile(r"\s+")
+
+slow_queries_total = metrics.registry.register(metrics.Counter(
+    "zentea_db_slow_queries_total", "慢查询次数",
+))
+repeated_statements_total = metrics.registry.register(metrics.Counter(
+    "zentea_db_repeated_statement_requests_total", "存在重复语句（疑似 N+1）的请求数",
+))
+
+
+class QueryStats:
+    """单个请求的语句统计"""
+
+    __slots__ = ("count", "duration", "shapes")
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        # {语句: 执行次数}，参数化语句文本即为语句“形状”
+        self.shapes: Dict[str, int] = {}
+
+    def record(self, statement: str, elapsed: float):
+        self.count += 1
+        self.duration += elapsed
+        self.shapes[statement] = self.shapes.get(statement, 0) + 1
+
+
+_current: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+def _normalize(statement: str) -> str:
+    return _WHITESPACE.sub(" ", statement).strip()
+
+
+def redact_parameters(parameters) -> str:
+    """参数脱敏：只保留参数名和类型"""
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{k}=<{type(v).__name__}>" for k, v in parameters.items()) + "}"
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (dict, list, tuple)):
+            # executemany：只记录批量大小和首行结构
+            return f"[{len(parameters)} x {redact_parameters(parameters[0])}]"
+        return "(" + ", ".join(f"<{type(v).__name__}>" for v in parameters) + ")"
+    return f"<{type(parameters).__name__}>"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("query_start")
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+
+    # SQLAlchemy 编译缓存命中情况（DDL、原生 SQL 等不参与缓存的语句不计）
+    if context is not None:
+        if context.cache_hit == context.dialect.CACHE_HIT:
+            metrics.record_cache("sql_compiled", True)
+        elif context.cache_hit == context.dialect.CACHE_MISS:
+            metrics.record_cache("sql_compiled", False)
+
+    record_statement(statement, parameters, elapsed)
+
+
+def record_statement(statement: str, parameters, elapsed: float):
+    """
+    计入当前请求的语句统计并检查慢查询
+    绕过 SQLAlchemy 直接在驱动连接上执行的语句（如 verify_fast）需手动调用
+    """
+    stats = _current.get()
+    if stats is not None:
+        stats.record(statement, elapsed)
+
+    if elapsed * 1000 >= settings.SLOW_QUERY_MS:
+        slow_queries_total.inc()
+        logger.warning(
+            "慢查询 %.1fms: %s 参数: %s",
+            elapsed * 1000, _normalize(statement), redact_parameters(parameters),
+        )
+
+
+def install(engine: Engine):
+    """在同步引擎上注册统计事件"""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _check_repeated(stats: QueryStats, method: str, path: str):
+    threshold = settings.QUERY_REPEAT_THRESHOLD
+    if threshold <= 0:
+        return
+    repeated = [(s, n) for s, n in stats.shapes.items() if n > threshold]
+    if not repeated:
+        return
+    repeated_statements_total.inc()
+    for statement, times in repeated:
+        logger.warning(
+            "疑似 N+1: %s %s 中同一语句执行了 %d 次: %s",
+            method, path, times, _normalize(statement)[:300],
+        )
+
+
+class QueryStatsMiddleware:
+    """为每个请求建立语句统计上下文"""
+
+    def __init__(self, app):
+        self.app = app
+        self._server_timing = not settings.is_production
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+        token = _current.set(stats)
+
+        async def send_wrapper(message):
+            if self._server_timing and message["type"] == "http.response.start":
+                header = f'db;dur={stats.duration * 1000:.1f};desc="{stats.count} queries"'
+                message["headers"] = list(message.get("headers", [])) + [(b"server-timing", header.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            _check_repeated(stats, scope.get("method", ""), scope.get("path", ""))
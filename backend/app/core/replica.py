@@ -0,0 +1,123 @@
+"""
+只读副本路由
+- get_read_session：只读接口使用的会话依赖，副本可用时走副本，否则回退主库
+- 复制延迟定期检测，超过 REPLICA_MAX_LAG_SECONDS 或检测失败时回退主库
+- 读己之写：同一令牌发起写请求后 READ_YOUR_WRITES_SECONDS 内的读请求仍走主库
+  （按进程记录，多 worker 部署时依赖该时间窗口覆盖复制延迟）
+"""
+import asyncio
+import time
+from typing import Dict, Optional
+
+from fastapi import Request
+from sqlalchemy import text
+
+from .config import settings
+from .database import async_session, replica_engine, replica_session
+from . import metrics
+
+# 复制延迟（秒）：主库无新事务时 replay 时间戳不再前进，此时以 LSN 一致判定为无延迟
+REPLICA_LAG_SQL = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+_SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+class ReplicaMonitor:
+    """副本复制延迟检测"""
+
+    def __init__(self):
+        self.lag: Optional[float] = None
+        self.healthy = False
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def _is_fresh(self) -> bool:
+        return time.monotonic() - self._checked_at < settings.REPLICA_LAG_CHECK_SECONDS
+
+    async def is_usable(self) -> bool:
+        """副本是否可用（延迟在阈值内）"""
+        if replica_engine is None:
+            return False
+        if not self._is_fresh():
+            await self._check()
+        return self.healthy
+
+    async def _check(self):
+        async with self._lock:
+            if self._is_fresh():
+                return
+            self._checked_at = time.monotonic()
+            try:
+                async with replica_engine.connect() as conn:
+                    lag = (await conn.execute(REPLICA_LAG_SQL)).scalar()
+                self.lag = float(lag or 0)
+                self.healthy = self.lag <= settings.REPLICA_MAX_LAG_SECONDS
+            except Exception:
+                self.lag = None
+                self.healthy = False
+
+
+replica_monitor = ReplicaMonitor()
+
+metrics.register_gauge(
+    "zentea_db_replica_lag_seconds", "只读副本复制延迟（秒）", lambda: replica_monitor.lag,
+)
+metrics.register_gauge(
+    "zentea_db_replica_usable", "只读副本是否可用（1 可用，0 回退主库）",
+    lambda: int(replica_monitor.healthy) if replica_engine is not None else None,
+)
+
+
+class RecentWriters:
+    """记录最近发起过写请求的令牌"""
+
+    # 超过该数量时清理过期记录
+    SWEEP_THRESHOLD = 10000
+
+    def __init__(self):
+        # {Authorization 头: 截止时间}
+        self._until: Dict[str, float] = {}
+
+    def mark(self, authorization: str):
+        now = time.monotonic()
+        self._until[authorization] = now + settings.READ_YOUR_WRITES_SECONDS
+        if len(self._until) > self.SWEEP_THRESHOLD:
+            self._until = {k: v for k, v in self._until.items() if v > now}
+
+    def is_recent(self, authorization: str) -> bool:
+        until = self._until.get(authorization)
+        return until is not None and until > time.monotonic()
+
+
+recent_writers = RecentWriters()
+
+
+class ReadYourWritesMiddleware:
+    """记录带令牌的写请求，使其后续读请求在时间窗口内走主库"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope.get("method") not in _SAFE_METHODS:
+            for name, value in scope.get("headers", []):
+                if name == b"authorization":
+                    recent_writers.mark(value.decode("latin-1"))
+                    break
+        await self.app(scope, receive, send)
+
+
+async def get_read_session(request: Request):
+    """获取只读接口的数据库会话（副本可用时走副本）"""
+    authorization = request.headers.get("Authorization")
+    use_replica = (
+        replica_session is not None
+        and not (authorization and recent_writers.is_recent(authorization))
+        and await replica_monitor.is_usable()
+    )
+    factory = replica_session if use_replica else async_session
+    async with factory() as session:
+        yield session
@@ -3,24 +3,69 @@ ZenTea License Server - 授权验证服务
 """
 from contextlib import asynccontextmanager
 import secrets
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 
 from app.core.database import init_db
 from app.core.config import settings
+from app.core import metrics, query_stats
+from app.core.replica import ReadYourWritesMiddleware
 from app.api.v1.router import api_router
+from app.api.deps import verify_metrics_access
+from app.services import license_events, verify_snapshot
+from app.services.audit import audit_log
+from app.services.id_generator import node_lease
+from app.services.online import online
+from app.services.payment_notifications import payment_queue
+from app.services.presence import presence
+from app.services.proof_storage import thumbnails
+from app.services.seat_leases import seat_leases
+from app.services.sharing import sharing_detector
 # 导入所有模型以确保表被创建
-from app.models import user, license, order, promo, setting, page  # noqa: F401
+from app.models import user, license, order, promo, setting, page, audit, payment, id_node  # noqa: F401
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """应用生命周期管理"""
+    # 只读边缘验证节点只使用同步过来的验证快照，不连接数据库
+    if settings.LICENSE_SNAPSHOT_EDGE:
+        yield
+        return
     # 启动时初始化数据库
     await init_db()
     # 创建默认管理员（如果不存在）
     await create_default_admin()
+    # 租用 ID 生成节点号
+    await node_lease.start()
+    # 授权变更推送的跨 worker 监听
+    await license_events.hub.start()
+    # 验证快照定期重建
+    await verify_snapshot.builder.start()
+    # 席位租约定期写回
+    await seat_leases.start()
+    # 在线状态批量写入
+    await presence.start()
+    # 仪表盘在线安装统计
+    await online.start()
+    # 授权共享告警写入
+    await sharing_detector.start()
+    # 审计日志批量写入
+    await audit_log.start()
+    # 支付通知写入与处理
+    await payment_queue.start()
     yield
+    await payment_queue.stop()
+    thumbnails.stop()
+    await audit_log.stop()
+    await sharing_detector.stop()
+    await online.stop()
+    await presence.stop()
+    await seat_leases.stop()
+    await verify_snapshot.builder.stop()
+    await license_events.hub.stop()
+    await node_lease.stop()
 
 
 async def create_default_admin():
@@ -83,6 +128,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 只读副本：记录写请求，保证读己之写
+if settings.DATABASE_REPLICA_URL:
+    app.add_middleware(ReadYourWritesMiddleware)
+
+# SQL 语句统计（非生产环境附加 Server-Timing 响应头）
+app.add_middleware(query_stats.QueryStatsMiddleware)
+
+# 监控指标（最外层，统计包含 CORS 在内的完整耗时）
+if settings.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+
 # 注册路由
 app.include_router(api_router, prefix="/api/v1")
 
@@ -91,3 +147,10 @@ app.include_router(api_router, prefix="/api/v1")
 async def health_check():
     """健康检查"""
     return {"status": "ok", "service": "zentea-license"}
+
+
+if settings.METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False, dependencies=[Depends(verify_metrics_access)])
+    async def metrics_endpoint():
+        """监控指标（Prometheus 文本格式）"""
+        return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
@@ -2,10 +2,13 @@
 模型汇总
 """
 from .user import User
-from .license import License, LicenseHeartbeat
+from .license import License, LicenseHeartbeat, LicenseSeatLease, LicenseBinding, LicensePresence, OnlineBucket, LicenseFlag
 from .promo import PromoCampaign
 from .order import Order
 from .setting import SystemSetting
 from .page import Page
+from .audit import AuditEvent
+from .payment import PaymentNotification
+from .id_node import IdNodeLease
 
-__all__ = ["User", "License", "LicenseHeartbeat", "PromoCampaign", "Order", "SystemSetting", "Page"]
+__all__ = ["User", "License", "LicenseHeartbeat", "LicenseSeatLease", "LicenseBinding", "LicensePresence", "OnlineBucket", "LicenseFlag", "PromoCampaign", "Order", "SystemSetting", "Page", "AuditEvent", "PaymentNotification", "IdNodeLease"]
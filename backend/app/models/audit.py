@@ -0,0 +1,36 @@
+"""
+审计日志模型
+记录管理员、订单、系统设置和页面的写操作
+"""
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import Index
+from sqlmodel import SQLModel, Field
+
+
+class AuditEvent(SQLModel, table=True):
+    """
+    审计事件表（只追加，由 services/audit.py 批量写入）
+    按 ID 倒序键集分页，按对象、操作人、操作类型查询各有对应的复合索引
+    """
+    __tablename__ = "audit_events"
+    __table_args__ = (
+        Index("ix_audit_events_target", "target_type", "target_id", "id"),
+        Index("ix_audit_events_actor", "actor_id", "id"),
+        Index("ix_audit_events_action", "action", "id"),
+    )
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    # 操作人（系统自动操作时为空）
+    actor_id: Optional[int] = Field(default=None)
+    actor: Optional[str] = Field(default=None, max_length=50)
+    # 操作，如 license.revoke、order.reject
+    action: str = Field(max_length=64)
+    # 操作对象
+    target_type: str = Field(max_length=32)
+    target_id: Optional[str] = Field(default=None, max_length=64)
+    # 变更字段 JSON：{"字段": [变更前, 变更后]}
+    changes: Optional[str] = Field(default=None)
+    # 附加说明（吊销原因、审核备注等）
+    detail: Optional[str] = Field(default=None)
@@ -0,0 +1,16 @@
+"""
+ID 生成节点租约模型
+每个 worker 启动时租用一个节点号（见 services/id_generator.py），保证订单号全局不重复
+"""
+from datetime import datetime
+from sqlmodel import SQLModel, Field
+
+
+class IdNodeLease(SQLModel, table=True):
+    """ID 生成节点租约表：节点号唯一，持有者定期续租，过期后可被其他 worker 接管"""
+    __tablename__ = "id_node_leases"
+
+    node_id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+    # 持有者：主机名:进程号:随机令牌
+    owner: str = Field(max_length=128)
+    expires_at: datetime
@@ -3,12 +3,22 @@
 """
 from typing import Optional
 from datetime import datetime
+from sqlalchemy import DDL, Index, event, inspect, text
 from sqlmodel import SQLModel, Field
 
 
 class License(SQLModel, table=True):
     """授权表"""
     __tablename__ = "licenses"
+    __table_args__ = (
+        # 条件验证（state_version）的窄查询：PostgreSQL 下可走仅索引扫描
+        Index(
+            "ix_licenses_key_state", "license_key",
+            postgresql_include=["id", "state_version", "status", "machine_id", "expire_date"],
+        ).ddl_if(dialect="postgresql"),
+    )
+    # state_version 在 UPDATE 中以 SQL 表达式递增，刷新后立即取回新值（避免异步会话中的延迟加载）
+    __mapper_args__ = {"eager_defaults": True}
     
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(foreign_key="users.id", index=True)
@@ -24,20 +34,57 @@ class License(SQLModel, table=True):
     # 状态：pending（待激活）, active（已激活）, expired（已过期）, revoked（已吊销）
     status: str = Field(default="pending", max_length=20, index=True)
     
-    # 机器绑定
+    # 机器绑定：首台（仍在绑定中的最早一台）设备，完整的绑定列表见 LicenseBinding
     machine_id: Optional[str] = Field(default=None, max_length=64, index=True)
     
     # 时间
     created_at: datetime = Field(default_factory=datetime.utcnow)
     activated_at: Optional[datetime] = Field(default=None)
     expire_date: Optional[datetime] = Field(default=None, index=True)
-    last_heartbeat: Optional[datetime] = Field(default=None)
+    # 最近心跳时间等高频更新的数据见 LicensePresence（旧库中的 last_heartbeat 列不再写入）
     
     # 限制
     max_users: int = Field(default=5, description="最大用户数")
+    max_machines: int = Field(default=1, sa_column_kwargs={"server_default": "1"}, description="最大绑定设备数")
     
     # 备注
     notes: Optional[str] = Field(default=None, max_length=1000)
+    
+    # 状态版本：影响客户端的字段（STATE_FIELDS）每次变更时递增，客户端据此做条件验证
+    state_version: int = Field(default=1, sa_column_kwargs={"server_default": "1"})
+
+
+# 客户端可见的授权状态字段
+STATE_FIELDS = ("status", "machine_id", "expire_date", "plan_type", "max_users")
+
+
+@event.listens_for(License, "before_update")
+def _bump_state_version(mapper, connection, target):
+    """状态字段有变更时在数据库端递增 state_version（并发修改也不会得到相同版本号）"""
+    attrs = inspect(target).attrs
+    if any(attrs[name].history.has_changes() for name in STATE_FIELDS):
+        target.state_version = License.state_version + 1
+
+
+def bump_state_version(license: License):
+    """绑定设备增减等不体现在 STATE_FIELDS 中的变更，显式递增 state_version"""
+    license.state_version = License.state_version + 1
+
+
+class LicenseBinding(SQLModel, table=True):
+    """授权绑定的设备（站点授权可绑定多台，上限为 License.max_machines）"""
+    __tablename__ = "license_bindings"
+    __table_args__ = (
+        # 验证时按 (授权, 机器码) 唯一索引探测，与绑定设备数无关
+        Index("ux_license_bindings_license_machine", "license_id", "machine_id", unique=True),
+    )
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    license_id: int = Field(foreign_key="licenses.id")
+    machine_id: str = Field(max_length=64)
+    activated_at: datetime = Field(default_factory=datetime.utcnow)
+    # 最近一次验证时间
+    last_seen: Optional[datetime] = Field(default=None)
 
 
 class LicenseHeartbeat(SQLModel, table=True):
@@ -49,3 +96,85 @@ class LicenseHeartbeat(SQLModel, table=True):
     machine_id: str = Field(max_length=64)
     ip_address: str = Field(max_length=45)
     created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class LicenseSeatLease(SQLModel, table=True):
+    """并发用户席位租约表（内存租约表的持久化检查点，见 services/seat_leases.py）"""
+    __tablename__ = "license_seat_leases"
+    
+    # 租约 ID（随机令牌，续租/归还时使用）
+    id: str = Field(primary_key=True, max_length=64)
+    license_id: int = Field(foreign_key="licenses.id", index=True)
+    # 客户端标识（ERP 登录用户或会话），同一客户端重复领取时复用租约
+    client_id: str = Field(max_length=64)
+    machine_id: str = Field(max_length=64)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    # 到期时间：内存中的续租定期写回，可能落后至多一个检查点间隔
+    expires_at: datetime = Field(index=True)
+
+
+class LicensePresence(SQLModel, table=True):
+    """
+    授权在线状态（最近心跳时间、IP、心跳次数）
+    心跳只更新这张窄表（由 services/presence.py 批量写入），不再改写 licenses 宽行；
+    除主键外不建索引，PostgreSQL 下降低 fillfactor，便于 HOT 更新；
+    不设外键：授权删除后缓冲中尚未写入的心跳不会使整批写入失败
+    """
+    __tablename__ = "license_presence"
+    
+    license_id: int = Field(primary_key=True)
+    last_heartbeat: Optional[datetime] = Field(default=None)
+    last_ip: Optional[str] = Field(default=None, max_length=45)
+    heartbeat_count: int = Field(default=0)
+
+
+event.listen(
+    LicensePresence.__table__,
+    "after_create",
+    DDL(
+        "ALTER TABLE license_presence "
+        "SET (fillfactor = 50, autovacuum_vacuum_scale_factor = 0.02, autovacuum_analyze_scale_factor = 0.05)"
+    ).execute_if(dialect="postgresql"),
+)
+
+
+class OnlineBucket(SQLModel, table=True):
+    """在线设备统计的分钟桶（各 worker 定期写入本进程的统计，读取时合并，见 services/online.py）"""
+    __tablename__ = "online_buckets"
+    
+    # 写入进程的随机标识
+    node: str = Field(primary_key=True, max_length=32)
+    # Unix 时间（分钟）
+    minute: int = Field(primary_key=True, index=True)
+    payload: bytes
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class LicenseFlag(SQLModel, table=True):
+    """
+    授权共享告警（由 services/sharing.py 在内存中检测后写入）
+    不设外键：授权删除后缓冲中尚未写入的告警不会使整批写入失败
+    同一授权同类告警最多一条 open 记录（部分唯一索引），多个 worker 检测到同一事件时以 upsert 合并
+    """
+    __tablename__ = "license_flags"
+    __table_args__ = (
+        Index(
+            "uq_license_flags_open", "license_id", "kind", unique=True,
+            postgresql_where=text("status = 'open'"), sqlite_where=text("status = 'open'"),
+        ),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    license_id: int = Field(index=True)
+    # 告警类型：many_ips（窗口内不同 IP 过多）/ machine_flips（机器码频繁切换）
+    kind: str = Field(max_length=32)
+    # 观测值、阈值、窗口（秒）
+    observed: int
+    threshold: int
+    window_seconds: int
+    detail: Optional[str] = Field(default=None, max_length=500)
+    # open（待处理）/ dismissed（已处理）
+    status: str = Field(default="open", max_length=16, index=True)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    resolved_at: Optional[datetime] = Field(default=None)
@@ -28,6 +28,9 @@ class Order(SQLModel, table=True):
     # 支付方式：manual（手动审核）, alipay（支付宝）, wechat（微信）
     payment_method: Optional[str] = Field(default=None, max_length=20)
     
+    # 支付平台交易号（支付宝/微信支付异步通知完成的订单）
+    payment_txn_id: Optional[str] = Field(default=None, max_length=64)
+    
     # 支付时间
     paid_at: Optional[datetime] = Field(default=None)
     
@@ -0,0 +1,41 @@
+"""
+支付通知模型
+支付宝/微信支付异步通知验签后原样保存，由 services/payment_notifications.py 的后台任务处理
+"""
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import Index, UniqueConstraint
+from sqlmodel import SQLModel, Field
+
+
+class PaymentNotification(SQLModel, table=True):
+    """
+    支付通知表
+    (provider, txn_id) 唯一：支付平台重试的同一笔交易只保存一行、只处理一次
+    不设外键：通知先于订单校验写入，订单号可能无效
+    """
+    __tablename__ = "payment_notifications"
+    __table_args__ = (
+        UniqueConstraint("provider", "txn_id", name="uq_payment_notifications_txn"),
+        Index("ix_payment_notifications_status", "status", "id"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    # 支付渠道：alipay / wechat / stub（本地测试网关）
+    provider: str = Field(max_length=16)
+    # 支付平台交易号
+    txn_id: str = Field(max_length=64)
+    # 商户订单号（orders.order_no）
+    order_no: str = Field(max_length=50, index=True)
+    # 实付金额（分）
+    amount_cents: int
+    # 原始通知内容
+    raw: str
+    # pending（待处理）/ processing（处理中）/ processed（已完成订单）/ failed（无法处理，需人工核对）
+    status: str = Field(default="pending", max_length=16)
+    attempts: int = Field(default=0)
+    error: Optional[str] = Field(default=None, max_length=500)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    # 最近一次领取处理的时间（处理中的通知超时后可被重新领取）
+    claimed_at: Optional[datetime] = Field(default=None)
+    processed_at: Optional[datetime] = Field(default=None)
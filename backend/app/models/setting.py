@@ -55,6 +55,16 @@ class SettingKeys:
     SERVER_MODE = "server_mode"  # local / production
     SERVER_URL = "server_url"    # 当前服务器地址
     
+    # 客户端心跳间隔策略（/license/verify、/license/activate 返回的 next_check_in）
+    HEARTBEAT_BASE_SECONDS = "heartbeat_base_seconds"
+    HEARTBEAT_MIN_SECONDS = "heartbeat_min_seconds"
+    HEARTBEAT_MAX_SECONDS = "heartbeat_max_seconds"
+    HEARTBEAT_LIFETIME_FACTOR = "heartbeat_lifetime_factor"
+    HEARTBEAT_LOAD_MAX_FACTOR = "heartbeat_load_max_factor"
+    HEARTBEAT_INFLIGHT_HIGH = "heartbeat_inflight_high"
+    HEARTBEAT_SHED_FACTOR = "heartbeat_shed_factor"
+    HEARTBEAT_JITTER = "heartbeat_jitter"
+    
     # ============ 首页配置 ============
     # Hero 区（首屏）
     HOME_HERO_TITLE = "home_hero_title"
@@ -137,6 +147,15 @@ DEFAULT_SETTINGS = [
     # 服务器模式
     {"key": SettingKeys.SERVER_MODE, "value": "local", "description": "运行模式: local=本地调试, production=生产环境", "category": "server"},
     {"key": SettingKeys.SERVER_URL, "value": "http://localhost:8001", "description": "当前服务器地址", "category": "server"},
+    # 心跳间隔策略
+    {"key": SettingKeys.HEARTBEAT_BASE_SECONDS, "value": "1800", "description": "基础心跳间隔（秒）", "category": "heartbeat"},
+    {"key": SettingKeys.HEARTBEAT_MIN_SECONDS, "value": "300", "description": "最短心跳间隔（秒）", "category": "heartbeat"},
+    {"key": SettingKeys.HEARTBEAT_MAX_SECONDS, "value": "21600", "description": "最长心跳间隔（秒）", "category": "heartbeat"},
+    {"key": SettingKeys.HEARTBEAT_LIFETIME_FACTOR, "value": "4", "description": "无到期日授权的间隔倍数", "category": "heartbeat"},
+    {"key": SettingKeys.HEARTBEAT_LOAD_MAX_FACTOR, "value": "4", "description": "服务器满载时的间隔倍数上限", "category": "heartbeat"},
+    {"key": SettingKeys.HEARTBEAT_INFLIGHT_HIGH, "value": "200", "description": "视为满载的并发请求数", "category": "heartbeat"},
+    {"key": SettingKeys.HEARTBEAT_SHED_FACTOR, "value": "1", "description": "人工降载倍数（故障期间调大以减少心跳）", "category": "heartbeat"},
+    {"key": SettingKeys.HEARTBEAT_JITTER, "value": "0.2", "description": "随机抖动比例（打散同时上线的客户端）", "category": "heartbeat"},
     # ============ 首页配置 ============
     # Hero 区（首屏）
     {"key": SettingKeys.HOME_HERO_TITLE, "value": "茶企专属 ERP 管理系统", "description": "首页主标题", "category": "homepage"},
@@ -0,0 +1,161 @@
+"""
+审计日志
+管理员、订单、系统设置和页面的写操作提交后调用 audit_log.record()，事件先进入内存队列，
+后台任务每 AUDIT_FLUSH_SECONDS 批量写入 audit_events（一条 executemany），请求不等待写入：
+- 只追加，不修改、不删除；操作记录不再追加到 License.notes / Order.notes
+- changes 只保存前后不同的字段；密码不记录，敏感设置脱敏，长文本只记录摘要
+- 写入失败时事件保留在队列中重试，超过 MAX_PENDING 时丢弃最早的事件并计数；
+  进程退出时写入剩余事件，异常退出最多丢失一个间隔内的事件
+"""
+import asyncio
+import hashlib
+import json
+import logging
+from collections import deque
+from datetime import date, datetime
+from typing import Any, Deque, Dict, List, Optional
+
+from app.core import metrics
+from app.core.config import settings
+from app.core.database import async_session
+from app.models.audit import AuditEvent
+from app.models.user import User
+
+logger = logging.getLogger("zentea.audit")
+
+# 内存队列上限（数据库长时间不可用时）
+MAX_PENDING = 100000
+
+# 各类对象记录变更的字段
+CUSTOMER_FIELDS = ("username", "email", "is_active", "company_name", "contact_name", "phone", "address")
+ADMIN_FIELDS = ("username", "email", "is_active")
+LICENSE_FIELDS = ("user_id", "license_key", "plan_type", "status", "expire_date", "max_users", "max_machines", "notes")
+ORDER_FIELDS = (
+    "order_no", "user_id", "plan_type", "amount", "status", "payment_method", "payment_txn_id", "payment_proof",
+    "promo_code", "license_id", "paid_at",
+)
+PROMO_FIELDS = ("name", "code", "description", "start_date", "end_date", "max_uses", "is_active")
+PAGE_FIELDS = ("slug", "title", "subtitle", "meta_description", "status", "sort_order")
+
+audit_events_total = metrics.registry.register(metrics.Counter(
+    "zentea_audit_events_total", "审计事件数", ("result",),
+))
+
+
+def _jsonable(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def snapshot(obj: Any, fields) -> Dict[str, Any]:
+    """读取对象的字段值（记录变更前后）"""
+    return {field: _jsonable(getattr(obj, field)) for field in fields}
+
+
+def digest(text: Optional[str]) -> Optional[str]:
+    """长文本摘要（只判断是否变化）"""
+    if text is None:
+        return None
+    return f"sha1:{hashlib.sha1(text.encode()).hexdigest()[:12]} ({len(text)} 字符)"
+
+
+def diff(before: Optional[Dict[str, Any]], after: Optional[Dict[str, Any]]) -> Dict[str, List[Any]]:
+    """{"字段": [变更前, 变更后]}，只包含不同的字段"""
+    before, after = before or {}, after or {}
+    return {
+        key: [before.get(key), after.get(key)]
+        for key in sorted(before.keys() | after.keys())
+        if before.get(key) != after.get(key)
+    }
+
+
+class AuditLog:
+    """审计事件写队列"""
+
+    def __init__(self):
+        self._pending: Deque[dict] = deque()
+        self._insert = AuditEvent.__table__.insert()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def record(
+        self,
+        actor: Optional[User],
+        action: str,
+        target_type: str,
+        target_id: Any = None,
+        before: Optional[Dict[str, Any]] = None,
+        after: Optional[Dict[str, Any]] = None,
+        detail: Optional[str] = None,
+    ):
+        """记录一次操作（只写内存队列）；before/after 为 snapshot() 的结果，新建时只传 after，删除时只传 before"""
+        changes = diff(before, after)
+        if len(self._pending) >= MAX_PENDING:
+            self._pending.popleft()
+            audit_events_total.inc("dropped")
+        self._pending.append({
+            "created_at": datetime.utcnow(),
+            "actor_id": actor.id if actor is not None else None,
+            "actor": actor.username if actor is not None else None,
+            "action": action,
+            "target_type": target_type,
+            "target_id": str(target_id) if target_id is not None else None,
+            "changes": json.dumps(changes, ensure_ascii=False, default=str) if changes else None,
+            "detail": detail,
+        })
+
+    async def flush(self):
+        """写入队列中的事件"""
+        if not self._pending:
+            return
+        batch = list(self._pending)
+        self._pending.clear()
+        try:
+            async with async_session() as session:
+                await session.execute(self._insert, batch)
+                await session.commit()
+        except BaseException:
+            self._pending.extendleft(reversed(batch))
+            raise
+        audit_events_total.inc("written", amount=len(batch))
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.AUDIT_FLUSH_SECONDS)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("审计日志写入失败，下次重试")
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止后台任务，并写入剩余事件"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("审计日志写入失败")
+
+
+# 全局单例
+audit_log = AuditLog()
+
+metrics.register_gauge(
+    "zentea_audit_events_pending", "等待批量写入的审计事件数", lambda: audit_log.pending_count,
+)
@@ -0,0 +1,85 @@
+"""
+授权设备绑定
+每台设备在 license_bindings 中占一行，站点授权可绑定多台（上限为 License.max_machines）；
+licenses.machine_id 保留为首台设备，供列表展示和只认单设备的旧逻辑使用。
+验证时按 (license_id, machine_id) 唯一索引探测（见 services/lookups.py），与绑定设备数无关。
+"""
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import bindparam
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select
+
+from app.models.license import License, LicenseBinding, bump_state_version
+
+_bindings = LicenseBinding.__table__
+
+# 更新设备的最近验证时间（由 services/presence.py 批量执行）
+TOUCH_BINDING = (
+    _bindings.update()
+    .where(_bindings.c.license_id == bindparam("b_license_id"), _bindings.c.machine_id == bindparam("b_machine_id"))
+    .values(last_seen=bindparam("b_now"))
+)
+
+
+async def machine_ids(session: AsyncSession, license_id: int) -> List[str]:
+    """授权已绑定的机器码（按绑定先后）"""
+    result = await session.execute(
+        select(LicenseBinding.machine_id)
+        .where(LicenseBinding.license_id == license_id)
+        .order_by(LicenseBinding.activated_at, LicenseBinding.id)
+    )
+    return list(result.scalars().all())
+
+
+async def list_bindings(session: AsyncSession, license_id: int) -> List[dict]:
+    """授权的绑定设备列表（管理后台、门户展示）"""
+    result = await session.execute(
+        select(LicenseBinding)
+        .where(LicenseBinding.license_id == license_id)
+        .order_by(LicenseBinding.activated_at, LicenseBinding.id)
+    )
+    return [
+        {
+            "machine_id": b.machine_id,
+            "activated_at": b.activated_at.isoformat() if b.activated_at else None,
+            "last_seen": b.last_seen.isoformat() if b.last_seen else None,
+        }
+        for b in result.scalars().all()
+    ]
+
+
+async def bind(session: AsyncSession, license: License, machine_id: str, now: datetime) -> bool:
+    """
+    绑定设备（由调用方提交），已达 max_machines 上限时返回 False
+    锁定授权行后再统计，并发激活不会超出上限
+    """
+    await session.execute(select(License.id).where(License.id == license.id).with_for_update())
+    bound = await machine_ids(session, license.id)
+    if machine_id in bound:
+        return True
+    if len(bound) >= max(license.max_machines, 1):
+        return False
+    session.add(LicenseBinding(license_id=license.id, machine_id=machine_id, activated_at=now, last_seen=now))
+    if license.machine_id is None:
+        license.machine_id = machine_id
+    bump_state_version(license)
+    return True
+
+
+async def unbind(session: AsyncSession, license: License, machine_id: Optional[str] = None) -> List[str]:
+    """解绑指定设备（machine_id 为空时解绑全部，由调用方提交），返回被解绑的机器码"""
+    bound = await machine_ids(session, license.id)
+    removed = [m for m in bound if machine_id is None or m == machine_id]
+    if not removed:
+        return []
+    stmt = _bindings.delete().where(_bindings.c.license_id == license.id)
+    if machine_id is not None:
+        stmt = stmt.where(_bindings.c.machine_id == machine_id)
+    await session.execute(stmt)
+    remaining = [m for m in bound if m not in removed]
+    if license.machine_id not in remaining:
+        license.machine_id = remaining[0] if remaining else None
+    bump_state_version(license)
+    return removed
@@ -0,0 +1,84 @@
+"""
+心跳日志去重
+客户端每次验证都写一行 license_heartbeats，绝大多数与上一行相同（同一设备、同一 IP，只差一个心跳间隔）。
+这里按 (授权, 设备) 在内存中记录最近一次写日志时的 IP 指纹和时间，只在以下情况写日志：
+- 本进程首次见到该授权的该设备
+- IP 与该设备最近一次写日志时不同
+- 距最近一次写日志已超过 HEARTBEAT_LOG_DEDUP_SECONDS（仍保留按时间的在线轨迹）
+跳过的心跳只计数（最近心跳时间仍由 services/presence.py 记录）。HEARTBEAT_LOG_DEDUP_SECONDS=0 时每次都写。
+
+映射以 (授权码, 设备) 的哈希为键（不保存授权码字符串），值为一个整数：高 32 位为 IP 的 CRC32 指纹，
+低 32 位为写日志时的 Unix 秒。多设备授权（max_machines > 1）的各台设备分别去重，交替心跳不会互相打断。
+各 worker 分别去重，同一设备在一个窗口内最多写 worker 数行。
+跟踪的设备数超过 MAX_TRACKED_MACHINES 时淘汰最久未写日志的设备（被淘汰的设备下次心跳按首次见到处理）。
+"""
+import zlib
+from collections import OrderedDict
+
+from app.core import metrics
+from app.core.config import settings
+
+_TIME_MASK = 0xFFFFFFFF
+MAX_TRACKED_MACHINES = 500000
+
+heartbeat_log_total = metrics.registry.register(metrics.Counter(
+    "zentea_heartbeat_log_total", "心跳日志写入/跳过次数", ("result",),
+))
+
+
+def _fingerprint(ip_address: str) -> int:
+    return zlib.crc32(ip_address.encode())
+
+
+class HeartbeatLogFilter:
+    """按授权的每台设备去重心跳日志"""
+
+    def __init__(self):
+        # {hash((授权码, 设备)): IP 指纹 << 32 | 写日志时间}，按写日志时间排序（最久的在前）
+        self._last: "OrderedDict[int, int]" = OrderedDict()
+
+    @property
+    def tracked_count(self) -> int:
+        return len(self._last)
+
+    def should_log(self, license_key: str, machine_id: str, ip_address: str, now: float) -> bool:
+        """
+        本次心跳是否需要写日志（now 为 Unix 秒）；返回 True 时即记为已写入
+        """
+        window = settings.HEARTBEAT_LOG_DEDUP_SECONDS
+        if window <= 0:
+            heartbeat_log_total.inc("logged_all")
+            return True
+        fingerprint = _fingerprint(ip_address)
+        seconds = int(now) & _TIME_MASK
+        key = hash((license_key, machine_id))
+        packed = self._last.get(key)
+        if packed is None:
+            result = "logged_first"
+        elif packed >> 32 != fingerprint:
+            result = "logged_changed"
+        elif (seconds - (packed & _TIME_MASK)) & _TIME_MASK >= window:
+            result = "logged_interval"
+        else:
+            heartbeat_log_total.inc("skipped")
+            return False
+        self._last[key] = fingerprint << 32 | seconds
+        if packed is None:
+            if len(self._last) > MAX_TRACKED_MACHINES:
+                self._last.popitem(last=False)
+        else:
+            self._last.move_to_end(key)
+        heartbeat_log_total.inc(result)
+        return True
+
+    def forget(self, license_key: str, machine_id: str):
+        """心跳最终未写日志（授权无效等）时撤销记录，下一次心跳重新判定"""
+        self._last.pop(hash((license_key, machine_id)), None)
+
+
+# 全局单例
+heartbeat_log = HeartbeatLogFilter()
+
+metrics.register_gauge(
+    "zentea_heartbeat_log_tracked", "心跳日志去重跟踪的设备数", lambda: heartbeat_log.tracked_count,
+)
@@ -0,0 +1,119 @@
+"""
+客户端心跳间隔策略
+/license/verify 和 /license/activate 返回 next_check_in（秒），ERP 客户端按该值安排下一次心跳：
+- 授权状态：无到期日的授权间隔放大；临近到期时不超过距到期的剩余时间，保证到期后能及时发现
+- 服务器负载：连接池使用率或并发请求数超过一半时按比例放大间隔，满载时达到上限倍数
+- 人工降载：故障期间运维可调大 heartbeat_shed_factor，立即降低心跳量
+- 随机抖动：避免同时启动的客户端长期保持同步
+策略参数保存在系统设置（category=heartbeat）中，修改后立即失效本进程缓存，其他 worker 在 TTL 内同步；
+只读边缘验证节点（LICENSE_SNAPSHOT_EDGE）不连接数据库，始终使用默认策略
+"""
+import asyncio
+import random
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+from sqlmodel import select
+
+from app.core import metrics
+from app.core.config import settings
+from app.core.database import async_session, pool_utilization
+from app.models.setting import SettingKeys, SystemSetting
+
+# 默认策略（与 DEFAULT_SETTINGS 一致，设置缺失或格式错误时使用）
+DEFAULT_POLICY: Dict[str, float] = {
+    SettingKeys.HEARTBEAT_BASE_SECONDS: 1800,
+    SettingKeys.HEARTBEAT_MIN_SECONDS: 300,
+    SettingKeys.HEARTBEAT_MAX_SECONDS: 21600,
+    SettingKeys.HEARTBEAT_LIFETIME_FACTOR: 4,
+    SettingKeys.HEARTBEAT_LOAD_MAX_FACTOR: 4,
+    SettingKeys.HEARTBEAT_INFLIGHT_HIGH: 200,
+    SettingKeys.HEARTBEAT_SHED_FACTOR: 1,
+    SettingKeys.HEARTBEAT_JITTER: 0.2,
+}
+
+# 负载低于该比例时不放大间隔
+LOAD_THRESHOLD = 0.5
+
+
+class HeartbeatPolicy:
+    """心跳间隔策略（参数缓存在内存中）"""
+
+    def __init__(self):
+        self._values: Dict[str, float] = dict(DEFAULT_POLICY)
+        self._loaded_at: float = 0
+        self._stale = True
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        """标记缓存失效（管理员修改系统设置后调用）"""
+        self._stale = True
+
+    def _is_expired(self) -> bool:
+        return self._stale or time.monotonic() - self._loaded_at > settings.HEARTBEAT_POLICY_TTL_SECONDS
+
+    async def _ensure_loaded(self):
+        if settings.LICENSE_SNAPSHOT_EDGE:
+            return
+        if not self._is_expired():
+            metrics.record_cache("heartbeat_policy", True)
+            return
+        metrics.record_cache("heartbeat_policy", False)
+        async with self._lock:
+            if not self._is_expired():
+                return
+            self._stale = False
+            async with async_session() as session:
+                result = await session.execute(
+                    select(SystemSetting.key, SystemSetting.value).where(
+                        SystemSetting.key.in_(list(DEFAULT_POLICY))
+                    )
+                )
+                rows = result.all()
+            values = dict(DEFAULT_POLICY)
+            for key, value in rows:
+                try:
+                    values[key] = float(value)
+                except (TypeError, ValueError):
+                    pass
+            self._values = values
+            self._loaded_at = time.monotonic()
+
+    def load_factor(self) -> float:
+        """当前负载对应的间隔倍数（1 ~ heartbeat_load_max_factor）"""
+        inflight_high = self._values[SettingKeys.HEARTBEAT_INFLIGHT_HIGH]
+        inflight = metrics.http_requests_in_flight.get() / inflight_high if inflight_high > 0 else 0
+        load = min(1.0, max(pool_utilization(), inflight))
+        if load <= LOAD_THRESHOLD:
+            return 1.0
+        max_factor = max(1.0, self._values[SettingKeys.HEARTBEAT_LOAD_MAX_FACTOR])
+        return 1 + (max_factor - 1) * (load - LOAD_THRESHOLD) / (1 - LOAD_THRESHOLD)
+
+    async def next_check_in(self, expire_date: Optional[datetime]) -> int:
+        """计算下一次心跳间隔（秒）"""
+        await self._ensure_loaded()
+        v = self._values
+        interval = v[SettingKeys.HEARTBEAT_BASE_SECONDS]
+        if expire_date is None:
+            interval *= v[SettingKeys.HEARTBEAT_LIFETIME_FACTOR]
+        interval *= self.load_factor() * max(v[SettingKeys.HEARTBEAT_SHED_FACTOR], 0)
+
+        jitter = min(max(v[SettingKeys.HEARTBEAT_JITTER], 0), 1)
+        interval *= random.uniform(1 - jitter, 1 + jitter)
+
+        # 临近到期：到期后尽快再检查一次（服务器降载时仍以到期时间为准）
+        if expire_date is not None:
+            interval = min(interval, (expire_date - datetime.utcnow()).total_seconds())
+
+        low = v[SettingKeys.HEARTBEAT_MIN_SECONDS]
+        high = max(low, v[SettingKeys.HEARTBEAT_MAX_SECONDS])
+        return int(min(max(interval, low), high))
+
+
+# 全局单例
+heartbeat_policy = HeartbeatPolicy()
+
+metrics.register_gauge(
+    "zentea_heartbeat_load_factor", "按当前负载计算的心跳间隔倍数", heartbeat_policy.load_factor,
+)
@@ -0,0 +1,300 @@
+"""
+ID 生成服务
+统一生成授权码和订单号：
+- 授权码：ZT-{套餐}-{时间戳}{随机段}{校验位}，按时间递增，插入唯一索引时集中在尾部；
+  末位为 Luhn mod 32 校验位，格式错误的授权码无需查库即可拒绝
+- 订单号：ORD{时间}{毫秒}{节点}{序号}，同一节点内严格递增，不依赖随机数避免碰撞
+节点号由每个 worker 启动时从 id_node_leases 租用（node_lease.start()），不同 worker 不会同时持有同一节点号；
+租约未能按时续期时停止生成订单号，直到续租或重新租用成功；未启动租约的脚本使用按主机名和进程号派生的节点号
+"""
+import asyncio
+import logging
+import os
+import random
+import secrets
+import socket
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from sqlalchemy import update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app.core.config import settings
+from app.core.database import async_session, engine
+from app.models.id_node import IdNodeLease
+
+logger = logging.getLogger("zentea.id")
+
+# Crockford Base32（去掉 I L O U，避免人工抄录混淆）
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+_CHAR_INDEX = {c: i for i, c in enumerate(ALPHABET)}
+
+# 授权码主体：10 位时间戳（毫秒，48 bit）+ 12 位随机（60 bit）+ 1 位校验
+KEY_TIME_LEN = 10
+KEY_RANDOM_LEN = 12
+KEY_BODY_LEN = KEY_TIME_LEN + KEY_RANDOM_LEN + 1
+
+# 旧版授权码主体：uuid4 hex 前 16 位（大写）
+LEGACY_KEY_BODY_LEN = 16
+_HEX_CHARS = set("0123456789ABCDEF")
+
+# 节点号 20 bit（实例 10 bit + worker 10 bit），每毫秒序号 10 bit
+NODE_BITS = 20
+WORKER_BITS = 10
+SEQ_BITS = 10
+
+# 每次租用最多尝试的节点号数（派生节点号 + 随机候选）
+LEASE_PROBES = 64
+# 本地判定租约到期时只使用租约时长的这一比例，抵消主机之间的时钟偏差
+LEASE_SAFETY_RATIO = 0.9
+# 续租失败后的重试间隔（秒）
+LEASE_RETRY_SECONDS = 5
+
+
+def _encode(value: int, length: int) -> str:
+    """定长 Base32 编码（高位在前，保证字典序与数值序一致）"""
+    chars = []
+    for _ in range(length):
+        chars.append(ALPHABET[value & 31])
+        value >>= 5
+    return "".join(reversed(chars))
+
+
+def luhn_mod32_check_char(body: str) -> str:
+    """计算 Luhn mod 32 校验位（可检出单字符错误和相邻字符互换）"""
+    factor = 2
+    total = 0
+    for c in reversed(body):
+        addend = factor * _CHAR_INDEX[c]
+        factor = 1 if factor == 2 else 2
+        total += addend // 32 + addend % 32
+    return ALPHABET[(32 - total % 32) % 32]
+
+
+def _instance_bits() -> int:
+    """实例号（ID_NODE_ID，未指定时取主机名哈希）"""
+    if settings.ID_NODE_ID >= 0:
+        return settings.ID_NODE_ID % (1 << (NODE_BITS - WORKER_BITS))
+    return zlib.crc32(socket.gethostname().encode()) & 0x3FF
+
+
+def _default_node_id() -> int:
+    """
+    派生节点号：高 10 bit 为实例号，低 10 bit 取进程号
+    不保证唯一，只用于未租用节点号时（脚本、租约获取失败）
+    """
+    return (_instance_bits() << WORKER_BITS) | (os.getpid() & ((1 << WORKER_BITS) - 1))
+
+
+class NodeLeaseExpired(RuntimeError):
+    """节点号租约已过期（续租失败），不能再生成订单号"""
+
+
+class IdGenerator:
+    """时间有序的 ID 生成器"""
+
+    def __init__(self, node_id: int = None):
+        self._node_id = _default_node_id() if node_id is None else node_id
+        # 节点号租约的本地到期时间（time.monotonic()），None 表示未使用租约
+        self._valid_until: Optional[float] = None
+        self._last_ms = 0
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    @property
+    def node_id(self) -> int:
+        return self._node_id
+
+    def set_lease(self, node_id: int, valid_until: Optional[float]):
+        """使用租用的节点号，valid_until 之后停止生成订单号"""
+        with self._lock:
+            self._node_id = node_id
+            self._valid_until = valid_until
+
+    def _next_tick(self) -> Tuple[int, int]:
+        """
+        获取 (毫秒时间戳, 序号)
+        同一毫秒内序号递增，序号用尽则等待下一毫秒；时钟回拨时沿用上次的时间戳
+        """
+        with self._lock:
+            now_ms = int(time.time() * 1000)
+            if now_ms <= self._last_ms:
+                now_ms = self._last_ms
+                self._seq += 1
+                if self._seq >= (1 << SEQ_BITS):
+                    now_ms += 1
+                    self._seq = 0
+            else:
+                self._seq = 0
+            self._last_ms = now_ms
+            return now_ms, self._seq
+
+    def license_key(self, plan_type: str) -> str:
+        """生成授权码"""
+        now_ms, _ = self._next_tick()
+        body = _encode(now_ms, KEY_TIME_LEN) + "".join(
+            secrets.choice(ALPHABET) for _ in range(KEY_RANDOM_LEN)
+        )
+        return f"ZT-{plan_type.upper()[:3]}-{body}{luhn_mod32_check_char(body)}"
+
+    def order_no(self) -> str:
+        """生成订单号"""
+        with self._lock:
+            node_id = self._node_id
+            if self._valid_until is not None and time.monotonic() >= self._valid_until:
+                raise NodeLeaseExpired("ID 生成节点号租约已过期，等待续租")
+        now_ms, seq = self._next_tick()
+        ts = datetime.utcfromtimestamp(now_ms / 1000).strftime("%Y%m%d%H%M%S")
+        return f"ORD{ts}{now_ms % 1000:03d}{_encode(node_id, 4)}{_encode(seq, 2)}"
+
+
+class NodeLease:
+    """
+    节点号租约
+    启动时先尝试派生节点号，再随机尝试最多 LEASE_PROBES 个空闲或已过期的节点号（INSERT ... ON CONFLICT DO UPDATE
+    WHERE 已过期，只有一个 worker 能成功），都被占用时报错；指定 ID_NODE_ID 时只在该实例的号段内尝试。
+    后台每 1/3 租约时长续租，续租发现租约已被接管时重新租用，停止时释放；
+    续租失败期间租约在本地到期后生成器停止发号，避免其他 worker 接管同一节点号后生成重复订单号
+    """
+
+    def __init__(self, generator: IdGenerator):
+        self._generator = generator
+        self._owner = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+        self._node_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _candidates(self) -> List[int]:
+        """候选节点号：派生节点号 + 随机节点号（指定实例号时在本实例号段内，否则在全部号段内）"""
+        start = _default_node_id()
+        if settings.ID_NODE_ID >= 0:
+            base, size = start & ~((1 << WORKER_BITS) - 1), 1 << WORKER_BITS
+        else:
+            base, size = 0, 1 << NODE_BITS
+        offsets = set()
+        while len(offsets) < min(size - 1, LEASE_PROBES - 1):
+            offset = random.randrange(size)
+            if base + offset != start:
+                offsets.add(offset)
+        return [start] + [base + offset for offset in offsets]
+
+    async def _acquire(self) -> int:
+        insert = pg_insert if engine.dialect.name == "postgresql" else sqlite_insert
+        table = IdNodeLease.__table__
+        async with async_session() as session:
+            for node_id in self._candidates():
+                started = time.monotonic()
+                now = datetime.utcnow()
+                stmt = insert(table).values(
+                    node_id=node_id, owner=self._owner,
+                    expires_at=now + timedelta(seconds=settings.ID_NODE_LEASE_SECONDS),
+                )
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=["node_id"],
+                    set_={"owner": stmt.excluded.owner, "expires_at": stmt.excluded.expires_at},
+                    where=table.c.expires_at < now,
+                )
+                result = await session.execute(stmt)
+                await session.commit()
+                if result.rowcount == 1:
+                    self._use(node_id, started)
+                    return node_id
+        raise RuntimeError(f"尝试 {LEASE_PROBES} 个 ID 生成节点号均被占用，请检查 id_node_leases 或 ID_NODE_ID 配置")
+
+    async def _renew(self) -> bool:
+        """续租，返回租约是否仍由本进程持有"""
+        started = time.monotonic()
+        async with async_session() as session:
+            result = await session.execute(
+                update(IdNodeLease)
+                .where(IdNodeLease.node_id == self._node_id, IdNodeLease.owner == self._owner)
+                .values(expires_at=datetime.utcnow() + timedelta(seconds=settings.ID_NODE_LEASE_SECONDS))
+            )
+            await session.commit()
+        if result.rowcount != 1:
+            return False
+        self._use(self._node_id, started)
+        return True
+
+    def _use(self, node_id: int, started: float):
+        """租约写入成功（started 为写入前的本地时间，本地到期时间从这里算起）"""
+        if node_id != self._node_id:
+            logger.info("ID 生成节点号: %d", node_id)
+        self._node_id = node_id
+        self._generator.set_lease(node_id, started + settings.ID_NODE_LEASE_SECONDS * LEASE_SAFETY_RATIO)
+
+    async def _run(self):
+        interval = settings.ID_NODE_LEASE_SECONDS / 3
+        delay = interval
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                if not await self._renew():
+                    logger.warning("ID 生成节点号 %d 的租约已被接管，重新租用", self._node_id)
+                    await self._acquire()
+                delay = interval
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("ID 生成节点号续租失败，稍后重试")
+                delay = min(interval, LEASE_RETRY_SECONDS)
+
+    async def start(self):
+        if self._task is None:
+            await self._acquire()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        try:
+            async with async_session() as session:
+                await session.execute(
+                    IdNodeLease.__table__.delete()
+                    .where(IdNodeLease.node_id == self._node_id, IdNodeLease.owner == self._owner)
+                )
+                await session.commit()
+        except Exception:
+            logger.exception("ID 生成节点号释放失败")
+
+
+def is_valid_license_key(license_key: str) -> bool:
+    """
+    校验授权码格式（不查库）
+    兼容旧版 uuid 授权码；新版授权码需通过校验位验证
+    """
+    if not isinstance(license_key, str) or not license_key.startswith("ZT-"):
+        return False
+    parts = license_key.rsplit("-", 1)
+    if len(parts) != 2 or len(parts[0]) < 4:
+        return False
+    body = parts[1]
+    if len(body) == LEGACY_KEY_BODY_LEN:
+        return all(c in _HEX_CHARS for c in body)
+    if len(body) != KEY_BODY_LEN or any(c not in _CHAR_INDEX for c in body):
+        return False
+    return luhn_mod32_check_char(body[:-1]) == body[-1]
+
+
+# 全局单例
+id_generator = IdGenerator()
+node_lease = NodeLease(id_generator)
+
+
+def generate_license_key(plan_type: str) -> str:
+    """生成授权码"""
+    return id_generator.license_key(plan_type)
+
+
+def generate_order_no() -> str:
+    """生成订单号"""
+    return id_generator.order_no()
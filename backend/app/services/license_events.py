@@ -0,0 +1,209 @@
+"""
+授权变更推送
+ERP 客户端通过 /license/events（SSE）订阅自己授权的变更，管理员吊销、续期、解绑后立即推送，
+客户端无需高频轮询 /license/verify。
+- 每个订阅只占用一个协程和一个小队列，不占用数据库连接，单 worker 可保持数万空闲连接
+  （需相应调高进程文件句柄上限，反向代理关闭缓冲）
+- 跨 worker 分发：PostgreSQL 下通过 NOTIFY/LISTEN，每个 worker 使用一条独立的监听连接；
+  SQLite（本地模式）或监听连接断开时仅推送给本进程的订阅者
+"""
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime
+from typing import Dict, Optional, Set
+
+from sqlalchemy import text
+
+from app.core import metrics
+from app.core.config import settings
+from app.core.database import engine
+
+logger = logging.getLogger("zentea.events")
+
+CHANNEL = "zentea_license_events"
+
+# 事件类型
+EVENT_REVOKE = "revoke"
+EVENT_EXTEND = "extend"
+EVENT_UNBIND = "unbind"
+
+# 收到后服务端关闭订阅（授权已失效或需重新激活）
+TERMINAL_EVENTS = {EVENT_REVOKE, EVENT_UNBIND}
+
+# 单个订阅的待发送事件上限，客户端长时间不读取时丢弃最早的事件
+SUBSCRIBER_QUEUE_SIZE = 16
+
+# 监听连接断开后的重连间隔（秒）
+RECONNECT_DELAYS = (1, 2, 5, 10, 30)
+
+events_published_total = metrics.registry.register(metrics.Counter(
+    "zentea_license_events_published_total", "发布的授权变更事件数", ("event",),
+))
+events_dropped_total = metrics.registry.register(metrics.Counter(
+    "zentea_license_events_dropped_total", "订阅队列已满而丢弃的事件数",
+))
+
+
+class LicenseEventHub:
+    """授权变更事件分发"""
+
+    def __init__(self):
+        # {license_id: {订阅队列}}
+        self._subscribers: Dict[int, Set[asyncio.Queue]] = {}
+        self._count = 0
+        self._listener = None
+        self._listener_task: Optional[asyncio.Task] = None
+        self._listening = False
+
+    @property
+    def subscriber_count(self) -> int:
+        return self._count
+
+    @property
+    def is_listening(self) -> bool:
+        return self._listening
+
+    @property
+    def is_full(self) -> bool:
+        return self._count >= settings.LICENSE_EVENTS_MAX_SUBSCRIBERS
+
+    def subscribe(self, license_id: int) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.setdefault(license_id, set()).add(queue)
+        self._count += 1
+        return queue
+
+    def unsubscribe(self, license_id: int, queue: asyncio.Queue):
+        queues = self._subscribers.get(license_id)
+        if not queues or queue not in queues:
+            return
+        queues.discard(queue)
+        self._count -= 1
+        if not queues:
+            del self._subscribers[license_id]
+
+    def _dispatch(self, event: dict):
+        """推送给本进程内该授权的订阅者"""
+        for queue in self._subscribers.get(event["license_id"], ()):
+            if queue.full():
+                queue.get_nowait()
+                events_dropped_total.inc()
+            queue.put_nowait(event)
+
+    async def publish(self, event_type: str, license_id: int, **data):
+        """
+        发布事件（在业务事务提交后调用）
+        PostgreSQL 下经 NOTIFY 分发给所有 worker（包括本进程）；通知失败或本进程未在监听时直接本地分发
+        """
+        event = {"event": event_type, "license_id": license_id, "ts": datetime.utcnow().isoformat(), **data}
+        events_published_total.inc(event_type)
+        notified = False
+        if engine.dialect.name == "postgresql":
+            try:
+                async with engine.begin() as conn:
+                    await conn.execute(
+                        text("SELECT pg_notify(:channel, :payload)"),
+                        {"channel": CHANNEL, "payload": json.dumps(event, default=str)},
+                    )
+                notified = True
+            except Exception:
+                logger.exception("授权事件 NOTIFY 失败，仅推送本进程订阅者")
+        if not (notified and self._listening):
+            self._dispatch(event)
+
+    # ==================== 跨 worker 监听 ====================
+
+    def _on_notify(self, connection, pid, channel, payload):
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            return
+        self._dispatch(event)
+
+    async def _listen_forever(self):
+        import asyncpg
+
+        dsn = engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+        attempt = 0
+        while True:
+            try:
+                self._listener = await asyncpg.connect(dsn)
+                await self._listener.add_listener(CHANNEL, self._on_notify)
+                self._listening = True
+                attempt = 0
+                # 连接断开时 asyncpg 会关闭连接，定期检查即可
+                while not self._listener.is_closed():
+                    await asyncio.sleep(settings.LICENSE_EVENTS_PING_SECONDS)
+                    await self._listener.execute("SELECT 1")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.warning("授权事件监听连接断开，稍后重连", exc_info=True)
+            finally:
+                self._listening = False
+                if self._listener is not None and not self._listener.is_closed():
+                    self._listener.terminate()
+                self._listener = None
+            await asyncio.sleep(RECONNECT_DELAYS[min(attempt, len(RECONNECT_DELAYS) - 1)])
+            attempt += 1
+
+    async def start(self):
+        """启动跨 worker 监听（仅 PostgreSQL + asyncpg）"""
+        if engine.dialect.driver != "asyncpg" or self._listener_task is not None:
+            return
+        self._listener_task = asyncio.create_task(self._listen_forever())
+
+    async def stop(self):
+        if self._listener_task is None:
+            return
+        self._listener_task.cancel()
+        try:
+            await self._listener_task
+        except asyncio.CancelledError:
+            pass
+        self._listener_task = None
+
+
+def format_sse(event: Optional[dict] = None, comment: str = "") -> bytes:
+    """编码为 SSE 消息；只传 comment 时为保活注释"""
+    if event is None:
+        return f": {comment}\n\n".encode()
+    return f"event: {event['event']}\ndata: {json.dumps(event, ensure_ascii=False, default=str)}\n\n".encode()
+
+
+async def stream(license_id: int, machine_id: str, first_event: dict):
+    """
+    单个订阅的 SSE 数据流
+    先发送当前状态，之后转发变更事件；空闲时定期发送保活注释，收到终止事件后结束
+    解绑事件带 machine_id 时只发给该设备（站点授权解绑单台设备）
+    """
+    queue = hub.subscribe(license_id)
+    try:
+        yield f"retry: {settings.LICENSE_EVENTS_RETRY_MS}\n\n".encode() + format_sse(first_event)
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), settings.LICENSE_EVENTS_PING_SECONDS)
+            except asyncio.TimeoutError:
+                yield format_sse(comment=str(int(time.time())))
+                continue
+            if event["event"] == EVENT_UNBIND and event.get("machine_id") not in (None, machine_id):
+                continue
+            yield format_sse(event)
+            if event["event"] in TERMINAL_EVENTS:
+                return
+    finally:
+        hub.unsubscribe(license_id, queue)
+
+
+# 全局单例
+hub = LicenseEventHub()
+
+metrics.register_gauge(
+    "zentea_license_event_subscribers", "当前进程的授权事件订阅连接数", lambda: hub.subscriber_count,
+)
+metrics.register_gauge(
+    "zentea_license_event_listener_up", "跨 worker 事件监听连接是否正常（1 正常）",
+    lambda: int(hub.is_listening) if engine.dialect.driver == "asyncpg" else None,
+)
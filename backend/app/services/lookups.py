@@ -0,0 +1,70 @@
+"""
+热点查询
+授权验证、登录和鉴权每个请求都要按键查一行。这里的语句在模块加载时构建一次，
+键值通过 bindparam 传入：每次请求不再重建 select()，SQLAlchemy 对同一语句对象的缓存键也只计算一次，
+直接命中编译缓存；SQL 文本保持不变，asyncpg 连接上的预编译语句同样可以复用。
+"""
+from typing import Optional, Tuple
+
+from sqlalchemy import Row, and_, bindparam
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select
+
+from app.models.license import License, LicenseBinding
+from app.models.user import User
+
+LICENSE_BY_KEY = select(License).where(License.license_key == bindparam("license_key"))
+# 当前设备的绑定：按 (license_id, machine_id) 唯一索引探测，未绑定时 binding_id 为 NULL
+_BINDING_JOIN = and_(
+    LicenseBinding.license_id == License.id,
+    LicenseBinding.machine_id == bindparam("machine_id"),
+)
+LICENSE_WITH_BINDING = (
+    select(License, LicenseBinding.id.label("binding_id"))
+    .outerjoin(LicenseBinding, _BINDING_JOIN)
+    .where(License.license_key == bindparam("license_key"))
+)
+# 条件验证只需判定字段（PostgreSQL 下命中 ix_licenses_key_state 的仅索引扫描）
+LICENSE_STATE_BY_KEY = (
+    select(
+        License.id, LicenseBinding.id.label("binding_id"),
+        License.status, License.expire_date, License.state_version, License.plan_type, License.user_id,
+    )
+    .outerjoin(LicenseBinding, _BINDING_JOIN)
+    .where(License.license_key == bindparam("license_key"))
+)
+USER_BY_ID = select(User).where(User.id == bindparam("user_id"))
+USER_BY_USERNAME = select(User).where(User.username == bindparam("username"))
+
+
+async def license_by_key(session: AsyncSession, license_key: str) -> Optional[License]:
+    """按授权码查询授权"""
+    result = await session.execute(LICENSE_BY_KEY, {"license_key": license_key})
+    return result.scalar_one_or_none()
+
+
+async def license_with_binding(
+    session: AsyncSession, license_key: str, machine_id: str,
+) -> Tuple[Optional[License], Optional[int]]:
+    """按授权码查询授权及该设备的绑定 ID（设备未绑定时为 None），一次往返"""
+    result = await session.execute(LICENSE_WITH_BINDING, {"license_key": license_key, "machine_id": machine_id})
+    row = result.one_or_none()
+    return (row[0], row[1]) if row is not None else (None, None)
+
+
+async def license_state_by_key(session: AsyncSession, license_key: str, machine_id: str) -> Optional[Row]:
+    """按授权码查询授权的判定字段（id, binding_id, status, expire_date, state_version, plan_type, user_id）"""
+    result = await session.execute(LICENSE_STATE_BY_KEY, {"license_key": license_key, "machine_id": machine_id})
+    return result.one_or_none()
+
+
+async def user_by_id(session: AsyncSession, user_id: int) -> Optional[User]:
+    """按 ID 查询用户"""
+    result = await session.execute(USER_BY_ID, {"user_id": user_id})
+    return result.scalar_one_or_none()
+
+
+async def user_by_username(session: AsyncSession, username: str) -> Optional[User]:
+    """按用户名查询用户"""
+    result = await session.execute(USER_BY_USERNAME, {"username": username})
+    return result.scalar_one_or_none()
@@ -0,0 +1,304 @@
+"""
+在线安装实时统计
+仪表盘显示最近 5/15/60 分钟内验证过的 ERP 安装数（授权 + 机器码），按总数、套餐和客户统计，
+无需按时间范围扫描 license_heartbeats：
+- 验证请求只写内存，按分钟分桶：总数和各套餐各一个 HyperLogLog（2^10 个寄存器，误差约 3%，
+  安装数较少时按线性计数基本精确），各客户一个安装哈希集合（单个客户的安装数很少）
+- 窗口统计合并最近若干个分钟桶，代价与桶数成正比，与在线安装数无关
+- 跨 worker：每个进程每 ONLINE_TRACKER_FLUSH_SECONDS 将有变化的分钟桶写入 online_buckets，
+  查询时合并所有进程的分钟桶（寄存器取最大值、集合取并集，重复合并不影响结果）
+- 快照路径只知道授权 ID 和套餐，所属客户从本进程缓存中查找，未命中的在写入前批量查询
+"""
+import asyncio
+import hashlib
+import logging
+import math
+import secrets
+import struct
+import time
+import zlib
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import delete
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import select
+
+from app.core import metrics
+from app.core.config import settings
+from app.core.database import async_session, engine
+from app.models.license import License, OnlineBucket
+
+logger = logging.getLogger("zentea.online")
+
+# 统计窗口（分钟），同时决定保留的分钟桶数
+WINDOWS = (5, 15, 60)
+RETAIN_MINUTES = max(WINDOWS)
+
+# HyperLogLog：2^P 个寄存器，哈希为 64 位
+P = 10
+M = 1 << P
+_ALPHA = 0.7213 / (1 + 1.079 / M)
+_POW = [2.0 ** -r for r in range(64 - P + 2)]
+
+# 总数维度（其余维度为套餐名）
+ALL = ""
+
+# 查询授权所属客户时每条 IN 查询的授权数
+CHUNK_SIZE = 500
+# 待查询所属客户的记录上限（数据库不可用时丢弃，只影响按客户统计）
+MAX_UNRESOLVED = 100000
+
+# 分钟桶序列化（zlib 压缩）：维度数、客户数；维度：名称长度 + 名称 + 寄存器；客户：客户 ID、安装数 + 安装哈希
+_COUNTS = struct.Struct("<HI")
+_NAME_LEN = struct.Struct("<B")
+_CUSTOMER = struct.Struct("<qI")
+
+Sketches = Dict[str, bytes]
+Customers = Dict[int, Set[int]]
+
+
+def _install_hash(license_id: int, machine_id: str) -> int:
+    return int.from_bytes(hashlib.blake2b(f"{license_id}:{machine_id}".encode(), digest_size=8).digest(), "little")
+
+
+def _hll_add(registers: bytearray, h: int):
+    index = h & (M - 1)
+    rank = 64 - P - (h >> P).bit_length() + 1
+    if rank > registers[index]:
+        registers[index] = rank
+
+
+def hll_count(registers: bytes) -> int:
+    """HyperLogLog 基数估计"""
+    zeros = registers.count(0)
+    estimate = _ALPHA * M * M / sum(map(_POW.__getitem__, registers))
+    if estimate <= 2.5 * M and zeros:
+        # 小基数：线性计数
+        estimate = M * math.log(M / zeros)
+    return int(round(estimate))
+
+
+class _Bucket:
+    """一分钟内本进程记录的在线安装"""
+    __slots__ = ("sketches", "customers", "dirty")
+
+    def __init__(self):
+        self.sketches: Dict[str, bytearray] = {}
+        self.customers: Customers = {}
+        # 有变化尚未写入 online_buckets
+        self.dirty = False
+
+    def encode(self) -> bytes:
+        parts = [_COUNTS.pack(len(self.sketches), len(self.customers))]
+        for name, registers in self.sketches.items():
+            raw = name.encode()
+            parts += [_NAME_LEN.pack(len(raw)), raw, bytes(registers)]
+        for user_id, installs in self.customers.items():
+            parts.append(_CUSTOMER.pack(user_id, len(installs)))
+            parts.append(struct.pack(f"<{len(installs)}Q", *installs))
+        return zlib.compress(b"".join(parts))
+
+
+def _decode(payload: bytes) -> Tuple[Sketches, Customers]:
+    data = zlib.decompress(payload)
+    sketch_count, customer_count = _COUNTS.unpack_from(data, 0)
+    offset = _COUNTS.size
+    sketches: Sketches = {}
+    for _ in range(sketch_count):
+        (length,) = _NAME_LEN.unpack_from(data, offset)
+        offset += _NAME_LEN.size
+        name = data[offset:offset + length].decode()
+        offset += length
+        sketches[name] = data[offset:offset + M]
+        offset += M
+    customers: Customers = {}
+    for _ in range(customer_count):
+        user_id, count = _CUSTOMER.unpack_from(data, offset)
+        offset += _CUSTOMER.size
+        customers[user_id] = set(struct.unpack_from(f"<{count}Q", data, offset))
+        offset += 8 * count
+    return sketches, customers
+
+
+def _upsert_statement():
+    insert = pg_insert if engine.dialect.name == "postgresql" else sqlite_insert
+    stmt = insert(OnlineBucket.__table__)
+    return stmt.on_conflict_do_update(
+        index_elements=["node", "minute"],
+        set_={"payload": stmt.excluded.payload, "updated_at": stmt.excluded.updated_at},
+    )
+
+
+class OnlineTracker:
+    """本进程的在线安装分钟桶"""
+
+    def __init__(self):
+        # 写入 online_buckets 时的进程标识（重启后不同，避免覆盖上一个进程的分钟桶）
+        self.node = secrets.token_hex(8)
+        self._buckets: Dict[int, _Bucket] = {}
+        # 授权 ID -> 客户 ID
+        self._owners: Dict[int, int] = {}
+        # 所属客户未知的记录：(分钟, 授权 ID, 安装哈希)
+        self._unresolved: List[Tuple[int, int, int]] = []
+        self._upsert = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def owner_count(self) -> int:
+        return len(self._owners)
+
+    def _bucket(self, minute: int) -> _Bucket:
+        bucket = self._buckets.get(minute)
+        if bucket is None:
+            bucket = self._buckets[minute] = _Bucket()
+            # 进入新的一分钟时淘汰超出窗口的桶
+            for old in [m for m in self._buckets if m <= minute - RETAIN_MINUTES]:
+                del self._buckets[old]
+        return bucket
+
+    def record(
+        self, license_id: int, machine_id: str, plan_type: Optional[str],
+        user_id: Optional[int] = None, now: Optional[float] = None,
+    ):
+        """记录一次有效验证（只写内存）；user_id 未知时由写入前的批量查询补充"""
+        minute = int((time.time() if now is None else now) // 60)
+        h = _install_hash(license_id, machine_id)
+        bucket = self._bucket(minute)
+        for name in (ALL, plan_type or "unknown"):
+            registers = bucket.sketches.get(name)
+            if registers is None:
+                registers = bucket.sketches[name] = bytearray(M)
+            _hll_add(registers, h)
+        if user_id is None:
+            user_id = self._owners.get(license_id)
+        else:
+            self._owners[license_id] = user_id
+        if user_id is not None:
+            bucket.customers.setdefault(user_id, set()).add(h)
+        elif len(self._unresolved) < MAX_UNRESOLVED:
+            self._unresolved.append((minute, license_id, h))
+        bucket.dirty = True
+
+    async def _resolve(self, session):
+        """批量查询所属客户未知的授权，补充到对应分钟桶"""
+        pending, self._unresolved = self._unresolved, []
+        missing = list({license_id for _, license_id, _ in pending if license_id not in self._owners})
+        try:
+            for i in range(0, len(missing), CHUNK_SIZE):
+                result = await session.execute(
+                    select(License.id, License.user_id).where(License.id.in_(missing[i:i + CHUNK_SIZE]))
+                )
+                self._owners.update(result.all())
+        except BaseException:
+            self._unresolved = pending + self._unresolved
+            raise
+        for minute, license_id, h in pending:
+            user_id = self._owners.get(license_id)
+            bucket = self._buckets.get(minute)
+            # 授权已删除或分钟桶已淘汰
+            if user_id is None or bucket is None:
+                continue
+            bucket.customers.setdefault(user_id, set()).add(h)
+            bucket.dirty = True
+
+    async def flush(self):
+        """写入有变化的分钟桶，并清理超出窗口的记录"""
+        oldest = int(time.time() // 60) - RETAIN_MINUTES
+        if self._upsert is None:
+            self._upsert = _upsert_statement()
+        async with async_session() as session:
+            if self._unresolved:
+                await self._resolve(session)
+            dirty = [(minute, bucket) for minute, bucket in sorted(self._buckets.items()) if bucket.dirty]
+            now = datetime.utcnow()
+            for _, bucket in dirty:
+                bucket.dirty = False
+            try:
+                if dirty:
+                    await session.execute(self._upsert, [
+                        {"node": self.node, "minute": minute, "payload": bucket.encode(), "updated_at": now}
+                        for minute, bucket in dirty
+                    ])
+                await session.execute(delete(OnlineBucket).where(OnlineBucket.minute <= oldest))
+                await session.commit()
+            except BaseException:
+                for _, bucket in dirty:
+                    bucket.dirty = True
+                raise
+
+    async def summary(self, session) -> Dict[int, dict]:
+        """
+        各窗口的在线安装数（合并所有进程的分钟桶）
+        返回 {窗口分钟数: {"total": 总数, "by_plan": {套餐: 数量}, "by_customer": {客户 ID: 数量}}}
+        """
+        current = int(time.time() // 60)
+        since = current - RETAIN_MINUTES + 1
+        # 本进程的分钟桶直接读内存（比已写入的更新）
+        result = await session.execute(
+            select(OnlineBucket.minute, OnlineBucket.payload)
+            .where(OnlineBucket.minute >= since, OnlineBucket.node != self.node)
+        )
+        by_minute: Dict[int, List[Tuple[Sketches, Customers]]] = {}
+        for minute, payload in result.all():
+            by_minute.setdefault(minute, []).append(_decode(payload))
+        for minute, bucket in self._buckets.items():
+            if minute >= since:
+                by_minute.setdefault(minute, []).append((bucket.sketches, bucket.customers))
+
+        # 从当前分钟向前逐桶合并，到达窗口边界时计数
+        sketches: Dict[str, bytes] = {}
+        customers: Customers = {}
+        windows: Dict[int, dict] = {}
+        for age in range(RETAIN_MINUTES):
+            for bucket_sketches, bucket_customers in by_minute.get(current - age, ()):
+                for name, registers in bucket_sketches.items():
+                    merged = sketches.get(name)
+                    sketches[name] = bytes(registers) if merged is None else bytes(map(max, merged, registers))
+                for user_id, installs in bucket_customers.items():
+                    customers.setdefault(user_id, set()).update(installs)
+            if age + 1 in WINDOWS:
+                windows[age + 1] = {
+                    "total": hll_count(sketches[ALL]) if ALL in sketches else 0,
+                    "by_plan": {name: hll_count(r) for name, r in sorted(sketches.items()) if name != ALL},
+                    "by_customer": {user_id: len(installs) for user_id, installs in customers.items()},
+                }
+        return windows
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.ONLINE_TRACKER_FLUSH_SECONDS)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("在线安装统计写入失败，下次重试")
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止后台任务，并写入最后一批"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("在线安装统计写入失败")
+
+
+# 全局单例
+online = OnlineTracker()
+
+metrics.register_gauge(
+    "zentea_online_owner_cache_size", "在线统计缓存的授权所属客户数", lambda: online.owner_count,
+)
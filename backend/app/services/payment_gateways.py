@@ -0,0 +1,270 @@
+"""
+支付网关异步通知：解析、验签和应答
+- 支付宝：application/x-www-form-urlencoded，RSA2（SHA256WithRSA）签名，使用系统设置中的支付宝公钥验签
+- 微信支付（V2）：XML，MD5 / HMAC-SHA256 签名，使用系统设置中的 API 密钥验签
+- stub：本地测试网关，JSON + HMAC-SHA256（密钥为 PAYMENT_STUB_SECRET，未配置或生产环境不启用），
+  测试时用 StubGateway.build_notification() 构造已签名的通知
+支付配置（开关、密钥）缓存在内存中，管理员修改系统设置后立即失效，其他 worker 在 TTL 内同步
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import secrets
+import textwrap
+import time
+import xml.etree.ElementTree as ElementTree
+from base64 import b64decode
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+from typing import Dict, NamedTuple, Optional
+from urllib.parse import parse_qsl
+
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+from jose import jwk
+from sqlmodel import select
+
+from app.core.config import settings
+from app.core.database import async_session
+from app.core.metrics import record_cache
+from app.models.setting import SettingKeys, SystemSetting
+
+# 验签用到的系统设置
+PAYMENT_KEYS = (
+    SettingKeys.ALIPAY_ENABLED, SettingKeys.ALIPAY_APP_ID, SettingKeys.ALIPAY_PUBLIC_KEY,
+    SettingKeys.WECHAT_ENABLED, SettingKeys.WECHAT_APP_ID, SettingKeys.WECHAT_MCH_ID, SettingKeys.WECHAT_API_KEY,
+)
+
+# 通知中已支付的交易状态
+ALIPAY_PAID_STATUSES = ("TRADE_SUCCESS", "TRADE_FINISHED")
+
+
+class NotificationError(ValueError):
+    """通知格式错误或验签失败"""
+
+
+class Notification(NamedTuple):
+    """验签通过的通知"""
+    txn_id: str
+    order_no: str
+    amount_cents: int
+    # 是否为支付成功通知（其他状态只应答不入队）
+    paid: bool
+
+
+def to_cents(amount) -> int:
+    """金额（元）转换为分"""
+    try:
+        return int((Decimal(str(amount)) * 100).quantize(Decimal("1")))
+    except (InvalidOperation, ValueError) as e:
+        raise NotificationError(f"金额格式错误: {amount}") from e
+
+
+def _canonical(params: Dict[str, str], exclude=("sign",)) -> str:
+    """按参数名排序拼接 k=v（跳过空值和签名字段）"""
+    return "&".join(f"{k}={params[k]}" for k in sorted(params) if k not in exclude and params[k] != "")
+
+
+@lru_cache(maxsize=4)
+def _rsa_public_key(key: str):
+    key = key.strip()
+    if not key.startswith("-----BEGIN"):
+        # 支付宝后台复制的公钥不带 PEM 头尾
+        key = "-----BEGIN PUBLIC KEY-----\n" + "\n".join(textwrap.wrap(key, 64)) + "\n-----END PUBLIC KEY-----"
+    return jwk.construct(key, "RS256")
+
+
+class PaymentConfig:
+    """支付配置（PAYMENT_KEYS 对应系统设置的内存缓存）"""
+
+    def __init__(self):
+        self._values: Dict[str, str] = {}
+        self._loaded_at: float = 0
+        self._stale = True
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        """标记缓存失效（管理员修改系统设置后调用）"""
+        self._stale = True
+
+    def _is_expired(self) -> bool:
+        return self._stale or time.monotonic() - self._loaded_at > settings.PAYMENT_CONFIG_TTL_SECONDS
+
+    async def get(self) -> Dict[str, str]:
+        if not self._is_expired():
+            record_cache("payment_config", True)
+            return self._values
+        record_cache("payment_config", False)
+        async with self._lock:
+            if self._is_expired():
+                self._stale = False
+                async with async_session() as session:
+                    result = await session.execute(
+                        select(SystemSetting.key, SystemSetting.value).where(SystemSetting.key.in_(PAYMENT_KEYS))
+                    )
+                    self._values = dict(result.all())
+                self._loaded_at = time.monotonic()
+        return self._values
+
+
+class Gateway:
+    """支付网关通知处理（子类实现各渠道的格式和签名）"""
+    name = ""
+
+    def enabled(self, config: Dict[str, str]) -> bool:
+        raise NotImplementedError
+
+    def parse(self, body: bytes) -> Dict[str, str]:
+        raise NotImplementedError
+
+    def verify(self, params: Dict[str, str], config: Dict[str, str]) -> bool:
+        raise NotImplementedError
+
+    def extract(self, params: Dict[str, str]) -> Notification:
+        raise NotImplementedError
+
+    def ack(self, ok: bool) -> Response:
+        """应答支付平台：ok=False 时平台稍后重试"""
+        raise NotImplementedError
+
+
+class AlipayGateway(Gateway):
+    name = "alipay"
+
+    def enabled(self, config):
+        return config.get(SettingKeys.ALIPAY_ENABLED) == "true" and bool(config.get(SettingKeys.ALIPAY_PUBLIC_KEY))
+
+    def parse(self, body):
+        try:
+            return dict(parse_qsl(body.decode("utf-8"), keep_blank_values=True, strict_parsing=True))
+        except (UnicodeDecodeError, ValueError) as e:
+            raise NotificationError("通知格式错误") from e
+
+    def verify(self, params, config):
+        if params.get("sign_type") != "RSA2" or not params.get("sign"):
+            return False
+        app_id = config.get(SettingKeys.ALIPAY_APP_ID)
+        if app_id and params.get("app_id") != app_id:
+            return False
+        try:
+            key = _rsa_public_key(config[SettingKeys.ALIPAY_PUBLIC_KEY])
+            return key.verify(_canonical(params, ("sign", "sign_type")).encode(), b64decode(params["sign"]))
+        except Exception:
+            return False
+
+    def extract(self, params):
+        if not params.get("trade_no") or not params.get("out_trade_no"):
+            raise NotificationError("缺少交易号或订单号")
+        return Notification(
+            params["trade_no"], params["out_trade_no"], to_cents(params.get("total_amount")),
+            params.get("trade_status") in ALIPAY_PAID_STATUSES,
+        )
+
+    def ack(self, ok):
+        return PlainTextResponse("success" if ok else "failure")
+
+
+class WechatPayGateway(Gateway):
+    name = "wechat"
+
+    def enabled(self, config):
+        return config.get(SettingKeys.WECHAT_ENABLED) == "true" and bool(config.get(SettingKeys.WECHAT_API_KEY))
+
+    def parse(self, body):
+        # 拒绝 DTD，避免实体扩展攻击
+        if b"<!DOCTYPE" in body or b"<!ENTITY" in body:
+            raise NotificationError("通知格式错误")
+        try:
+            root = ElementTree.fromstring(body)
+        except ElementTree.ParseError as e:
+            raise NotificationError("通知格式错误") from e
+        return {child.tag: (child.text or "") for child in root}
+
+    def verify(self, params, config):
+        sign = params.get("sign")
+        if not sign:
+            return False
+        for key, setting_key in (("appid", SettingKeys.WECHAT_APP_ID), ("mch_id", SettingKeys.WECHAT_MCH_ID)):
+            if config.get(setting_key) and params.get(key) != config[setting_key]:
+                return False
+        api_key = config[SettingKeys.WECHAT_API_KEY]
+        payload = f"{_canonical(params)}&key={api_key}".encode()
+        if params.get("sign_type", "MD5") == "HMAC-SHA256":
+            expected = hmac.new(api_key.encode(), payload, hashlib.sha256).hexdigest()
+        else:
+            expected = hashlib.md5(payload).hexdigest()
+        return hmac.compare_digest(expected.upper(), sign.upper())
+
+    def extract(self, params):
+        paid = params.get("return_code") == "SUCCESS" and params.get("result_code") == "SUCCESS"
+        if not params.get("transaction_id") or not params.get("out_trade_no"):
+            if not paid:
+                # 通信失败类通知没有交易号，只应答
+                return Notification("", "", 0, False)
+            raise NotificationError("缺少交易号或订单号")
+        try:
+            amount_cents = int(params.get("total_fee", ""))
+        except ValueError as e:
+            raise NotificationError("金额格式错误") from e
+        return Notification(params["transaction_id"], params["out_trade_no"], amount_cents, paid)
+
+    def ack(self, ok):
+        code, msg = ("SUCCESS", "OK") if ok else ("FAIL", "ERROR")
+        return Response(
+            f"<xml><return_code><![CDATA[{code}]]></return_code><return_msg><![CDATA[{msg}]]></return_msg></xml>",
+            media_type="application/xml",
+        )
+
+
+class StubGateway(Gateway):
+    """本地测试网关（PAYMENT_STUB_SECRET 未配置时不启用）"""
+    name = "stub"
+
+    @staticmethod
+    def sign(params: Dict[str, str], secret: str) -> str:
+        return hmac.new(secret.encode(), _canonical(params).encode(), hashlib.sha256).hexdigest()
+
+    @classmethod
+    def build_notification(
+        cls, order_no: str, amount, txn_id: Optional[str] = None, status: str = "SUCCESS",
+    ) -> Dict[str, str]:
+        """构造已签名的通知（POST 到 /payments/notify/stub 的 JSON 请求体）"""
+        params = {
+            "txn_id": txn_id or f"STUB{secrets.token_hex(8).upper()}",
+            "order_no": order_no,
+            "amount": str(Decimal(str(amount)).quantize(Decimal("0.01"))),
+            "status": status,
+        }
+        params["sign"] = cls.sign(params, settings.PAYMENT_STUB_SECRET)
+        return params
+
+    def enabled(self, config):
+        return bool(settings.PAYMENT_STUB_SECRET) and not settings.is_production
+
+    def parse(self, body):
+        try:
+            params = json.loads(body)
+        except ValueError as e:
+            raise NotificationError("通知格式错误") from e
+        if not isinstance(params, dict):
+            raise NotificationError("通知格式错误")
+        return {str(k): str(v) for k, v in params.items()}
+
+    def verify(self, params, config):
+        return hmac.compare_digest(self.sign(params, settings.PAYMENT_STUB_SECRET), params.get("sign", ""))
+
+    def extract(self, params):
+        if not params.get("txn_id") or not params.get("order_no"):
+            raise NotificationError("缺少交易号或订单号")
+        return Notification(
+            params["txn_id"], params["order_no"], to_cents(params.get("amount")), params.get("status") == "SUCCESS",
+        )
+
+    def ack(self, ok):
+        return JSONResponse({"code": "SUCCESS" if ok else "FAIL"})
+
+
+GATEWAYS: Dict[str, Gateway] = {g.name: g for g in (AlipayGateway(), WechatPayGateway(), StubGateway())}
+
+# 全局单例
+payment_config = PaymentConfig()
@@ -0,0 +1,262 @@
+"""
+支付通知入队与处理
+回调接口验签后调用 payment_queue.submit()，后台任务再异步完成订单：
+- 入队：等待 PAYMENT_NOTIFY_BATCH_MS 合并同一时刻到达的通知，一条 INSERT ... ON CONFLICT DO NOTHING 批量写入
+  payment_notifications 后再应答；支付平台高峰期的重试风暴不会为每个回调各开一个事务
+- 幂等：(provider, txn_id) 唯一，同一笔交易重复通知只保存一行；本进程最近写入的交易号直接应答，不访问数据库
+- 处理：按 ID 顺序逐条领取（条件 UPDATE，多个 worker 不会重复处理），锁定订单行后校验状态和金额，
+  调用 complete_order_internal 完成订单；订单已由同一交易号完成时视为重复通知，不会再生成授权
+- 处理异常时保留为 pending 稍后重试，超过 PAYMENT_WORKER_MAX_ATTEMPTS 次或无法处理（订单不存在、金额不符、
+  订单已取消或已由其他交易支付）时标记为 failed，由管理员人工核对
+"""
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, or_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import select
+
+from app.api.v1.endpoints.order import complete_order_internal
+from app.core import metrics
+from app.core.config import settings
+from app.core.database import async_session, engine
+from app.models.order import Order
+from app.models.payment import PaymentNotification
+from app.models.user import User
+from app.services.payment_gateways import Notification, to_cents
+
+logger = logging.getLogger("zentea.payment")
+
+# 本进程记住的最近写入的交易号数
+RECENT_TXN_LIMIT = 10000
+# 每轮领取的通知数
+WORKER_BATCH_SIZE = 100
+
+payment_notifications_total = metrics.registry.register(metrics.Counter(
+    "zentea_payment_notifications_total", "支付通知数", ("provider", "result"),
+))
+
+_notifications = PaymentNotification.__table__
+
+
+def _insert_statement():
+    insert = pg_insert if engine.dialect.name == "postgresql" else sqlite_insert
+    return insert(_notifications).on_conflict_do_nothing(index_elements=["provider", "txn_id"])
+
+
+def _claimable(now: datetime):
+    """可领取的通知：待处理，或处理中但已超时（处理进程异常退出）"""
+    stale = now - timedelta(seconds=settings.PAYMENT_CLAIM_TIMEOUT_SECONDS)
+    return or_(
+        PaymentNotification.status == "pending",
+        and_(PaymentNotification.status == "processing", PaymentNotification.claimed_at < stale),
+    )
+
+
+class PaymentNotificationQueue:
+    """支付通知写入合并与后台处理"""
+
+    def __init__(self):
+        # 等待写入的通知: [(行, 等待应答的 future)]
+        self._pending: List[Tuple[dict, asyncio.Future]] = []
+        # 最近写入的 (provider, txn_id)
+        self._recent: "OrderedDict[Tuple[str, str], None]" = OrderedDict()
+        self._flush_event = asyncio.Event()
+        self._work_event = asyncio.Event()
+        self._insert = None
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    async def submit(self, provider: str, notification: Notification, raw: str):
+        """保存验签通过的支付成功通知（写入数据库后返回，写入失败时抛出异常）"""
+        key = (provider, notification.txn_id)
+        if key in self._recent:
+            payment_notifications_total.inc(provider, "duplicate")
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(({
+            "provider": provider,
+            "txn_id": notification.txn_id,
+            "order_no": notification.order_no,
+            "amount_cents": notification.amount_cents,
+            "raw": raw,
+            "status": "pending",
+            "attempts": 0,
+            "created_at": datetime.utcnow(),
+        }, future))
+        if self._tasks:
+            self._flush_event.set()
+        else:
+            # 后台任务未启动（脚本/测试）时直接写入
+            await self._flush()
+        await future
+        payment_notifications_total.inc(provider, "accepted")
+
+    async def _flush(self):
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        if self._insert is None:
+            self._insert = _insert_statement()
+        # 同一批内的重复通知只写一行
+        rows: Dict[Tuple[str, str], dict] = {(row["provider"], row["txn_id"]): row for row, _ in batch}
+        try:
+            async with async_session() as session:
+                await session.execute(self._insert, list(rows.values()))
+                await session.commit()
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            raise
+        for key in rows:
+            self._recent[key] = None
+            if len(self._recent) > RECENT_TXN_LIMIT:
+                self._recent.popitem(last=False)
+        for _, future in batch:
+            if not future.done():
+                future.set_result(None)
+        self._work_event.set()
+
+    async def _run_flush(self):
+        while True:
+            await self._flush_event.wait()
+            self._flush_event.clear()
+            await asyncio.sleep(settings.PAYMENT_NOTIFY_BATCH_MS / 1000)
+            try:
+                await self._flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("支付通知写入失败，支付平台将重试")
+
+    async def process_pending(self) -> int:
+        """处理可领取的通知，返回本轮处理数"""
+        async with async_session() as session:
+            result = await session.execute(
+                select(PaymentNotification.id)
+                .where(_claimable(datetime.utcnow()))
+                .order_by(PaymentNotification.id)
+                .limit(WORKER_BATCH_SIZE)
+            )
+            ids = result.scalars().all()
+        processed = 0
+        for notification_id in ids:
+            if await self._process(notification_id):
+                processed += 1
+        return processed
+
+    async def _process(self, notification_id: int) -> bool:
+        now = datetime.utcnow()
+        async with async_session() as session:
+            claimed = await session.execute(
+                update(PaymentNotification)
+                .where(PaymentNotification.id == notification_id, _claimable(now))
+                .values(status="processing", claimed_at=now, attempts=PaymentNotification.attempts + 1)
+            )
+            await session.commit()
+            if claimed.rowcount != 1:
+                # 已被其他 worker 领取
+                return False
+            notification = await session.get(PaymentNotification, notification_id)
+            provider, txn_id, attempts = notification.provider, notification.txn_id, notification.attempts
+            try:
+                status, message = await self._complete(session, notification)
+            except Exception as e:
+                await session.rollback()
+                logger.exception("支付通知处理失败: %s %s", provider, txn_id)
+                status = "failed" if attempts >= settings.PAYMENT_WORKER_MAX_ATTEMPTS else "pending"
+                message = f"{type(e).__name__}: {e}"
+            payment_notifications_total.inc(provider, "retry" if status == "pending" else status)
+            if status == "failed":
+                logger.warning("支付通知无法处理: %s %s %s", provider, txn_id, message)
+            await session.execute(
+                update(PaymentNotification)
+                .where(PaymentNotification.id == notification_id)
+                .values(
+                    status=status,
+                    error=message[:500] if message else None,
+                    processed_at=datetime.utcnow() if status != "pending" else None,
+                )
+            )
+            await session.commit()
+        return True
+
+    async def _complete(self, session, notification: PaymentNotification) -> Tuple[str, Optional[str]]:
+        """完成通知对应的订单，返回 (通知状态, 说明)"""
+        # 锁定订单行：同一订单的多笔通知、管理员同时审核时只有一方能完成订单
+        result = await session.execute(
+            select(Order).where(Order.order_no == notification.order_no).with_for_update()
+        )
+        order = result.scalar_one_or_none()
+        if order is None:
+            return "failed", "订单不存在"
+        if order.status == "paid":
+            if order.payment_method == notification.provider and order.payment_txn_id == notification.txn_id:
+                return "processed", "重复通知，订单已完成"
+            return "failed", "订单已支付，本笔交易需人工核对退款"
+        if order.status != "pending":
+            return "failed", f"订单状态为 {order.status}，本笔交易需人工核对退款"
+        if to_cents(order.amount) != notification.amount_cents:
+            return "failed", f"金额不符：订单 {to_cents(order.amount)} 分，实付 {notification.amount_cents} 分"
+        user = await session.get(User, order.user_id)
+        if user is None:
+            return "failed", "订单用户不存在"
+        response = await complete_order_internal(
+            session, order, user,
+            notes=f"{notification.provider} 交易号 {notification.txn_id}",
+            action="order.pay",
+            payment_method=notification.provider,
+            payment_txn_id=notification.txn_id,
+        )
+        if response["code"] != 200:
+            return "failed", response["message"]
+        return "processed", None
+
+    async def _run_worker(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._work_event.wait(), settings.PAYMENT_WORKER_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._work_event.clear()
+            try:
+                await self.process_pending()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("支付通知处理失败，下次重试")
+
+    async def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._run_flush()), asyncio.create_task(self._run_worker())]
+
+    async def stop(self):
+        """停止后台任务，写入尚未写入的通知（未处理的通知由下次启动或其他 worker 处理）"""
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        try:
+            await self._flush()
+        except Exception:
+            logger.exception("支付通知写入失败")
+
+
+# 全局单例
+payment_queue = PaymentNotificationQueue()
+
+metrics.register_gauge(
+    "zentea_payment_notifications_pending", "等待写入的支付通知数", lambda: payment_queue.pending_count,
+)
@@ -0,0 +1,151 @@
+"""
+授权在线状态批量写入
+心跳请求只在内存中记录最近心跳时间、IP 和次数，后台任务每 LICENSE_PRESENCE_FLUSH_SECONDS
+合并写入 license_presence（按授权一行的窄表）和 license_bindings.last_seen：
+- licenses 宽行（含 notes 等文本）不再因心跳被改写，避免表膨胀和与管理员修改争用同一行
+- 同一授权在一个间隔内的多次心跳只写一次；多个 worker 的写入以较晚的心跳时间为准、次数累加
+- 按主键排序写入，多个 worker 同时写入时不会互相死锁
+进程退出时写入最后一批；异常退出最多丢失一个间隔内的在线状态（心跳日志不受影响）。
+"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import case
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app.core import metrics
+from app.core.config import settings
+from app.core.database import async_session, engine
+from app.models.license import LicensePresence
+from app.services.bindings import TOUCH_BINDING
+
+logger = logging.getLogger("zentea.presence")
+
+_presence = LicensePresence.__table__
+
+presence_flushed_total = metrics.registry.register(metrics.Counter(
+    "zentea_license_presence_flushed_total", "批量写入的在线状态行数", ("table",),
+))
+
+
+def _upsert_statement():
+    """按主键合并写入：心跳时间取较晚者，次数累加"""
+    insert = pg_insert if engine.dialect.name == "postgresql" else sqlite_insert
+    stmt = insert(_presence)
+    return stmt.on_conflict_do_update(
+        index_elements=[_presence.c.license_id],
+        set_={
+            "last_heartbeat": case(
+                (_presence.c.last_heartbeat.is_(None), stmt.excluded.last_heartbeat),
+                (stmt.excluded.last_heartbeat > _presence.c.last_heartbeat, stmt.excluded.last_heartbeat),
+                else_=_presence.c.last_heartbeat,
+            ),
+            "last_ip": stmt.excluded.last_ip,
+            "heartbeat_count": _presence.c.heartbeat_count + stmt.excluded.heartbeat_count,
+        },
+    )
+
+
+class PresenceBuffer:
+    """在线状态写缓冲"""
+
+    def __init__(self):
+        # {license_id: [最近心跳时间, IP, 次数]}
+        self._licenses: Dict[int, list] = {}
+        # {(license_id, machine_id): 最近心跳时间}
+        self._machines: Dict[Tuple[int, str], datetime] = {}
+        self._upsert = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._licenses)
+
+    def record(self, license_id: int, machine_id: str, ip_address: Optional[str], now: datetime):
+        """记录一次心跳（只写内存）"""
+        entry = self._licenses.get(license_id)
+        if entry is None:
+            self._licenses[license_id] = [now, ip_address, 1]
+        else:
+            entry[0], entry[1] = max(entry[0], now), ip_address
+            entry[2] += 1
+        self._machines[(license_id, machine_id)] = now
+
+    def _restore(self, licenses: Dict[int, list], machines: Dict[Tuple[int, str], datetime]):
+        """写入失败时合并回缓冲，下次重试"""
+        for license_id, (last, ip, count) in licenses.items():
+            entry = self._licenses.get(license_id)
+            if entry is None:
+                self._licenses[license_id] = [last, ip, count]
+            else:
+                entry[0] = max(entry[0], last)
+                entry[2] += count
+        for key, last in machines.items():
+            self._machines[key] = max(self._machines.get(key, last), last)
+
+    async def flush(self):
+        """写入缓冲中的在线状态"""
+        licenses, self._licenses = self._licenses, {}
+        machines, self._machines = self._machines, {}
+        if not licenses:
+            return
+        if self._upsert is None:
+            self._upsert = _upsert_statement()
+        presence_rows: List[dict] = [
+            {"license_id": license_id, "last_heartbeat": last, "last_ip": ip, "heartbeat_count": count}
+            for license_id, (last, ip, count) in sorted(licenses.items())
+        ]
+        binding_rows: List[dict] = [
+            {"b_license_id": license_id, "b_machine_id": machine_id, "b_now": last}
+            for (license_id, machine_id), last in sorted(machines.items())
+        ]
+        try:
+            async with async_session() as session:
+                await session.execute(self._upsert, presence_rows)
+                await session.execute(TOUCH_BINDING, binding_rows)
+                await session.commit()
+        except BaseException:
+            self._restore(licenses, machines)
+            raise
+        presence_flushed_total.inc("license_presence", amount=len(presence_rows))
+        presence_flushed_total.inc("license_bindings", amount=len(binding_rows))
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.LICENSE_PRESENCE_FLUSH_SECONDS)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("在线状态批量写入失败，下次重试")
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止后台任务，并写入最后一批"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("在线状态批量写入失败")
+
+
+# 全局单例
+presence = PresenceBuffer()
+
+metrics.register_gauge(
+    "zentea_license_presence_pending", "等待批量写入的授权在线状态数", lambda: presence.pending_count,
+)
@@ -0,0 +1,132 @@
+"""
+促销活动缓存
+将启用中的促销活动保存在内存中，/promo/current、/promo/check 和下单时无需每次查询数据库。
+- 管理员修改促销活动后调用 invalidate() 立即失效
+- 活动开始/结束的时间边界到达时重新计算当前有效列表
+- 兜底 TTL 到期后重新加载（多 worker 部署时同步其他进程的修改）
+"""
+import asyncio
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import or_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select
+
+from app.core.config import settings
+from app.core.metrics import record_cache
+from app.models.promo import PromoCampaign
+
+
+class PromoCache:
+    """促销活动内存缓存"""
+
+    def __init__(self):
+        # 启用中的活动: {code: PromoCampaign}
+        self._by_code: Dict[str, PromoCampaign] = {}
+        # 当前时间窗口内的活动（按 id 排序）
+        self._active: List[PromoCampaign] = []
+        # 下一个开始/结束时间边界，到达后重新计算 _active
+        self._next_boundary: Optional[datetime] = None
+        self._loaded_at: float = 0
+        self._stale = True
+        # 失效次数：加载期间发生的失效在加载完成后仍然生效
+        self._generation = 0
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        """标记缓存失效（管理员修改促销活动后调用）"""
+        self._stale = True
+        self._generation += 1
+
+    def _is_expired(self) -> bool:
+        return self._stale or time.monotonic() - self._loaded_at > settings.PROMO_CACHE_TTL_SECONDS
+
+    async def _ensure_loaded(self, session: AsyncSession):
+        if not self._is_expired():
+            record_cache("promo", True)
+            return
+        record_cache("promo", False)
+        async with self._lock:
+            # 等锁期间可能已被其他协程刷新
+            if not self._is_expired():
+                return
+            generation = self._generation
+            # 查询失败时保持失效状态，下一次请求重新加载
+            result = await session.execute(
+                select(PromoCampaign).where(PromoCampaign.is_active == True)
+            )
+            promos = result.scalars().all()
+            # 脱离会话，避免缓存对象被请求内的工作单元修改
+            for p in promos:
+                session.expunge(p)
+            self._by_code = {p.code: p for p in promos}
+            self._rebuild_active(datetime.utcnow())
+            self._loaded_at = time.monotonic()
+            self._stale = generation != self._generation
+
+    def _rebuild_active(self, now: datetime):
+        """按时间边界重新计算当前有效的活动"""
+        active = []
+        boundaries = []
+        for p in self._by_code.values():
+            if p.start_date > now:
+                boundaries.append(p.start_date)
+            elif p.end_date >= now:
+                active.append(p)
+                boundaries.append(p.end_date)
+        self._active = sorted(active, key=lambda p: p.id or 0)
+        self._next_boundary = min(boundaries) if boundaries else None
+
+    async def get_active(self, session: AsyncSession) -> List[PromoCampaign]:
+        """获取当前时间窗口内的活动（不过滤名额）"""
+        await self._ensure_loaded(session)
+        now = datetime.utcnow()
+        if self._next_boundary and now >= self._next_boundary:
+            self._rebuild_active(now)
+        return self._active
+
+    async def get_by_code(self, session: AsyncSession, code: str) -> Optional[PromoCampaign]:
+        """按活动码获取启用中的活动（不校验时间和名额）"""
+        await self._ensure_loaded(session)
+        return self._by_code.get(code)
+
+    def update_uses(self, code: str, current_uses: int):
+        """同步缓存中的已使用次数（核销成功后调用）"""
+        promo = self._by_code.get(code)
+        if promo:
+            promo.current_uses = current_uses
+
+
+async def redeem_promo(session: AsyncSession, code: str) -> Optional[int]:
+    """
+    原子核销促销码（使用次数 +1）
+    单条条件 UPDATE 同时校验启用状态、时间范围和名额：下单前校验后活动被停用或到期也不会核销，并发下不会超出 max_uses
+    返回: 核销后的使用次数；活动不存在、未启用、不在时间范围内或名额已满时返回 None
+    """
+    now = datetime.utcnow()
+    result = await session.execute(
+        update(PromoCampaign)
+        .where(
+            PromoCampaign.code == code,
+            PromoCampaign.is_active == True,
+            PromoCampaign.start_date <= now,
+            PromoCampaign.end_date >= now,
+            or_(
+                PromoCampaign.max_uses == None,
+                PromoCampaign.current_uses < PromoCampaign.max_uses,
+            ),
+        )
+        .values(current_uses=PromoCampaign.current_uses + 1)
+        .returning(PromoCampaign.current_uses)
+        .execution_options(synchronize_session=False)
+    )
+    current_uses = result.scalar_one_or_none()
+    if current_uses is not None:
+        promo_cache.update_uses(code, current_uses)
+    return current_uses
+
+
+# 全局单例
+promo_cache = PromoCache()
@@ -0,0 +1,449 @@
+"""
+支付凭证上传与存储
+- 上传：直接解析请求体的 multipart 流（不经过 UploadFile 的临时文件），文件数据按块边计算 SHA-256 边写入存储，
+  不在内存中缓冲整个文件；超过 PROOF_MAX_BYTES 或文件头不是允许的格式（PNG/JPEG/WebP/PDF）时立即中止
+- 上传限制：从请求流读取的全部字节（含非文件字段、分段头部）不超过 PROOF_MAX_BYTES + MULTIPART_OVERHEAD，
+  单个分段头部不超过 MAX_PART_HEADER_BYTES，没有 Content-Length 的分块上传同样受限
+- 命名：按内容 SHA-256 命名（<sha256>.<扩展名>），同一文件只存一份；订单中保存不带签名的规范 URL
+- 读取链接：接口返回的凭证链接带有效期和 HMAC 签名（<前缀><到期时间>/<签名>/<文件名>），<img> 标签可直接引用，
+  过期或签名不符时拒绝；到期时间按 PROOF_URL_TTL_SECONDS 对齐，同一时段内链接不变，浏览器可长期缓存
+- 存储：ProofStorage 为存储接口（抽象基类），默认 LocalProofStorage 写入 PROOF_STORAGE_DIR（先写临时文件再原子改名），
+  对象存储实现同样的写入/读取接口后在 STORAGE_BACKENDS 中注册，由 PROOF_STORAGE_BACKEND 选择
+- 读取：本地文件由 FileResponse 分块发送；配置 PROOF_ACCEL_REDIRECT 后返回 X-Accel-Redirect，
+  由 nginx 通过 sendfile 零拷贝发送（需配置指向 PROOF_STORAGE_DIR 的 internal location）
+- 缩略图：图片上传后在后台进程池生成 JPEG 缩略图（<sha256>.thumb.jpg），供管理后台订单列表使用；
+  Pillow 为可选依赖，未安装时不生成缩略图，列表回退显示原图
+"""
+import asyncio
+import hashlib
+import hmac
+import logging
+import os
+import re
+import secrets
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Type
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response
+from multipart.multipart import MultipartParser, parse_options_header
+
+from app.core import metrics
+from app.core.config import settings
+
+try:
+    from PIL import Image
+except ImportError:  # 可选依赖
+    Image = None
+
+logger = logging.getLogger("zentea.proofs")
+
+# 凭证读取接口的 URL 前缀（见 endpoints/order.py）
+URL_PREFIX = "/api/v1/orders/proofs/"
+
+# 允许的格式：文件头 -> (扩展名, Content-Type)
+MAGIC_TYPES: List[Tuple[bytes, str, str]] = [
+    (b"\x89PNG\r\n\x1a\n", "png", "image/png"),
+    (b"\xff\xd8\xff", "jpg", "image/jpeg"),
+    (b"%PDF-", "pdf", "application/pdf"),
+]
+CONTENT_TYPES = {"png": "image/png", "jpg": "image/jpeg", "webp": "image/webp", "pdf": "application/pdf"}
+IMAGE_EXTENSIONS = ("png", "jpg", "webp")
+# 判断格式需要的文件头长度
+SNIFF_BYTES = 12
+
+# 上传表单中的文件字段名
+FILE_FIELD = "file"
+# 请求体中除文件外的 multipart 开销上限（边界、头部、其他字段）
+MULTIPART_OVERHEAD = 16 * 1024
+# 单个分段头部（字段名 + 值）的长度上限
+MAX_PART_HEADER_BYTES = 1024
+
+NAME_PATTERN = re.compile(r"^[0-9a-f]{64}(\.thumb)?\.(png|jpg|webp|pdf)$")
+
+# 凭证按内容命名，内容不会变化
+CACHE_CONTROL = "private, max-age=31536000, immutable"
+# 读取凭证的响应头：禁止浏览器按内容猜测类型
+PROOF_HEADERS = {"Cache-Control": CACHE_CONTROL, "X-Content-Type-Options": "nosniff"}
+
+proof_uploads_total = metrics.registry.register(metrics.Counter(
+    "zentea_payment_proof_uploads_total", "支付凭证上传次数", ("result",),
+))
+
+
+class ProofRejected(ValueError):
+    """上传的凭证不符合要求"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def sniff_type(head: bytes) -> Optional[str]:
+    """按文件头判断格式，返回扩展名"""
+    for magic, ext, _ in MAGIC_TYPES:
+        if head.startswith(magic):
+            return ext
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def proof_name(proof_url: Optional[str]) -> Optional[str]:
+    """从订单的 payment_proof 取出凭证文件名（旧数据中客户提供的外部 URL 返回 None）"""
+    if proof_url and proof_url.startswith(URL_PREFIX):
+        name = proof_url[len(URL_PREFIX):]
+        if NAME_PATTERN.match(name):
+            return name
+    return None
+
+
+def thumbnail_name(name: str) -> Optional[str]:
+    digest, _, ext = name.partition(".")
+    return f"{digest}.thumb.jpg" if ext in IMAGE_EXTENSIONS else None
+
+
+def _signature(name: str, expires: int) -> str:
+    message = f"proof:{expires}:{name}".encode()
+    return hmac.new(settings.SECRET_KEY.encode(), message, hashlib.sha256).hexdigest()[:32]
+
+
+def signed_url(name: str) -> str:
+    """带签名的凭证读取链接（有效期 PROOF_URL_TTL_SECONDS ~ 2 倍该时长）"""
+    ttl = max(1, settings.PROOF_URL_TTL_SECONDS)
+    expires = (int(time.time()) // ttl + 2) * ttl
+    return f"{URL_PREFIX}{expires}/{_signature(name, expires)}/{name}"
+
+
+def verify_signature(name: str, expires: int, signature: str) -> bool:
+    return expires >= time.time() and hmac.compare_digest(_signature(name, expires), signature)
+
+
+def display_url(proof_url: Optional[str]) -> Optional[str]:
+    """订单中保存的凭证 URL 转换为返回给前端的签名链接（旧数据中的外部 URL 原样返回）"""
+    name = proof_name(proof_url)
+    return signed_url(name) if name else proof_url
+
+
+class ProofWriter(ABC):
+    """写入一个凭证文件（由存储实现）"""
+
+    @abstractmethod
+    async def write(self, data: bytes):
+        ...
+
+    @abstractmethod
+    async def commit(self, name: str):
+        """写入完成，以 name 保存（同名文件已存在时保留原文件）"""
+
+    @abstractmethod
+    async def abort(self):
+        ...
+
+
+class ProofStorage(ABC):
+    """凭证存储接口"""
+
+    @abstractmethod
+    def open_writer(self) -> ProofWriter:
+        ...
+
+    @abstractmethod
+    async def existing(self, names: Iterable[str]) -> Set[str]:
+        """names 中已存在的文件名（列表页一次检查一页，不逐个等待）"""
+
+    async def exists(self, name: str) -> bool:
+        return name in await self.existing([name])
+
+    def local_path(self, name: str) -> Optional[str]:
+        """本地文件路径（缩略图生成使用），非本地存储返回 None"""
+        return None
+
+    @abstractmethod
+    def response(self, name: str) -> Response:
+        ...
+
+    @staticmethod
+    def url(name: str) -> str:
+        return URL_PREFIX + name
+
+
+class _LocalWriter(ProofWriter):
+
+    def __init__(self, storage: "LocalProofStorage"):
+        self._storage = storage
+        self._tmp_path = os.path.join(storage.tmp_dir, secrets.token_hex(16))
+        self._file = None
+
+    def _write(self, data: bytes):
+        if self._file is None:
+            os.makedirs(self._storage.tmp_dir, exist_ok=True)
+            self._file = open(self._tmp_path, "wb")
+        self._file.write(data)
+
+    def _commit(self, path: str):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            os.unlink(self._tmp_path)
+        else:
+            os.replace(self._tmp_path, path)
+
+    def _abort(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        try:
+            os.unlink(self._tmp_path)
+        except FileNotFoundError:
+            pass
+
+    async def write(self, data: bytes):
+        await asyncio.to_thread(self._write, data)
+
+    async def commit(self, name: str):
+        await asyncio.to_thread(self._commit, self._storage.local_path(name))
+
+    async def abort(self):
+        await asyncio.to_thread(self._abort)
+
+
+class LocalProofStorage(ProofStorage):
+    """本地目录存储（按文件名前两位分子目录）"""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.tmp_dir = os.path.join(root, "tmp")
+
+    def open_writer(self) -> ProofWriter:
+        return _LocalWriter(self)
+
+    def _existing(self, names: List[str]) -> Set[str]:
+        return {name for name in names if os.path.exists(self.local_path(name))}
+
+    async def existing(self, names: Iterable[str]) -> Set[str]:
+        names = list(names)
+        if not names:
+            return set()
+        # 文件系统检查在线程中执行，不阻塞事件循环
+        return await asyncio.to_thread(self._existing, names)
+
+    def local_path(self, name: str) -> str:
+        return os.path.join(self.root, name[:2], name)
+
+    def response(self, name: str) -> Response:
+        ext = name.rsplit(".", 1)[1]
+        headers = dict(PROOF_HEADERS, ETag=f'"{name}"')
+        if settings.PROOF_ACCEL_REDIRECT:
+            headers["X-Accel-Redirect"] = f"{settings.PROOF_ACCEL_REDIRECT.rstrip('/')}/{name[:2]}/{name}"
+            return Response(media_type=CONTENT_TYPES[ext], headers=headers)
+        return FileResponse(self.local_path(name), media_type=CONTENT_TYPES[ext], headers=headers)
+
+
+STORAGE_BACKENDS: Dict[str, Type[ProofStorage]] = {
+    "local": LocalProofStorage,
+}
+
+
+def _create_storage() -> ProofStorage:
+    backend = STORAGE_BACKENDS.get(settings.PROOF_STORAGE_BACKEND)
+    if backend is None:
+        raise RuntimeError(f"未知的凭证存储: {settings.PROOF_STORAGE_BACKEND}")
+    return backend(settings.PROOF_STORAGE_DIR)
+
+
+class _UploadParser:
+    """multipart 流解析：只接收一个名为 file 的文件字段，其余字段忽略（总长度由 receive_proof 限制）"""
+
+    def __init__(self, writer: ProofWriter):
+        self._writer = writer
+        self._header_name = b""
+        self._header_value = b""
+        self._disposition = b""
+        self._in_file = False
+        self._seen_file = False
+        # 回调中收到的文件数据，解析器每次 write 后异步写入
+        self._chunks: List[bytes] = []
+        self._head = b""
+        self.ext: Optional[str] = None
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+
+    def callbacks(self):
+        return {
+            "on_part_begin": self._on_part_begin,
+            "on_part_data": self._on_part_data,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+        }
+
+    def _on_part_begin(self):
+        self._disposition = b""
+        self._in_file = False
+
+    def _check_header_size(self):
+        if len(self._header_name) + len(self._header_value) > MAX_PART_HEADER_BYTES:
+            raise ProofRejected("上传内容格式错误")
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_name += data[start:end]
+        self._check_header_size()
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+        self._check_header_size()
+
+    def _on_header_end(self):
+        if self._header_name.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_name = self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._disposition)
+        if options.get(b"name") == FILE_FIELD.encode() and b"filename" in options:
+            if self._seen_file:
+                raise ProofRejected("只能上传一个文件")
+            self._in_file = self._seen_file = True
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if self._in_file:
+            self._chunks.append(data[start:end])
+
+    async def drain(self):
+        """校验并写入已解析的文件数据"""
+        chunks, self._chunks = self._chunks, []
+        for chunk in chunks:
+            self.size += len(chunk)
+            if self.size > settings.PROOF_MAX_BYTES:
+                raise ProofRejected(f"文件不能超过 {settings.PROOF_MAX_BYTES // (1024 * 1024)}MB", 413)
+            if self.ext is None:
+                # 文件头未收齐前暂存
+                self._head += chunk
+                if len(self._head) < SNIFF_BYTES:
+                    continue
+                self.ext = sniff_type(self._head)
+                if self.ext is None:
+                    raise ProofRejected("仅支持 PNG、JPEG、WebP 图片或 PDF 文件", 415)
+                chunk, self._head = self._head, b""
+            self.sha256.update(chunk)
+            await self._writer.write(chunk)
+
+    async def finish(self):
+        await self.drain()
+        if not self._seen_file:
+            raise ProofRejected("请选择要上传的文件")
+        if self.ext is None:
+            # 文件小于 SNIFF_BYTES
+            self.ext = sniff_type(self._head)
+            if self.ext is None:
+                raise ProofRejected("仅支持 PNG、JPEG、WebP 图片或 PDF 文件", 415)
+            self.sha256.update(self._head)
+            await self._writer.write(self._head)
+
+
+async def receive_proof(request: Request, storage: ProofStorage) -> str:
+    """从请求体流式接收凭证文件并保存，返回文件名"""
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise ProofRejected("请使用 multipart/form-data 上传文件")
+    max_body = settings.PROOF_MAX_BYTES + MULTIPART_OVERHEAD
+    too_large = f"文件不能超过 {settings.PROOF_MAX_BYTES // (1024 * 1024)}MB"
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_body:
+        raise ProofRejected(too_large, 413)
+
+    writer = storage.open_writer()
+    upload = _UploadParser(writer)
+    parser = MultipartParser(params[b"boundary"], upload.callbacks())
+    try:
+        try:
+            received = 0
+            async for chunk in request.stream():
+                # 按实际读取的字节数限制（分块上传没有 Content-Length，非文件字段也计入）
+                received += len(chunk)
+                if received > max_body:
+                    raise ProofRejected(too_large, 413)
+                parser.write(chunk)
+                await upload.drain()
+            parser.finalize()
+        except ProofRejected:
+            raise
+        except Exception as e:
+            raise ProofRejected("上传内容格式错误") from e
+        await upload.finish()
+        name = f"{upload.sha256.hexdigest()}.{upload.ext}"
+        await writer.commit(name)
+    except BaseException as e:
+        await writer.abort()
+        if isinstance(e, ProofRejected):
+            proof_uploads_total.inc("rejected")
+        raise
+    proof_uploads_total.inc("stored")
+    return name
+
+
+def _make_thumbnail(src: str, dst: str, size: int):
+    """生成 JPEG 缩略图（在子进程中执行，已存在时跳过）"""
+    if os.path.exists(dst):
+        return
+    with Image.open(src) as image:
+        image.thumbnail((size, size))
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        tmp = f"{dst}.{os.getpid()}.tmp"
+        image.save(tmp, "JPEG", quality=80, optimize=True)
+    os.replace(tmp, dst)
+
+
+class ThumbnailPool:
+    """缩略图后台进程池（首次使用时创建，图片解码不占用事件循环和 worker 进程的 GIL）"""
+
+    def __init__(self):
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._tasks = set()
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._tasks)
+
+    def schedule(self, storage: ProofStorage, name: str):
+        """为图片凭证生成缩略图（不等待完成）"""
+        thumb = thumbnail_name(name)
+        src = storage.local_path(name)
+        if Image is None or thumb is None or src is None or settings.PROOF_THUMBNAIL_WORKERS <= 0:
+            return
+        dst = storage.local_path(thumb)
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=settings.PROOF_THUMBNAIL_WORKERS)
+        future = asyncio.get_running_loop().run_in_executor(
+            self._executor, _make_thumbnail, src, dst, settings.PROOF_THUMBNAIL_SIZE,
+        )
+        task = asyncio.ensure_future(future)
+        self._tasks.add(task)
+        task.add_done_callback(self._done)
+
+    def _done(self, task: asyncio.Future):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("支付凭证缩略图生成失败: %s", task.exception())
+
+    def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# 全局单例
+proof_storage = _create_storage()
+thumbnails = ThumbnailPool()
+
+metrics.register_gauge(
+    "zentea_payment_proof_thumbnails_pending", "等待生成的支付凭证缩略图数", lambda: thumbnails.pending_count,
+)
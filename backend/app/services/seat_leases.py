@@ -0,0 +1,299 @@
+"""
+并发用户席位租约
+License.max_users 限制同一授权同时在线的用户数：ERP 客户端登录时领取（checkout）租约，
+在线期间定期续租（renew），退出时归还（checkin），未续租的租约到期后自动释放席位。
+
+- 领取较少，直接读写 license_seat_leases 并锁定授权行，多 worker 下也不会超发
+- 续租占绝大多数调用，只在内存租约表中延长到期时间，由后台任务每 SEAT_LEASE_CHECKPOINT_SECONDS
+  批量写回；本进程未持有的租约（其他 worker 领取的或进程重启后）首次续租时从数据库加载
+- 数据库中的到期时间最多落后一个检查点，统计占用席位和清理过期记录时额外保留两个检查点间隔，
+  宁可晚释放也不超发
+- 内存中的租约用最小堆按到期时间惰性淘汰（续租只压入新条目，弹出时以租约当前到期时间为准）
+- 归还、吊销、解绑会删除数据库记录，其他 worker 在下一个检查点发现记录已删除后丢弃内存租约
+"""
+import asyncio
+import heapq
+import logging
+import secrets
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import bindparam, case, delete
+from sqlmodel import select
+
+from app.core import metrics
+from app.core.config import settings
+from app.core.database import async_session
+from app.models.license import License, LicenseSeatLease
+
+logger = logging.getLogger("zentea.seats")
+
+# 检查点核对租约是否仍存在时，每条 IN 查询的租约数
+CHUNK_SIZE = 500
+
+_leases = LicenseSeatLease.__table__
+
+# 检查点批量写回续租：只前移到期时间（多个 worker 持有同一租约时以最晚的为准）
+CHECKPOINT_UPDATE = (
+    _leases.update()
+    .where(_leases.c.id == bindparam("b_id"))
+    .values(expires_at=case(
+        (_leases.c.expires_at < bindparam("b_expires_at"), bindparam("b_expires_at")),
+        else_=_leases.c.expires_at,
+    ))
+)
+
+seat_checkouts_total = metrics.registry.register(metrics.Counter(
+    "zentea_seat_checkouts_total", "席位领取次数", ("result",),
+))
+
+
+def _grace() -> timedelta:
+    """数据库中到期时间可能落后的最大时长"""
+    return timedelta(seconds=2 * settings.SEAT_LEASE_CHECKPOINT_SECONDS)
+
+
+class Lease:
+    """内存中的席位租约"""
+    __slots__ = ("id", "license_id", "client_id", "machine_id", "expires_at", "license_expire")
+
+    def __init__(
+        self, id: str, license_id: int, client_id: str, machine_id: str,
+        expires_at: datetime, license_expire: Optional[datetime],
+    ):
+        self.id = id
+        self.license_id = license_id
+        self.client_id = client_id
+        self.machine_id = machine_id
+        self.expires_at = expires_at
+        # 授权到期时间：租约不会超过该时间
+        self.license_expire = license_expire
+
+    def to_dict(self) -> dict:
+        return {
+            "lease_id": self.id,
+            "expires_at": self.expires_at.isoformat(),
+            "ttl": max(0, int((self.expires_at - datetime.utcnow()).total_seconds())),
+        }
+
+
+class SeatLeaseTable:
+    """本进程的内存租约表"""
+
+    def __init__(self):
+        self._leases: Dict[str, Lease] = {}
+        self._by_license: Dict[int, Set[str]] = {}
+        # (到期时间, 租约 ID) 最小堆
+        self._heap: List[Tuple[datetime, str]] = []
+        # 续租后尚未写回数据库的租约
+        self._dirty: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def held_count(self) -> int:
+        return len(self._leases)
+
+    @staticmethod
+    def _new_expiry(license_expire: Optional[datetime], now: datetime) -> datetime:
+        expires_at = now + timedelta(seconds=settings.SEAT_LEASE_TTL_SECONDS)
+        if license_expire is not None and license_expire < expires_at:
+            return license_expire
+        return expires_at
+
+    def _hold(self, lease: Lease):
+        self._leases[lease.id] = lease
+        self._by_license.setdefault(lease.license_id, set()).add(lease.id)
+        heapq.heappush(self._heap, (lease.expires_at, lease.id))
+
+    def _discard(self, lease_id: str):
+        lease = self._leases.pop(lease_id, None)
+        if lease is None:
+            return
+        self._dirty.discard(lease_id)
+        ids = self._by_license.get(lease.license_id)
+        if ids is not None:
+            ids.discard(lease_id)
+            if not ids:
+                del self._by_license[lease.license_id]
+
+    def _expire(self, now: datetime):
+        """淘汰已到期的租约"""
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            _, lease_id = heapq.heappop(heap)
+            lease = self._leases.get(lease_id)
+            # 已续租的租约在堆中还有更晚的条目
+            if lease is not None and lease.expires_at <= now:
+                self._discard(lease_id)
+
+    async def checkout(
+        self, session, license: License, client_id: str, machine_id: str,
+    ) -> Tuple[Optional[Lease], int]:
+        """
+        领取席位（调用方已校验授权有效）
+        返回 (租约, 当前占用席位数)，席位已满时租约为 None；同一客户端重复领取时复用原租约
+        """
+        now = datetime.utcnow()
+        grace = _grace()
+        # 锁定授权行，串行化同一授权的领取（SQLite 下进入写队列）
+        await session.execute(select(License.id).where(License.id == license.id).with_for_update())
+        await session.execute(
+            delete(LicenseSeatLease).where(
+                LicenseSeatLease.license_id == license.id,
+                LicenseSeatLease.expires_at < now - grace,
+            )
+        )
+        result = await session.execute(
+            select(LicenseSeatLease).where(LicenseSeatLease.license_id == license.id)
+        )
+        rows = result.scalars().all()
+        expires_at = self._new_expiry(license.expire_date, now)
+
+        row = next((r for r in rows if r.client_id == client_id and r.machine_id == machine_id), None)
+        if row is not None:
+            outcome = "reused"
+            row.expires_at = max(row.expires_at, expires_at)
+        elif len(rows) >= license.max_users:
+            # 提交过期记录的清理并释放行锁
+            await session.commit()
+            seat_checkouts_total.inc("denied")
+            return None, len(rows)
+        else:
+            outcome = "granted"
+            row = LicenseSeatLease(
+                id=secrets.token_urlsafe(24),
+                license_id=license.id,
+                client_id=client_id,
+                machine_id=machine_id,
+                expires_at=expires_at,
+            )
+            session.add(row)
+            rows.append(row)
+        await session.commit()
+
+        self._discard(row.id)
+        lease = Lease(row.id, license.id, client_id, machine_id, row.expires_at, license.expire_date)
+        self._hold(lease)
+        seat_checkouts_total.inc(outcome)
+        return lease, len(rows)
+
+    async def renew(self, session, lease_id: str) -> Optional[Lease]:
+        """续租；本进程持有该租约时不访问数据库。租约不存在、已过期或授权已到期时返回 None"""
+        now = datetime.utcnow()
+        self._expire(now)
+        lease = self._leases.get(lease_id)
+        metrics.record_cache("seat_leases", lease is not None)
+        if lease is None:
+            result = await session.execute(
+                select(LicenseSeatLease, License.expire_date)
+                .join(License, License.id == LicenseSeatLease.license_id)
+                .where(LicenseSeatLease.id == lease_id, LicenseSeatLease.expires_at >= now - _grace())
+            )
+            row = result.first()
+            if row is None:
+                return None
+            stored, license_expire = row
+            lease = Lease(
+                stored.id, stored.license_id, stored.client_id, stored.machine_id,
+                stored.expires_at, license_expire,
+            )
+            self._hold(lease)
+
+        expires_at = self._new_expiry(lease.license_expire, now)
+        if expires_at <= now:
+            self._discard(lease_id)
+            return None
+        lease.expires_at = expires_at
+        heapq.heappush(self._heap, (expires_at, lease_id))
+        self._dirty.add(lease_id)
+        return lease
+
+    async def checkin(self, session, lease_id: str) -> bool:
+        """归还席位，返回租约是否存在"""
+        held = lease_id in self._leases
+        self._discard(lease_id)
+        result = await session.execute(delete(LicenseSeatLease).where(LicenseSeatLease.id == lease_id))
+        await session.commit()
+        return held or result.rowcount > 0
+
+    async def release_license(self, session, license_id: int, machine_id: Optional[str] = None):
+        """
+        释放授权的席位（吊销、解绑、停用时在同一事务中调用，由调用方提交）
+        指定 machine_id 时只释放该设备上的席位
+        """
+        stmt = delete(LicenseSeatLease).where(LicenseSeatLease.license_id == license_id)
+        if machine_id is not None:
+            stmt = stmt.where(LicenseSeatLease.machine_id == machine_id)
+        await session.execute(stmt)
+        for lease_id in list(self._by_license.get(license_id, ())):
+            if machine_id is None or self._leases[lease_id].machine_id == machine_id:
+                self._discard(lease_id)
+
+    # ==================== 检查点 ====================
+
+    async def checkpoint(self):
+        """续租写回数据库、清理过期记录，并丢弃已在其他 worker 归还或释放的租约"""
+        now = datetime.utcnow()
+        self._expire(now)
+        dirty = {lease_id: self._leases[lease_id].expires_at for lease_id in self._dirty if lease_id in self._leases}
+        self._dirty = set()
+        held = list(self._leases)
+        try:
+            async with async_session() as session:
+                if dirty:
+                    await session.execute(
+                        CHECKPOINT_UPDATE,
+                        [{"b_id": lease_id, "b_expires_at": expires_at} for lease_id, expires_at in dirty.items()],
+                    )
+                await session.execute(delete(LicenseSeatLease).where(LicenseSeatLease.expires_at < now - _grace()))
+                existing: Set[str] = set()
+                for i in range(0, len(held), CHUNK_SIZE):
+                    result = await session.execute(
+                        select(LicenseSeatLease.id).where(LicenseSeatLease.id.in_(held[i:i + CHUNK_SIZE]))
+                    )
+                    existing.update(result.scalars().all())
+                await session.commit()
+        except BaseException:
+            # 写回失败时保留到下一个检查点
+            self._dirty.update(lease_id for lease_id in dirty if lease_id in self._leases)
+            raise
+        for lease_id in held:
+            if lease_id not in existing:
+                self._discard(lease_id)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.SEAT_LEASE_CHECKPOINT_SECONDS)
+            try:
+                await self.checkpoint()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("席位租约检查点写入失败")
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止后台任务，并写回最后一次检查点"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        try:
+            await self.checkpoint()
+        except Exception:
+            logger.exception("席位租约检查点写入失败")
+
+
+# 全局单例
+seat_leases = SeatLeaseTable()
+
+metrics.register_gauge(
+    "zentea_seat_leases_held", "本进程内存中持有的席位租约数", lambda: seat_leases.held_count,
+)
@@ -0,0 +1,221 @@
+"""
+授权共享检测
+破解或转借的授权码通常表现为：同一授权从大量不同 IP 验证，或多台机器交替使用同一授权码。
+验证和激活请求将（授权、机器码、IP、设备是否已绑定）送入本模块，在内存中按授权维护有界的滑动窗口状态：
+- 不同 IP：每个授权最多跟踪 MAX_TRACKED_IPS 个 IP 及最近出现时间，窗口内的数量超过 SHARING_MAX_IPS 时告警
+- 机器切换：与上一次请求的机器码不同且至少一方未绑定（已绑定设备之间交替是多设备授权的正常情况），
+  窗口内的切换次数超过 SHARING_MAX_MACHINE_FLIPS 时告警
+告警由后台任务批量写入 license_flags 供管理员处理，同一授权同类告警未处理前只更新观测值
+（部分唯一索引 + upsert，多个 worker 同时检测到同一事件也只有一条未处理告警）。
+检测不查询心跳历史；跟踪的授权数超过 MAX_TRACKED_LICENSES 时淘汰最久未出现的授权。
+各 worker 独立检测，负载均衡分散请求时每个 worker 只看到部分流量，阈值按单个 worker 配置。
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional, Tuple
+
+from sqlalchemy import case, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app.core import metrics
+from app.core.config import settings
+from app.core.database import async_session, engine
+from app.models.license import LicenseFlag
+
+logger = logging.getLogger("zentea.sharing")
+
+_flags = LicenseFlag.__table__
+
+# 告警类型
+KIND_MANY_IPS = "many_ips"
+KIND_MACHINE_FLIPS = "machine_flips"
+
+# 内存上限：跟踪的授权数、每个授权跟踪的 IP 数和切换记录数（阈值不应超过后两者）
+MAX_TRACKED_LICENSES = 200000
+MAX_TRACKED_IPS = 32
+MAX_TRACKED_FLIPS = 64
+
+# 告警详情中列出的 IP 数
+DETAIL_IPS = 10
+
+sharing_flags_total = metrics.registry.register(metrics.Counter(
+    "zentea_license_sharing_flags_total", "授权共享告警次数", ("kind",),
+))
+
+
+def _upsert_statement():
+    """写入告警：已有同类未处理告警时只前移观测值、更新详情和时间"""
+    insert = pg_insert if engine.dialect.name == "postgresql" else sqlite_insert
+    stmt = insert(_flags)
+    return stmt.on_conflict_do_update(
+        index_elements=["license_id", "kind"],
+        index_where=text("status = 'open'"),
+        set_={
+            "observed": case(
+                (_flags.c.observed < stmt.excluded.observed, stmt.excluded.observed), else_=_flags.c.observed,
+            ),
+            "detail": stmt.excluded.detail,
+            "updated_at": stmt.excluded.updated_at,
+        },
+    )
+
+
+class _LicenseState:
+    """单个授权的滑动窗口状态"""
+    __slots__ = ("ips", "last_machine", "last_bound", "flips", "flagged")
+
+    def __init__(self):
+        # {IP: 最近出现时间}
+        self.ips: Dict[str, float] = {}
+        self.last_machine: Optional[str] = None
+        self.last_bound = True
+        # 机器切换时间
+        self.flips: Deque[float] = deque(maxlen=MAX_TRACKED_FLIPS)
+        # {告警类型: 告警时间}，窗口内不重复告警
+        self.flagged: Dict[str, float] = {}
+
+
+class SharingDetector:
+    """授权共享检测器"""
+
+    def __init__(self):
+        self._states: "OrderedDict[int, _LicenseState]" = OrderedDict()
+        # 待写入的告警
+        self._pending: List[dict] = []
+        self._upsert = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def tracked_count(self) -> int:
+        return len(self._states)
+
+    def _state(self, license_id: int) -> _LicenseState:
+        state = self._states.get(license_id)
+        if state is None:
+            state = self._states[license_id] = _LicenseState()
+            if len(self._states) > MAX_TRACKED_LICENSES:
+                self._states.popitem(last=False)
+        else:
+            self._states.move_to_end(license_id)
+        return state
+
+    def observe(
+        self, license_id: int, machine_id: str, ip_address: Optional[str], bound: bool,
+        now: Optional[float] = None,
+    ):
+        """记录一次验证/激活请求（只写内存）；bound 为该机器码是否已绑定到授权"""
+        now = time.time() if now is None else now
+        since = now - settings.SHARING_WINDOW_SECONDS
+        state = self._state(license_id)
+
+        if ip_address:
+            ips = state.ips
+            is_new = ip_address not in ips
+            ips[ip_address] = now
+            if is_new:
+                if len(ips) > MAX_TRACKED_IPS:
+                    for ip in [ip for ip, seen in ips.items() if seen < since] or [min(ips, key=ips.get)]:
+                        del ips[ip]
+                distinct = sum(1 for seen in ips.values() if seen >= since)
+                if distinct > settings.SHARING_MAX_IPS:
+                    recent = sorted(ips, key=ips.get, reverse=True)[:DETAIL_IPS]
+                    self._flag(license_id, state, KIND_MANY_IPS, distinct, settings.SHARING_MAX_IPS, now,
+                               "最近 IP: " + ", ".join(recent))
+
+        last = state.last_machine
+        if last is not None and machine_id != last and not (bound and state.last_bound):
+            flips = state.flips
+            flips.append(now)
+            while flips and flips[0] < since:
+                flips.popleft()
+            if len(flips) > settings.SHARING_MAX_MACHINE_FLIPS:
+                self._flag(license_id, state, KIND_MACHINE_FLIPS, len(flips), settings.SHARING_MAX_MACHINE_FLIPS, now,
+                           f"机器码在 {last} 与 {machine_id} 之间切换")
+        state.last_machine, state.last_bound = machine_id, bound
+
+    def _flag(
+        self, license_id: int, state: _LicenseState, kind: str, observed: int, threshold: int,
+        now: float, detail: str,
+    ):
+        flagged_at = state.flagged.get(kind)
+        if flagged_at is not None and flagged_at >= now - settings.SHARING_WINDOW_SECONDS:
+            return
+        state.flagged[kind] = now
+        sharing_flags_total.inc(kind)
+        self._pending.append({
+            "license_id": license_id,
+            "kind": kind,
+            "observed": observed,
+            "threshold": threshold,
+            "window_seconds": settings.SHARING_WINDOW_SECONDS,
+            "detail": detail[:500],
+            "created_at": datetime.utcfromtimestamp(now),
+        })
+
+    async def flush(self):
+        """写入待处理的告警；同一授权同类告警已有未处理记录时更新观测值"""
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+        # 同一批内的同类告警先合并（同一条 upsert 不能两次更新同一行）
+        rows: Dict[Tuple[int, str], dict] = {}
+        for item in pending:
+            key = (item["license_id"], item["kind"])
+            row = rows.get(key)
+            if row is None:
+                rows[key] = dict(item, status="open", updated_at=item["created_at"])
+            else:
+                row.update(
+                    observed=max(row["observed"], item["observed"]), detail=item["detail"],
+                    updated_at=item["created_at"],
+                )
+        if self._upsert is None:
+            self._upsert = _upsert_statement()
+        try:
+            async with async_session() as session:
+                await session.execute(self._upsert, list(rows.values()))
+                await session.commit()
+        except BaseException:
+            self._pending = pending + self._pending
+            raise
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.SHARING_FLUSH_SECONDS)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("授权共享告警写入失败，下次重试")
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止后台任务，并写入最后一批"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("授权共享告警写入失败")
+
+
+# 全局单例
+sharing_detector = SharingDetector()
+
+metrics.register_gauge(
+    "zentea_license_sharing_tracked", "共享检测跟踪的授权数", lambda: sharing_detector.tracked_count,
+)
@@ -0,0 +1,65 @@
+"""
+授权验证快速路径
+/license/verify 的 ORM 实现需要加载完整的 License 实例（模型校验 + 会话跟踪），
+再单独执行 INSERT license_heartbeats，至少两次往返。
+这里在 asyncpg 驱动连接上用一条 CTE 语句完成查询（含设备绑定探测）、标记过期和写心跳日志，
+只返回判定所需的列；asyncpg 会自动预编译并缓存该语句。
+
+仅在 LICENSE_VERIFY_FAST_PATH 开启且数据库驱动为 asyncpg 时生效，其余情况走 ORM 路径，
+两条路径的判定顺序和响应内容保持一致，便于用 benchmarks.heartbeat_load 对比。
+"""
+import time
+from datetime import datetime
+from typing import Optional
+
+from app.core import query_stats
+from app.core.config import settings
+from app.core.database import engine
+
+# 返回更新前的授权行（与 ORM 路径读取到的值一致），只在设备已绑定（binding_id 非空）且未吊销时写入：
+# - 已过期：状态改为 expired
+# - 有效：$5 为真时写入心跳日志（去重见 services/heartbeat_log.py）；最近心跳时间由调用方记入在线状态缓冲（services/presence.py），不改写授权行
+VERIFY_SQL = """
+WITH target AS (
+    SELECT l.id, l.user_id, b.id AS binding_id, l.status, l.plan_type, l.expire_date, l.max_users, l.state_version
+    FROM licenses AS l
+    LEFT JOIN license_bindings AS b ON b.license_id = l.id AND b.machine_id = $2
+    WHERE l.license_key = $1
+),
+expired AS (
+    UPDATE licenses AS l
+    SET status = 'expired', state_version = l.state_version + 1
+    FROM target AS t
+    WHERE l.id = t.id AND t.binding_id IS NOT NULL AND t.status NOT IN ('revoked', 'expired')
+      AND t.expire_date IS NOT NULL AND t.expire_date < $3
+),
+heartbeat AS (
+    INSERT INTO license_heartbeats (license_id, machine_id, ip_address, created_at)
+    SELECT id, $2, $4, $3 FROM target
+    WHERE $5 AND binding_id IS NOT NULL AND status <> 'revoked' AND (expire_date IS NULL OR expire_date >= $3)
+)
+SELECT id, user_id, binding_id, status, plan_type, expire_date, max_users, state_version FROM target
+"""
+
+
+def enabled() -> bool:
+    """是否启用快速路径"""
+    return settings.LICENSE_VERIFY_FAST_PATH and engine.dialect.driver == "asyncpg"
+
+
+async def verify_and_touch(
+    license_key: str, machine_id: str, ip_address: str, now: datetime, log_heartbeat: bool = True,
+) -> Optional[dict]:
+    """
+    查询授权并在同一语句中完成心跳更新（log_heartbeat 为假时不写心跳日志）
+    返回更新前的 id / user_id / binding_id（设备未绑定时为 None）/ status / plan_type / expire_date / max_users / state_version，
+    授权码不存在时返回 None
+    """
+    params = (license_key, machine_id, now, ip_address, log_heartbeat)
+    async with engine.connect() as conn:
+        raw = await conn.get_raw_connection()
+        start = time.perf_counter()
+        # 单条语句在 asyncpg 中自动提交，无需显式事务
+        row = await raw.driver_connection.fetchrow(VERIFY_SQL, *params)
+        query_stats.record_statement(VERIFY_SQL, params, time.perf_counter() - start)
+    return dict(row) if row is not None else None
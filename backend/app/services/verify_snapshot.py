@@ -0,0 +1,455 @@
+"""
+授权验证快照（内存映射文件）
+定期把所有非 pending 授权写成按 (授权码哈希, 机器码哈希) 排序的定长记录文件，各 worker 进程以只读 mmap 映射，
+/license/verify 用二分查找判定，数据由操作系统页缓存在进程间共享，无需每个进程各自加载一份。
+文件也可同步到其他主机，供只读的边缘验证节点（LICENSE_SNAPSHOT_EDGE）使用。
+
+- 快照文件：头部 + 按 (key_hash, machine_hash) 排序的记录；每台绑定设备一条记录，
+  没有绑定设备的授权一条 machine_hash 为 0 的记录，同一授权的记录相邻
+- 增量文件（<快照>.delta）：管理员修改、激活/停用后追加该授权的全部记录，叠加在快照之上直到下次重建；
+  同一授权以 state_version 较大者为准，因此增量与快照的先后顺序不影响结果
+- 重建由任一 worker 在文件锁保护下完成（写临时文件后原子替换），随后压缩增量文件，
+  读取方按 inode 变化重新映射
+
+记录只保存判定所需的字段，授权码与机器码以 64 位哈希存储。
+"""
+import asyncio
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from sqlmodel import select
+
+from app.core import metrics
+from app.core.config import settings
+from app.core.database import async_session
+from app.models.license import License, LicenseBinding
+from app.services import bindings
+
+logger = logging.getLogger("zentea.snapshot")
+
+MAGIC = b"ZTVS"
+FORMAT_VERSION = 2
+
+# 头部：魔数、格式版本、记录长度、记录数、数据截止时间（微秒）、生成时间（微秒）
+HEADER = struct.Struct("<4sHHIqq")
+# 记录：key_hash、machine_hash（0 为未绑定）、授权 ID、expire（微秒，0 为无到期日）、max_users、state_version、
+# status、plan_type
+RECORD = struct.Struct("<QQqqIIBBxx")
+SORT_KEY = struct.Struct("<QQ")
+# 增量记录：写入时间（微秒）+ 记录
+DELTA = struct.Struct("<q" + RECORD.format[1:])
+
+STATUS_CODES = {"pending": 0, "active": 1, "expired": 2, "revoked": 3}
+# 已删除的授权（仅出现在增量文件中）
+STATUS_DELETED = 255
+STATUS_NAMES = {code: name for name, code in STATUS_CODES.items()}
+
+PLAN_CODES = {"monthly": 1, "yearly": 2, "lifetime": 3, "trial": 4, "promo_free": 5, "free_forever": 6}
+PLAN_NAMES = {code: name for name, code in PLAN_CODES.items()}
+
+# 读取方检查文件变化的最小间隔（秒）
+REFRESH_INTERVAL = 1.0
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _hash(value: Optional[str]) -> int:
+    """64 位哈希（0 保留给空值）"""
+    if not value:
+        return 0
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "little") or 1
+
+
+def _to_micros(value: Optional[datetime]) -> int:
+    if value is None:
+        return 0
+    return (value - _EPOCH) // timedelta(microseconds=1)
+
+
+def _now_micros() -> int:
+    return int(time.time() * 1_000_000)
+
+
+class SnapshotRecord(NamedTuple):
+    """快照中的授权状态"""
+    key_hash: int
+    machine_hash: int
+    license_id: int
+    expire: int
+    max_users: int
+    state_version: int
+    status: int
+    plan: int
+
+    @property
+    def status_name(self) -> Optional[str]:
+        return STATUS_NAMES.get(self.status)
+
+    @property
+    def plan_type(self) -> Optional[str]:
+        return PLAN_NAMES.get(self.plan)
+
+    @property
+    def expire_date(self) -> Optional[datetime]:
+        return _EPOCH + timedelta(microseconds=self.expire) if self.expire else None
+
+    def machine_matches(self, machine_id: str) -> bool:
+        return self.machine_hash != 0 and self.machine_hash == _hash(machine_id)
+
+    def is_expired(self) -> bool:
+        return self.expire != 0 and self.expire < _now_micros()
+
+
+def _record(
+    license_key: str, license_id: int, machine_id: Optional[str], status: str, plan_type: str,
+    expire_date: Optional[datetime], max_users: int, state_version: int,
+) -> SnapshotRecord:
+    return SnapshotRecord(
+        _hash(license_key), _hash(machine_id), license_id, _to_micros(expire_date),
+        max_users or 0, state_version or 0, STATUS_CODES.get(status, STATUS_DELETED), PLAN_CODES.get(plan_type, 0),
+    )
+
+
+# ==================== 读取 ====================
+
+class SnapshotReader:
+    """映射快照文件并叠加增量记录"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.delta_path = path + ".delta"
+        self._file = None
+        self._mmap: Optional[mmap.mmap] = None
+        self._inode: Optional[int] = None
+        self._count = 0
+        self._as_of = 0
+        self._built_at = 0
+        self._delta_inode: Optional[int] = None
+        self._delta_offset = 0
+        # {key_hash: (state_version, {machine_hash: 记录})}
+        self._overlay: Dict[int, Tuple[int, Dict[int, SnapshotRecord]]] = {}
+        self._checked_at = 0.0
+
+    @property
+    def loaded(self) -> bool:
+        return self._mmap is not None
+
+    @property
+    def record_count(self) -> int:
+        return self._count
+
+    @property
+    def age_seconds(self) -> Optional[float]:
+        return (_now_micros() - self._built_at) / 1e6 if self.loaded else None
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._file.close()
+        self._mmap = self._file = self._inode = None
+        self._count = 0
+
+    def _load(self):
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            self.close()
+            return
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, record_size, count, as_of, built_at = HEADER.unpack_from(mm, 0)
+            if magic != MAGIC or version != FORMAT_VERSION or record_size != RECORD.size:
+                raise ValueError("快照格式不兼容")
+            if len(mm) < HEADER.size + count * RECORD.size:
+                raise ValueError("快照文件不完整")
+        except (ValueError, struct.error, OSError):
+            f.close()
+            logger.warning("快照文件无效，忽略: %s", self.path, exc_info=True)
+            return
+        self.close()
+        self._file, self._mmap = f, mm
+        self._inode = os.fstat(f.fileno()).st_ino
+        self._count, self._as_of, self._built_at = count, as_of, built_at
+        # 新快照已包含截止时间之前的增量，重新读取增量文件
+        self._delta_inode = None
+
+    def _read_deltas(self):
+        try:
+            st = os.stat(self.delta_path)
+        except FileNotFoundError:
+            self._delta_inode, self._delta_offset, self._overlay = None, 0, {}
+            return
+        if st.st_ino != self._delta_inode or st.st_size < self._delta_offset:
+            self._delta_inode, self._delta_offset, self._overlay = st.st_ino, 0, {}
+        if st.st_size - self._delta_offset < DELTA.size:
+            return
+        with open(self.delta_path, "rb") as f:
+            f.seek(self._delta_offset)
+            data = f.read((st.st_size - self._delta_offset) // DELTA.size * DELTA.size)
+        self._delta_offset += len(data)
+        for values in DELTA.iter_unpack(data):
+            if values[0] < self._as_of:
+                continue
+            record = SnapshotRecord(*values[1:])
+            current = self._overlay.get(record.key_hash)
+            if current is None or record.state_version > current[0]:
+                self._overlay[record.key_hash] = (record.state_version, {record.machine_hash: record})
+            elif record.state_version == current[0]:
+                current[1][record.machine_hash] = record
+
+    def refresh(self, force: bool = False):
+        """检查快照和增量文件是否有变化（默认最多每 REFRESH_INTERVAL 秒一次）"""
+        now = time.monotonic()
+        if not force and now - self._checked_at < REFRESH_INTERVAL:
+            return
+        self._checked_at = now
+        try:
+            inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            inode = None
+        if inode != self._inode:
+            self._load()
+        if self.loaded:
+            self._read_deltas()
+
+    def _search(self, key_hash: int, machine_hash: int) -> Optional[SnapshotRecord]:
+        """二分查找 (key_hash, machine_hash)；设备未绑定时返回该授权的相邻记录"""
+        mm, lo, hi = self._mmap, 0, self._count
+        target = (key_hash, machine_hash)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if SORT_KEY.unpack_from(mm, HEADER.size + mid * RECORD.size) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        # lo 为第一条不小于目标的记录：命中时即为该设备，否则同一授权的记录只可能在 lo 或 lo - 1
+        for i in (lo, lo - 1):
+            if 0 <= i < self._count:
+                values = RECORD.unpack_from(mm, HEADER.size + i * RECORD.size)
+                if values[0] == key_hash:
+                    return SnapshotRecord(*values)
+        return None
+
+    def lookup(self, license_key: str, machine_id: str) -> Optional[SnapshotRecord]:
+        """
+        查询授权在该设备上的状态；快照未加载或授权码不在快照中时返回 None
+        设备未绑定时返回该授权的其他记录（machine_matches 为 False），
+        已删除的授权返回 status 为 STATUS_DELETED 的记录
+        """
+        self.refresh()
+        if not self.loaded:
+            return None
+        key_hash, machine_hash = _hash(license_key), _hash(machine_id)
+        record = self._search(key_hash, machine_hash)
+        delta = self._overlay.get(key_hash)
+        if delta is not None and (record is None or delta[0] >= record.state_version):
+            records = delta[1]
+            record = records.get(machine_hash) or next(iter(records.values()))
+        metrics.record_cache("license_snapshot", record is not None)
+        return record
+
+
+# ==================== 增量 ====================
+
+def _append_deltas(path: str, records: Iterable[SnapshotRecord]):
+    now = _now_micros()
+    data = b"".join(DELTA.pack(now, *record) for record in records)
+    if not data:
+        return
+    while True:
+        with open(path, "ab") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            # 加锁期间文件可能已被压缩替换，需写入新文件
+            try:
+                replaced = os.stat(path).st_ino != os.fstat(f.fileno()).st_ino
+            except FileNotFoundError:
+                replaced = True
+            if not replaced:
+                f.write(data)
+                return
+
+
+async def record_license(session, license: License):
+    """授权状态或绑定设备变更提交后调用，写入该授权的全部记录（未启用快照时不做任何事）"""
+    if not settings.LICENSE_SNAPSHOT_PATH or settings.LICENSE_SNAPSHOT_EDGE:
+        return
+    machines = await bindings.machine_ids(session, license.id) or [None]
+    records = [
+        _record(
+            license.license_key, license.id, machine_id, license.status, license.plan_type,
+            license.expire_date, license.max_users, license.state_version,
+        )
+        for machine_id in machines
+    ]
+    try:
+        _append_deltas(settings.LICENSE_SNAPSHOT_PATH + ".delta", records)
+    except OSError:
+        # 写入失败时读取方最迟在下次重建后得到正确状态
+        logger.exception("写入验证快照增量失败")
+    # 本进程立即可见，其他 worker 最迟 REFRESH_INTERVAL 秒后可见
+    reader.refresh(force=True)
+
+
+def record_removed(license_keys: Iterable[str]):
+    """授权被删除后调用"""
+    if not settings.LICENSE_SNAPSHOT_PATH or settings.LICENSE_SNAPSHOT_EDGE:
+        return
+    # 删除记录的版本号取最大值，保证覆盖快照中的旧状态
+    records = [SnapshotRecord(_hash(key), 0, 0, 0, 0, 0xFFFFFFFF, STATUS_DELETED, 0) for key in license_keys]
+    try:
+        _append_deltas(settings.LICENSE_SNAPSHOT_PATH + ".delta", records)
+    except OSError:
+        logger.exception("写入验证快照增量失败")
+    reader.refresh(force=True)
+
+
+# ==================== 重建 ====================
+
+def _write_snapshot(path: str, rows: List[Tuple], as_of: int) -> int:
+    records = sorted(_record(*row) for row in rows)
+    # 哈希冲突（极少见）时保留版本号较大的一条
+    unique: List[SnapshotRecord] = []
+    for record in records:
+        if unique and unique[-1][:2] == record[:2]:
+            unique[-1] = max(unique[-1], record, key=lambda r: r.state_version)
+        else:
+            unique.append(record)
+
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, RECORD.size, len(unique), as_of, _now_micros()))
+        f.write(b"".join(RECORD.pack(*record) for record in unique))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    _compact_deltas(path + ".delta", as_of)
+    return len(unique)
+
+
+def _compact_deltas(path: str, as_of: int):
+    """删除已包含在新快照中的增量记录（替换为新文件，写入方和读取方按 inode 识别）"""
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return
+    with f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        data = f.read()
+        kept = b"".join(
+            data[i:i + DELTA.size]
+            for i in range(0, len(data) - DELTA.size + 1, DELTA.size)
+            if DELTA.unpack_from(data, i)[0] >= as_of
+        )
+        tmp_path = f"{path}.tmp.{os.getpid()}"
+        with open(tmp_path, "wb") as out:
+            out.write(kept)
+        os.replace(tmp_path, path)
+
+
+async def build_snapshot(path: str) -> int:
+    """从数据库重建快照，返回记录数"""
+    # 截止时间取查询开始前，之后提交的修改由增量文件补充
+    as_of = _now_micros()
+    async with async_session() as session:
+        result = await session.execute(
+            select(
+                License.license_key, License.id, LicenseBinding.machine_id, License.status, License.plan_type,
+                License.expire_date, License.max_users, License.state_version,
+            )
+            .outerjoin(LicenseBinding, LicenseBinding.license_id == License.id)
+            .where(License.status != "pending")
+        )
+        rows = result.all()
+    return await asyncio.to_thread(_write_snapshot, path, rows, as_of)
+
+
+class SnapshotBuilder:
+    """后台定期重建快照；多个 worker 通过文件锁保证同一时间只有一个在重建"""
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+
+    def _try_lock(self, path: str):
+        f = open(path + ".lock", "a")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            return None
+        return f
+
+    async def rebuild_if_due(self, path: str):
+        interval = settings.LICENSE_SNAPSHOT_INTERVAL_SECONDS
+        lock = self._try_lock(path)
+        if lock is None:
+            return
+        with lock:
+            try:
+                age = time.time() - os.stat(path).st_mtime
+            except FileNotFoundError:
+                age = None
+            # 其他 worker 刚完成重建时跳过
+            if age is not None and age < interval * 0.9:
+                return
+            start = time.perf_counter()
+            count = await build_snapshot(path)
+            snapshot_build_seconds.observe(time.perf_counter() - start)
+            logger.info("验证快照已重建: %s 条记录，耗时 %.2fs", count, time.perf_counter() - start)
+
+    async def _run(self, path: str):
+        while True:
+            try:
+                await self.rebuild_if_due(path)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("验证快照重建失败")
+            await asyncio.sleep(settings.LICENSE_SNAPSHOT_INTERVAL_SECONDS)
+
+    async def start(self):
+        """启动定期重建（未配置快照路径或边缘节点时不启动）"""
+        path = settings.LICENSE_SNAPSHOT_PATH
+        if not path or settings.LICENSE_SNAPSHOT_EDGE or self._task is not None:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._task = asyncio.create_task(self._run(path))
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+def enabled() -> bool:
+    """是否使用快照判定"""
+    return bool(settings.LICENSE_SNAPSHOT_PATH)
+
+
+# 全局单例
+reader = SnapshotReader(settings.LICENSE_SNAPSHOT_PATH)
+builder = SnapshotBuilder()
+
+snapshot_build_seconds = metrics.registry.register(metrics.Histogram(
+    "zentea_license_snapshot_build_seconds", "验证快照重建耗时（秒）",
+    buckets=(0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0),
+))
+metrics.register_gauge(
+    "zentea_license_snapshot_records", "当前映射的验证快照记录数",
+    lambda: reader.record_count if enabled() else None,
+)
+metrics.register_gauge(
+    "zentea_license_snapshot_age_seconds", "当前映射的验证快照距生成的时间（秒）",
+    lambda: reader.age_seconds if enabled() else None,
+)
@@ -0,0 +1,329 @@
+"""
+app.core 基础函数微基准
+覆盖各端点依赖的 CPU 密集型函数，并与提交在仓库中的基线（micro_baseline.json）对比，
+任一用例比基线慢超过容差即以非 0 退出码结束，便于在 CI 中发现性能回退。
+
+用法（在 backend 目录下执行）:
+    python -m benchmarks.micro                     # 运行并与基线对比
+    python -m benchmarks.micro --filter limiter    # 只运行名称包含 limiter 的用例
+    python -m benchmarks.micro --save-baseline     # 运行并覆盖基线
+    python -m benchmarks.micro --output result.json
+
+计时方法：每个用例先自动校准循环次数（单轮不少于 --min-time 秒），重复 --rounds 轮，
+取单次耗时的最小值作为对比依据（受调度抖动影响最小），同时记录中位数。
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "micro_baseline.json")
+
+# 登录限制器规模
+DEFAULT_LIMITER_SIZES = "10000,100000,1000000"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="app.core 基础函数微基准")
+    parser.add_argument("--filter", default=None, help="只运行名称包含该字符串的用例")
+    parser.add_argument("--rounds", type=int, default=5, help="重复轮数")
+    parser.add_argument("--min-time", type=float, default=0.2, help="单轮最短时长（秒）")
+    parser.add_argument("--limiter-sizes", default=DEFAULT_LIMITER_SIZES, help="登录限制器已跟踪键数量（逗号分隔）")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="基线文件路径")
+    parser.add_argument("--tolerance", type=float, default=0.30, help="允许比基线慢的比例（0.30 即 30%%）")
+    parser.add_argument("--save-baseline", action="store_true", help="将本次结果写入基线文件")
+    parser.add_argument("--output", default=None, help="结果 JSON 路径")
+    return parser.parse_args(argv)
+
+
+# ==================== 用例 ====================
+
+# 用例: (名称, setup)，setup 返回被测的无参函数
+Case = Tuple[str, Callable[[], Callable[[], object]]]
+
+
+def _security_cases() -> List[Case]:
+    from app.core.security import create_access_token, decode_token, get_password_hash, verify_password
+
+    def token_create():
+        return lambda: create_access_token({"sub": "42"})
+
+    def token_decode():
+        token = create_access_token({"sub": "42"})
+        return lambda: decode_token(token)
+
+    def token_decode_invalid():
+        token = create_access_token({"sub": "42"})[:-4] + "AAAA"
+        return lambda: decode_token(token)
+
+    def password_verify():
+        hashed = get_password_hash("correct horse battery staple")
+        return lambda: verify_password("correct horse battery staple", hashed)
+
+    return [
+        ("security.create_access_token", token_create),
+        ("security.decode_token", token_decode),
+        ("security.decode_token[invalid]", token_decode_invalid),
+        ("security.verify_password", password_verify),
+    ]
+
+
+def _limiter_cases(sizes: List[int]) -> List[Case]:
+    from app.core.login_limiter import LoginLimiter
+
+    def build(size: int) -> Tuple[LoginLimiter, List[Tuple[str, str]]]:
+        limiter = LoginLimiter()
+        now = time.time()
+        keys = [(f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}", f"user{i}") for i in range(size)]
+        limiter._attempts = {f"{ip}:{user}": (1, now, 0) for ip, user in keys}
+        return limiter, keys
+
+    def is_locked(size: int):
+        def setup():
+            limiter, keys = build(size)
+            state = {"i": 0}
+
+            def run():
+                ip, user = keys[state["i"] % size]
+                state["i"] += 7919
+                return limiter.is_locked(ip, user)
+            return run
+        return setup
+
+    def record_failure(size: int):
+        def setup():
+            limiter, keys = build(size)
+            state = {"i": 0}
+
+            def run():
+                ip, user = keys[state["i"] % size]
+                state["i"] += 7919
+                return limiter.record_failure(ip, user)
+            return run
+        return setup
+
+    cases = []
+    for size in sizes:
+        cases.append((f"login_limiter.is_locked[{size}]", is_locked(size)))
+        cases.append((f"login_limiter.record_failure[{size}]", record_failure(size)))
+    return cases
+
+
+def _misc_cases() -> List[Case]:
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+
+    from app.api.v1.endpoints.license import generate_machine_id
+    from app.core import binary_protocol
+    from app.core.binary_protocol import NegotiatedResponse
+    from app.core.config import Settings
+    from app.core.response import success
+
+    def machine_id():
+        info = {"cpu_id": "BFEBFBFF000906EA", "disk_serial": "S4EWNX0N123456", "mac_address": "00:1A:2B:3C:4D:5E"}
+        return lambda: generate_machine_id(info)
+
+    def cors_json():
+        s = Settings(BACKEND_CORS_ORIGINS='["http://localhost:3001", "http://127.0.0.1:3001", "http://localhost:3002"]')
+        return lambda: s.cors_origins
+
+    def cors_csv():
+        s = Settings(BACKEND_CORS_ORIGINS="http://localhost:3001, http://127.0.0.1:3001, http://localhost:3002")
+        return lambda: s.cors_origins
+
+    def envelope():
+        # 与 /license/verify 成功响应相同的结构，走 FastAPI 返回 dict 时的序列化路径
+        data = {
+            "valid": True,
+            "plan_type": "yearly",
+            "expire_date": "2026-12-31T23:59:59",
+            "remaining_days": 120,
+            "max_users": 10,
+        }
+        return lambda: JSONResponse(content=jsonable_encoder(success(data))).body
+
+    def envelope_binary(fmt: str):
+        def setup():
+            # 与 response.success[serialize] 相同的响应，协商为二进制格式（紧凑信封）
+            data = {
+                "valid": True,
+                "plan_type": "yearly",
+                "expire_date": "2026-12-31T23:59:59",
+                "remaining_days": 120,
+                "max_users": 10,
+            }
+
+            def run():
+                token = binary_protocol._response_format.set(fmt)
+                try:
+                    return NegotiatedResponse(content=jsonable_encoder(success(data))).body
+                finally:
+                    binary_protocol._response_format.reset(token)
+            return run
+        return setup
+
+    cases = [
+        ("license.generate_machine_id", machine_id),
+        ("config.cors_origins[json]", cors_json),
+        ("config.cors_origins[csv]", cors_csv),
+        ("response.success[serialize]", envelope),
+    ]
+    for fmt in sorted(binary_protocol.available_formats()):
+        cases.append((f"response.success[{fmt}]", envelope_binary(fmt)))
+    return cases
+
+
+def _lookup_cases() -> List[Case]:
+    """
+    /license/verify 的授权码查询：每次重建 select() 与模块级预构建语句（bindparam）的对比
+    使用内存 SQLite 同步会话，数据库耗时可忽略，差值即为每次请求节省的 Python CPU 时间
+    """
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+    from sqlmodel import SQLModel, select
+
+    from app.models.license import License
+    from app.models.user import User
+    from app.services.lookups import LICENSE_BY_KEY
+
+    license_key = "ZT-YEA-01M59G27JX1PPECRDRVZP2A"
+
+    def build_session() -> Session:
+        engine = create_engine("sqlite://")
+        SQLModel.metadata.create_all(engine, tables=[User.__table__, License.__table__])
+        session = Session(engine)
+        session.add(User(id=1, username="bench", email="bench@local", hashed_password="!"))
+        session.add(License(user_id=1, license_key=license_key, status="active", machine_id="m1"))
+        session.commit()
+        return session
+
+    def rebuilt_select():
+        session = build_session()
+        return lambda: session.execute(
+            select(License).where(License.license_key == license_key)
+        ).scalar_one_or_none()
+
+    def prebuilt():
+        session = build_session()
+        return lambda: session.execute(LICENSE_BY_KEY, {"license_key": license_key}).scalar_one_or_none()
+
+    return [
+        ("lookup.license_by_key[select]", rebuilt_select),
+        ("lookup.license_by_key[prebuilt]", prebuilt),
+    ]
+
+
+def collect_cases(args) -> List[Case]:
+    sizes = [int(s) for s in args.limiter_sizes.split(",") if s.strip()]
+    cases = _security_cases() + _limiter_cases(sizes) + _misc_cases() + _lookup_cases()
+    if args.filter:
+        cases = [c for c in cases if args.filter in c[0]]
+    return cases
+
+
+# ==================== 计时 ====================
+
+def _calibrate(func: Callable[[], object], min_time: float) -> int:
+    """确定单轮循环次数，使单轮耗时不少于 min_time"""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return number
+        # 按比例放大，至少翻倍
+        number = max(number * 2, int(number * min_time / max(elapsed, 1e-9) * 1.1))
+
+
+def measure(func: Callable[[], object], rounds: int, min_time: float) -> dict:
+    number = _calibrate(func, min_time)
+    per_op = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        per_op.append((time.perf_counter() - start) / number)
+    return {
+        "min_us": round(min(per_op) * 1e6, 4),
+        "median_us": round(statistics.median(per_op) * 1e6, 4),
+        "ops_per_sec": round(1 / min(per_op), 1),
+        "iterations": number,
+        "rounds": rounds,
+    }
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """返回回退的用例说明"""
+    regressions = []
+    for name, current in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        ratio = current["min_us"] / base["min_us"] if base["min_us"] else 1
+        current["baseline_min_us"] = base["min_us"]
+        current["ratio"] = round(ratio, 3)
+        if ratio > 1 + tolerance:
+            regressions.append(f"{name}: {base['min_us']}us -> {current['min_us']}us (x{ratio:.2f})")
+    return regressions
+
+
+def _load_baseline(path: str) -> Optional[dict]:
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    results: Dict[str, dict] = {}
+    for name, setup in collect_cases(args):
+        func = setup()
+        results[name] = measure(func, args.rounds, args.min_time)
+        r = results[name]
+        print(f"{name:<45} {r['min_us']:>14.3f} us  (median {r['median_us']:.3f} us, {r['ops_per_sec']:.0f} ops/s)")
+
+    meta = {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+    status = 0
+    baseline = _load_baseline(args.baseline)
+    if baseline and not args.save_baseline:
+        regressions = compare(results, baseline.get("results", {}), args.tolerance)
+        if regressions:
+            status = 1
+            print(f"\n性能回退（容差 {args.tolerance:.0%}，基线 {baseline.get('meta', {}).get('platform')}）:")
+            for line in regressions:
+                print(f"  {line}")
+        else:
+            print(f"\n与基线对比通过（容差 {args.tolerance:.0%}）")
+    elif not baseline and not args.save_baseline:
+        print(f"\n未找到基线文件 {args.baseline}，可使用 --save-baseline 生成")
+
+    report = {"meta": meta, "results": results}
+    if args.save_baseline:
+        merged = (baseline or {}).get("results", {}) if args.filter else {}
+        merged.update(results)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"meta": meta, "results": dict(sorted(merged.items()))}, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        print(f"\n基线已写入 {args.baseline}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return status
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    sys.exit(main())
@@ -0,0 +1,66 @@
+"""
+测试公共配置
+导入应用前指定临时 SQLite 数据库和本地测试支付网关密钥；应用在同一个事件循环中只启动一次（lifespan），
+后台支付通知任务停止后由用例直接调用 payment_queue.process_pending() 处理通知。
+
+运行（在 backend 目录下执行）:
+    python -m pytest tests
+"""
+import asyncio
+import os
+import shutil
+import tempfile
+from types import SimpleNamespace
+
+import pytest
+
+_tmpdir = tempfile.mkdtemp(prefix="zentea-test-")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{_tmpdir}/test.db"
+os.environ["PAYMENT_STUB_SECRET"] = "test-stub-secret"
+os.environ["ADMIN_USERNAME"] = "admin"
+os.environ["ADMIN_PASSWORD"] = "admin123"
+os.environ.pop("LICENSE_SNAPSHOT_PATH", None)
+
+import httpx  # noqa: E402
+
+from app.core.database import engine  # noqa: E402
+from app.main import app, lifespan  # noqa: E402
+from app.services.payment_notifications import payment_queue  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def run():
+    """在测试共用的事件循环中执行协程（数据库连接池、SQLite 写锁等都绑定在该循环上）"""
+    loop = asyncio.new_event_loop()
+    yield loop.run_until_complete
+    loop.close()
+    shutil.rmtree(_tmpdir, ignore_errors=True)
+
+
+@pytest.fixture(scope="session")
+def api(run):
+    """已启动的应用、HTTP 客户端及管理员/普通用户的认证头"""
+    context = lifespan(app)
+
+    async def start():
+        await context.__aenter__()
+        # 停止后台写入与处理任务：submit() 直接写入，通知只在用例调用 process_pending() 时处理
+        await payment_queue.stop()
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+        r = await client.post("/api/v1/auth/login", data={"username": "admin", "password": "admin123"})
+        admin = {"Authorization": f"Bearer {r.json()['data']['access_token']}"}
+        await client.post("/api/v1/portal/register", json={
+            "username": "buyer", "email": "buyer@example.com", "password": "buyer-password",
+        })
+        r = await client.post("/api/v1/auth/login", data={"username": "buyer", "password": "buyer-password"})
+        user = {"Authorization": f"Bearer {r.json()['data']['access_token']}"}
+        return SimpleNamespace(client=client, admin=admin, user=user)
+
+    async def stop(ns):
+        await ns.client.aclose()
+        await context.__aexit__(None, None, None)
+        await engine.dispose()
+
+    ns = run(start())
+    yield ns
+    run(stop(ns))
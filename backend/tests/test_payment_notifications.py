@@ -0,0 +1,162 @@
+"""
+支付通知端到端测试：POST /payments/notify/stub 写入通知，payment_queue.process_pending() 完成订单（SQLite）
+"""
+import asyncio
+
+from sqlmodel import func, select
+
+from app.core.config import settings
+from app.core.database import async_session
+from app.models.license import License
+from app.models.order import Order
+from app.models.payment import PaymentNotification
+from app.services import payment_notifications
+from app.services.payment_gateways import StubGateway
+from app.services.payment_notifications import payment_queue
+
+NOTIFY_URL = "/api/v1/payments/notify/stub"
+
+
+async def _create_order(api) -> dict:
+    r = await api.client.post("/api/v1/orders/create", json={"plan_type": "monthly"}, headers=api.user)
+    assert r.json()["code"] == 200, r.json()
+    return r.json()["data"]
+
+
+async def _notify(api, params: dict) -> str:
+    r = await api.client.post(NOTIFY_URL, json=params)
+    assert r.status_code == 200
+    return r.json()["code"]
+
+
+async def _notifications(txn_id: str) -> list:
+    async with async_session() as session:
+        result = await session.execute(select(PaymentNotification).where(PaymentNotification.txn_id == txn_id))
+        return result.scalars().all()
+
+
+async def _order(order_id: int) -> Order:
+    async with async_session() as session:
+        return await session.get(Order, order_id)
+
+
+async def _license_count() -> int:
+    async with async_session() as session:
+        return (await session.execute(select(func.count()).select_from(License))).scalar_one()
+
+
+def test_duplicate_notifications_complete_order_once(api, run):
+    async def scenario():
+        order = await _create_order(api)
+        licenses = await _license_count()
+        params = StubGateway.build_notification(order["order_no"], order["amount"], txn_id="DUP-1")
+
+        # 同一时刻的重试风暴、其他 worker 收到的重复通知（本进程未记住该交易号）都只保存一行
+        codes = await asyncio.gather(*[_notify(api, params) for _ in range(20)])
+        payment_queue._recent.clear()
+        codes.append(await _notify(api, params))
+        assert set(codes) == {"SUCCESS"}
+        assert len(await _notifications("DUP-1")) == 1
+
+        assert await payment_queue.process_pending() == 1
+        paid = await _order(order["order_id"])
+        assert paid.status == "paid"
+        assert (paid.payment_method, paid.payment_txn_id) == ("stub", "DUP-1")
+        assert await _license_count() == licenses + 1
+
+        # 订单完成后的重复通知：应答成功，不再生成授权
+        assert await _notify(api, params) == "SUCCESS"
+        assert await payment_queue.process_pending() == 0
+        [notification] = await _notifications("DUP-1")
+        assert notification.status == "processed"
+        assert await _license_count() == licenses + 1
+
+    run(scenario())
+
+
+def test_amount_mismatch_marks_notification_failed(api, run):
+    async def scenario():
+        order = await _create_order(api)
+        params = StubGateway.build_notification(order["order_no"], "0.01", txn_id="AMOUNT-1")
+        assert await _notify(api, params) == "SUCCESS"
+
+        assert await payment_queue.process_pending() == 1
+        [notification] = await _notifications("AMOUNT-1")
+        assert notification.status == "failed"
+        assert "金额不符" in notification.error
+        assert notification.processed_at is not None
+        assert (await _order(order["order_id"])).status == "pending"
+
+    run(scenario())
+
+
+def test_tampered_notification_is_rejected(api, run):
+    async def scenario():
+        order = await _create_order(api)
+        params = StubGateway.build_notification(order["order_no"], order["amount"], txn_id="SIGN-1")
+        params["amount"] = "0.01"
+        assert await _notify(api, params) == "FAIL"
+        assert await _notifications("SIGN-1") == []
+
+    run(scenario())
+
+
+def test_notify_races_admin_approve(api, run):
+    async def scenario():
+        order = await _create_order(api)
+        licenses = await _license_count()
+        params = StubGateway.build_notification(order["order_no"], order["amount"], txn_id="RACE-1")
+        assert await _notify(api, params) == "SUCCESS"
+
+        # 通知处理与管理员审核同时锁定订单行（with_for_update），只有一方完成订单
+        processed, approve = await asyncio.gather(
+            payment_queue.process_pending(),
+            api.client.post(f"/api/v1/orders/admin/{order['order_id']}/approve", headers=api.admin),
+        )
+        assert processed == 1
+        [notification] = await _notifications("RACE-1")
+        paid = await _order(order["order_id"])
+        assert paid.status == "paid"
+        assert await _license_count() == licenses + 1
+        if approve.json()["code"] == 200:
+            assert notification.status == "failed"
+            assert "订单已支付" in notification.error
+            assert paid.payment_txn_id is None
+        else:
+            assert notification.status == "processed"
+            assert paid.payment_txn_id == "RACE-1"
+
+    run(scenario())
+
+
+def test_failed_processing_retries_until_max_attempts(api, run, monkeypatch):
+    async def broken(*args, **kwargs):
+        raise RuntimeError("数据库暂时不可用")
+
+    monkeypatch.setattr(payment_notifications, "complete_order_internal", broken)
+    monkeypatch.setattr(settings, "PAYMENT_WORKER_MAX_ATTEMPTS", 3)
+
+    async def scenario():
+        order = await _create_order(api)
+        params = StubGateway.build_notification(order["order_no"], order["amount"], txn_id="RETRY-1")
+        assert await _notify(api, params) == "SUCCESS"
+
+        for attempt in range(1, 4):
+            assert await payment_queue.process_pending() == 1
+            [notification] = await _notifications("RETRY-1")
+            assert notification.attempts == attempt
+            assert "RuntimeError" in notification.error
+            assert notification.status == ("failed" if attempt == 3 else "pending")
+        assert await payment_queue.process_pending() == 0
+        assert (await _order(order["order_id"])).status == "pending"
+
+        # 故障排除后由管理员重新处理
+        monkeypatch.undo()
+        r = await api.client.post(f"/api/v1/payments/admin/notifications/{notification.id}/retry", headers=api.admin)
+        assert r.json()["code"] == 200
+        assert await payment_queue.process_pending() == 1
+        [notification] = await _notifications("RETRY-1")
+        assert notification.status == "processed"
+        assert (await _order(order["order_id"])).status == "paid"
+
+    run(scenario())
@@ -193,6 +193,8 @@ server {
 
     location / {
         proxy_pass http://127.0.0.1:8001;
+        # 支付凭证上传（后端限制 PROOF_MAX_BYTES，默认 10MB）
+        client_max_body_size 12m;
         proxy_http_version 1.1;
         proxy_set_header Upgrade \$http_upgrade;
         proxy_set_header Connection 'upgrade';
@@ -225,6 +227,8 @@ server {
             return 404;
         }
         proxy_pass http://127.0.0.1:8001;
+        # 支付凭证上传（后端限制 PROOF_MAX_BYTES，默认 10MB）
+        client_max_body_size 12m;
         proxy_http_version 1.1;
         proxy_set_header Host \$host;
         proxy_set_header X-Real-IP \$remote_addr;
@@ -252,6 +256,8 @@ server {
             return 404;
         }
         proxy_pass http://127.0.0.1:8001;
+        # 支付凭证上传（后端限制 PROOF_MAX_BYTES，默认 10MB）
+        client_max_body_size 12m;
         proxy_http_version 1.1;
         proxy_set_header Host \$host;
         proxy_set_header X-Real-IP \$remote_addr;
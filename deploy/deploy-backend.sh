@@ -55,6 +55,9 @@ services:
       DATABASE_URL: postgresql+asyncpg://${POSTGRES_USER}:${POSTGRES_PASSWORD}@db:5432/${POSTGRES_DB}
       SECRET_KEY: ${SECRET_KEY}
       LICENSE_SERVER_URL: https://${DOMAIN_API}
+    volumes:
+      # 支付凭证（PROOF_STORAGE_DIR）
+      - proof_data:/app/data/proofs
     ports:
       - "0.0.0.0:8001:8001"
     depends_on:
@@ -63,6 +66,7 @@ services:
 
 volumes:
   postgres_data:
+  proof_data:
 EOF
 
 # 构建并启动
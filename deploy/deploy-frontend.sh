@@ -76,6 +76,8 @@ server {
 
     location /api {
         proxy_pass ${BACKEND_SERVER};
+        # 支付凭证上传（后端限制 PROOF_MAX_BYTES，默认 10MB）
+        client_max_body_size 12m;
         proxy_http_version 1.1;
         proxy_set_header Host \$host;
         proxy_set_header X-Real-IP \$remote_addr;
@@ -100,6 +102,8 @@ server {
 
     location /api {
         proxy_pass ${BACKEND_SERVER};
+        # 支付凭证上传（后端限制 PROOF_MAX_BYTES，默认 10MB）
+        client_max_body_size 12m;
         proxy_http_version 1.1;
         proxy_set_header Host \$host;
         proxy_set_header X-Real-IP \$remote_addr;
@@ -126,6 +126,8 @@ server {
 
     location / {
         proxy_pass http://127.0.0.1:8001;
+        # 支付凭证上传（后端限制 PROOF_MAX_BYTES，默认 10MB）
+        client_max_body_size 12m;
         proxy_http_version 1.1;
         proxy_set_header Upgrade \$http_upgrade;
         proxy_set_header Connection 'upgrade';
@@ -158,6 +160,8 @@ server {
             return 404;
         }
         proxy_pass http://127.0.0.1:8001;
+        # 支付凭证上传（后端限制 PROOF_MAX_BYTES，默认 10MB）
+        client_max_body_size 12m;
         proxy_http_version 1.1;
         proxy_set_header Host \$host;
         proxy_set_header X-Real-IP \$remote_addr;
@@ -185,6 +189,8 @@ server {
             return 404;
         }
         proxy_pass http://127.0.0.1:8001;
+        # 支付凭证上传（后端限制 PROOF_MAX_BYTES，默认 10MB）
+        client_max_body_size 12m;
         proxy_http_version 1.1;
         proxy_set_header Host \$host;
         proxy_set_header X-Real-IP \$remote_addr;
@@ -37,8 +37,11 @@ export const portalApi = {
   // 获取我的订单
   getMyOrders: () => request.get('/orders/my'),
   // 上传支付凭证
-  uploadPaymentProof: (orderId: number, proofUrl: string) =>
-    request.post(`/orders/${orderId}/upload-proof?proof_url=${encodeURIComponent(proofUrl)}`),
+  uploadPaymentProof: (orderId: number, file: File) => {
+    const formData = new FormData()
+    formData.append('file', file)
+    return request.post(`/orders/${orderId}/upload-proof`, formData)
+  },
 }
 
 // 促销